@@ -9,13 +9,22 @@ def main():
     ap.add_argument('-n', '--nodes', help='Input node file path (JSONL)', required=True)
     ap.add_argument('-e', '--edges', help='Input edge file path (JSONL)', required=True)
     ap.add_argument('-o', '--outdir', help='Output directory', required=False)
+    ap.add_argument('--no-binary-links', help='Only write links.txt, not the binary links.bin',
+                    action='store_true')
+    ap.add_argument('--no-link-partitions', help='Do not write the per-predicate link partitions',
+                    action='store_true')
+    ap.add_argument('--legacy-count-keys', help='Only write backlinks.txt, not the compact backlinks.bin',
+                    action='store_true')
 
     args = vars(ap.parse_args())
 
     generate_ac_files(
         input_node_file=args['nodes'],
         input_edge_file=args['edges'],
-        output_dir=args['outdir']
+        output_dir=args['outdir'],
+        binary_links=not args['no_binary_links'],
+        compact_count_keys=not args['legacy_count_keys'],
+        link_partitions=not args['no_link_partitions']
     )
 
 
@@ -517,6 +517,8 @@ class InferenceParams:
     pvalue_threshold: float | None = 1e-5
     max_rules: int | None = 100
     max_results: int | None = 2000
+    # "poisson", "binom" or "hypergeom"; None leaves each coalescer with its own default
+    scoring_engine: str | None = None
 
     @classmethod
     def from_message(cls, in_message: dict) -> 'InferenceParams':
@@ -529,5 +531,6 @@ class InferenceParams:
             node_constraints=params.get('node_constraints', None),
             pvalue_threshold=params.get('pvalue_threshold', 1e-5),
             max_rules=params.get('max_rules', None),
-            max_results=params.get('max_results', None)
+            max_results=params.get('max_results', None),
+            scoring_engine=params.get('scoring_engine', None)
         )
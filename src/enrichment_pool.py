@@ -0,0 +1,93 @@
+"""Where the CPU-bound enrichment stages run.
+
+The grouping, scoring and hierarchy filtering of coalesce_by_graph, and the scoring of coalesce_by_property, are
+pure python and numpy.  By default they run in a worker thread, which keeps them off the event loop but not off the
+GIL, so a large enrichment slows down every other request in the process.  With the "process" executor they run in a
+pool of worker processes instead, and spread across the cores of the host.
+
+Work sent to the pool goes as string tables and integer arrays (see graph_coalescer.pack_enrichment_inputs and
+property_coalescer.pack_enriched_properties) rather than as pickled dicts of lists, and comes back the same way.
+
+Each worker process has its own p-value cache; set pvalue_cache_shared_name to have them share one.
+
+Configuration (config.json, all optional):
+    enrichment_executor: "thread" or "process"
+    enrichment_processes: the number of worker processes, 0 for one per core
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import numpy as np
+from src.graph_coalescence.redis_pool import load_config
+
+ENRICHMENT_EXECUTORS = ('thread', 'process')
+DEFAULT_EXECUTOR = 'thread'
+
+_pool = None
+_pool_configured = False
+_pool_lock = threading.Lock()
+
+
+def _warm_worker():
+    # Loading the biolink model and the predicate tables takes a while, so do it before the first request arrives
+    import src.graph_coalescence.graph_coalescer  # noqa: F401
+    import src.property_coalescence.property_coalescer  # noqa: F401
+
+
+def create_enrichment_pool(conf):
+    """A ProcessPoolExecutor for the "process" executor, None for "thread"."""
+    executor = conf.get('enrichment_executor', DEFAULT_EXECUTOR)
+    if executor == 'thread':
+        return None
+    if executor != 'process':
+        raise ValueError(f'Unknown enrichment executor {executor}; use one of {", ".join(ENRICHMENT_EXECUTORS)}')
+    processes = int(conf.get('enrichment_processes', 0)) or os.cpu_count() or 1
+    # The server has threads (redis, asyncio.to_thread) running, so don't fork it
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                               initializer=_warm_worker)
+
+
+def get_enrichment_pool():
+    """The process pool, or None when the enrichment stages run in threads."""
+    global _pool, _pool_configured
+    if not _pool_configured:
+        with _pool_lock:
+            if not _pool_configured:
+                _pool = create_enrichment_pool(load_config())
+                _pool_configured = True
+    return _pool
+
+
+def set_enrichment_pool(pool):
+    """Use pool for this process (None for threads), e.g. in a test.  The previous pool is shut down."""
+    global _pool, _pool_configured
+    with _pool_lock:
+        if _pool is not None and _pool is not pool:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = pool
+        _pool_configured = True
+
+
+async def run_in_pool(func, *args):
+    """func(*args) in the process pool, which must be configured."""
+    return await asyncio.get_running_loop().run_in_executor(get_enrichment_pool(), func, *args)
+
+
+def pack_node_sets(node_sets, node_index):
+    """Sets of input nodes as (offsets, members): the positions in node_index of the nodes of set i, in order, are
+    members[offsets[i]:offsets[i + 1]]."""
+    members = [sorted(map(node_index.__getitem__, node_set)) for node_set in node_sets]
+    offsets = np.zeros(len(members) + 1, dtype=np.int64)
+    np.cumsum([len(m) for m in members], out=offsets[1:])
+    return offsets, np.fromiter(chain.from_iterable(members), dtype=np.int32, count=int(offsets[-1]))
+
+
+def unpack_node_sets(node_list, offsets, members):
+    """The frozensets packed by pack_node_sets.  They are built in input order, as the coalescers build them, so they
+    iterate in the same order too."""
+    offsets = offsets.tolist()
+    return [frozenset(map(node_list.__getitem__, members[start:end].tolist()))
+            for start, end in zip(offsets, offsets[1:])]
@@ -0,0 +1,160 @@
+"""Enrichment p-values for whole batches of (x, n) pairs, shared by the graph and property coalescers.
+
+An enrichment draws ndraws nodes (the input set) from total_node_count nodes, n of which have some property (a link to
+the enriched node, or a chemical property).  x of the drawn nodes have it, and the p-value is P(X >= x).
+
+The correct distribution for X is the hypergeometric.  The binomial and then the poisson approximate it, each a bit
+less well (https://riskwiki.vosesoftware.com/ApproximationstotheHypergeometricdistribution.php), and the graph
+coalescer has used the poisson because scipy's hypergeom.sf is far slower.  Here the engine is a parameter, and
+every pair is scored at once with the engine's scipy.stats sf, which takes whole arrays for all three.
+
+Those p-values run into the bottom of the float range, and enrichments beyond it would all come back as 0.  So
+alongside the p-values there are their logs: for the p-values below SERIES_BELOW the tail is summed in log space,
+starting from the log pmf at x (log factorials from a precomputed table) and stepping with the ratio between
+consecutive pmf terms.  Enrichments only get scored when x is at least the expected count, so the terms fall off
+quickly.  Pairs that haven't converged after MAX_TERMS terms, or that fall outside the support, go to scipy's logsf.
+
+The p-values are always the ones scipy gives; the logs only break their ties, keeping tiny p-values apart: log_sf of
+two enrichments far beyond 1e-308 still orders them even though both come back from pvalues as 0.
+"""
+import threading
+import numpy as np
+from scipy.special import gammaln
+from scipy.stats import binom, hypergeom, poisson
+
+SCORING_ENGINES = ('poisson', 'binom', 'hypergeom')
+# Past this many entries (16 MB), log factorials are computed with gammaln instead of looked up
+LOG_FACTORIAL_TABLE_MAX = 1 << 21
+MAX_TERMS = 1024
+FIRST_TERM_BLOCK = 4
+MAX_TERM_BLOCK = 64
+# p-values above this are scipy's, with their logs; below it, the logs come from the log space sum
+SERIES_BELOW = 1e-280
+# Stop summing a pair's tail when the next term changes the sum by less than this
+TAIL_EPSILON = 1e-17
+
+_log_factorials = gammaln(np.arange(1, 1025, dtype=np.float64))
+_table_lock = threading.Lock()
+
+
+def log_factorial(k):
+    """log(k!) for an integer array k >= 0."""
+    global _log_factorials
+    k = np.asarray(k, dtype=np.int64)
+    if k.size == 0:
+        return np.zeros(k.shape)
+    kmax = int(k.max())
+    if kmax >= len(_log_factorials) and kmax < LOG_FACTORIAL_TABLE_MAX:
+        with _table_lock:
+            if kmax >= len(_log_factorials):
+                size = min(max(kmax + 1, 2 * len(_log_factorials)), LOG_FACTORIAL_TABLE_MAX)
+                _log_factorials = gammaln(np.arange(1, size + 1, dtype=np.float64))
+    table = _log_factorials
+    if kmax < len(table):
+        return table[k]
+    return gammaln(k + 1.0)
+
+
+def log_comb(a, b):
+    """log(a choose b), -inf where b < 0 or b > a."""
+    a, b = np.broadcast_arrays(np.asarray(a, dtype=np.int64), np.asarray(b, dtype=np.int64))
+    valid = (b >= 0) & (b <= a)
+    a_ok = np.where(valid, a, 0)
+    b_ok = np.where(valid, b, 0)
+    result = log_factorial(a_ok) - log_factorial(b_ok) - log_factorial(a_ok - b_ok)
+    return np.where(valid, result, -np.inf)
+
+
+def _log_pmf_and_ratio(engine, x, n, ndraws, total_node_count):
+    """The log pmf at x, a function giving pmf(k + 1) / pmf(k), and the largest k in the support.  The hypergeometric
+    is the default."""
+    if engine == 'poisson':
+        mu = n * ndraws / total_node_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_pmf = x * np.log(mu) - mu - log_factorial(x)
+        return log_pmf, lambda k, i: mu[i] / (k + 1), np.full(len(x), np.iinfo(np.int64).max)
+    if engine == 'binom':
+        p = n / total_node_count
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_pmf = log_comb(ndraws, x) + x * np.log(p) + (ndraws - x) * np.log1p(-p)
+            odds = p / (1 - p)
+        return log_pmf, lambda k, i: (ndraws - k) / (k + 1) * odds[i], np.full(len(x), ndraws)
+    log_pmf = log_comb(n, x) + log_comb(total_node_count - n, ndraws - x) - log_comb(total_node_count, ndraws)
+    return (log_pmf,
+            lambda k, i: (n[i] - k) * (ndraws - k) / ((k + 1) * (total_node_count - n[i] - ndraws + k + 1)),
+            np.minimum(n, ndraws))
+
+
+def _scipy_log_sf(engine, x, n, ndraws, total_node_count):
+    if engine == 'poisson':
+        return poisson.logsf(x - 1, n * ndraws / total_node_count)
+    if engine == 'binom':
+        return binom.logsf(x - 1, ndraws, n / total_node_count)
+    return hypergeom.logsf(x - 1, total_node_count, n, ndraws)
+
+
+def _scipy_sf(engine, x, n, ndraws, total_node_count):
+    if engine == 'poisson':
+        return poisson.sf(x - 1, n * ndraws / total_node_count)
+    if engine == 'binom':
+        return binom.sf(x - 1, ndraws, n / total_node_count)
+    return hypergeom.sf(x - 1, total_node_count, n, ndraws)
+
+
+def _series_log_sf(engine, x, n, ndraws, total_node_count):
+    log_pmf, ratio, kmax = _log_pmf_and_ratio(engine, x, n, ndraws, total_node_count)
+    # The tail relative to its first term: 1 + r(x) + r(x) r(x + 1) + ..., summed a block of terms at a time.  Most
+    # pairs are done after the first small block; the blocks grow for the few that are close to their expected count.
+    tail = np.ones(len(x))
+    term = np.ones(len(x))
+    k = x.astype(np.float64)
+    active = np.flatnonzero(np.isfinite(log_pmf) & (x < kmax))
+    block = FIRST_TERM_BLOCK
+    summed = 0
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        while len(active) > 0 and summed < MAX_TERMS:
+            ks = k[active, None] + np.arange(block, dtype=np.float64)
+            # Past the end of the support the ratio goes through 0 and then negative; the 0 ends the products
+            terms = term[active, None] * np.cumprod(np.maximum(ratio(ks, active[:, None]), 0), axis=1)
+            tail[active] += terms.sum(axis=1)
+            term[active] = terms[:, -1]
+            k[active] += block
+            summed += block
+            block = min(2 * block, MAX_TERM_BLOCK)
+            active = active[(term[active] > TAIL_EPSILON * tail[active]) & (k[active] < kmax[active])]
+        result = log_pmf + np.log(tail)
+    redo = ~np.isfinite(result)
+    redo[active] = True
+    if redo.any():
+        result[redo] = _scipy_log_sf(engine, x[redo], n[redo], ndraws, total_node_count)
+    return result
+
+
+def sf_and_log_sf(x, n, ndraws, total_node_count, engine='poisson'):
+    """P(X >= x) and its log for each pair of x (draws with the property) and n (nodes with the property), as two
+    arrays.  The p-values are scipy's; the logs go on past the bottom of the float range."""
+    x = np.asarray(x, dtype=np.int64)
+    n = np.asarray(n, dtype=np.int64)
+    if engine not in SCORING_ENGINES:
+        raise ValueError(f'Unknown scoring engine {engine}; use one of {", ".join(SCORING_ENGINES)}')
+    sf = np.ones(len(x))
+    log = np.zeros(len(x))
+    scored = np.flatnonzero(x > 0)
+    sf[scored] = _scipy_sf(engine, x[scored], n[scored], ndraws, total_node_count)
+    # scipy is accurate until it runs into the bottom of the float range, where the logs come from the series
+    series = scored[sf[scored] <= SERIES_BELOW]
+    direct = scored[sf[scored] > SERIES_BELOW]
+    log[direct] = np.log(sf[direct])
+    if len(series) > 0:
+        log[series] = _series_log_sf(engine, x[series], n[series], ndraws, total_node_count)
+    return sf, log
+
+
+def log_sf(x, n, ndraws, total_node_count, engine='poisson'):
+    """log P(X >= x) for each pair, as an array; see sf_and_log_sf."""
+    return sf_and_log_sf(x, n, ndraws, total_node_count, engine)[1]
+
+
+def pvalues(x, n, ndraws, total_node_count, engine='poisson'):
+    """P(X >= x) for each pair, as an array; see sf_and_log_sf."""
+    return sf_and_log_sf(x, n, ndraws, total_node_count, engine)[0]
@@ -0,0 +1,128 @@
+"""What the coalescers need from the biolink model, precomputed.
+
+Building a bmt Toolkit and walking the model for every predicate and category takes about a second, which every
+worker process paid at startup.  biolink_closure.json holds the results instead:
+
+    predicates  for each predicate under biolink:related_to, [symmetric, ancestors, children], in bmt order
+    categories  the descendants of biolink:NamedThing, in bmt order, each with its ancestors
+    enums       for each enumeration, the permissible values that have children, with their children
+
+It is written by
+
+    python -m src.graph_coalescence.biolink_closure
+
+whenever bmt is upgraded, and records the bmt version it came from.  If the file is missing, or was written by a
+different bmt, the closure is built from the toolkit instead, as before.  Predicates outside the closure are looked
+up in the toolkit (see predicates.PredicateRegistry), which is only built if one shows up.
+"""
+import importlib.metadata
+import os
+import sys
+import threading
+import orjson
+
+CLOSURE_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'biolink_closure.json')
+FORMAT_VERSION = 1
+ROOT_PREDICATE = 'biolink:related_to'
+ROOT_CATEGORY = 'biolink:NamedThing'
+
+_toolkit = None
+_toolkit_lock = threading.Lock()
+
+
+def get_toolkit():
+    """The process's bmt Toolkit.  Loading the biolink model is slow, so everything shares one."""
+    global _toolkit
+    if _toolkit is None:
+        with _toolkit_lock:
+            if _toolkit is None:
+                import bmt
+                _toolkit = bmt.Toolkit()
+    return _toolkit
+
+
+def bmt_version():
+    return importlib.metadata.version('bmt')
+
+
+class BiolinkClosure:
+    def __init__(self, predicates, categories, enums, source='file'):
+        # predicate -> (symmetric, ancestors, children)
+        self.predicates = {predicate: (symmetric, tuple(ancestors), tuple(children))
+                           for predicate, (symmetric, ancestors, children) in predicates.items()}
+        # category -> ancestors, in bmt order
+        self.categories = {category: tuple(ancestors) for category, ancestors in categories.items()}
+        # enum -> {permissible value: its children}
+        self.enums = {enum: {value: frozenset(children) for value, children in values.items()}
+                      for enum, values in enums.items()}
+        # 'file' or 'toolkit'
+        self.source = source
+
+    @classmethod
+    def from_toolkit(cls, tk):
+        predicates = {}
+        for predicate in tk.get_descendants(ROOT_PREDICATE, formatted=True) or []:
+            element = tk.get_element(predicate)
+            predicates[predicate] = (element is not None and element['symmetric'] is True,
+                                     tk.get_ancestors(predicate, formatted=True, reflexive=False) or [],
+                                     tk.get_children(predicate, formatted=True) or [])
+        categories = {category: tk.get_ancestors(category, formatted=True) or []
+                      for category in tk.get_descendants(ROOT_CATEGORY, formatted=True) or []}
+        enums = {}
+        for enum, definition in tk.view.all_enums().items():
+            values = {}
+            for value in definition.permissible_values or {}:
+                children = tk.get_permissible_value_children(value, enum)
+                if children:
+                    values[value] = sorted(children)
+            if values:
+                enums[enum] = values
+        return cls(predicates, categories, enums, source='toolkit')
+
+    @classmethod
+    def from_file(cls, path):
+        """The closure in path, or None if there is none or it isn't for the installed bmt."""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as inf:
+            data = orjson.loads(inf.read())
+        if data.get('format_version') != FORMAT_VERSION or data.get('bmt_version') != bmt_version():
+            return None
+        return cls(data['predicates'], data['categories'], data['enums'])
+
+    def to_json(self, biolink_version):
+        return orjson.dumps({'format_version': FORMAT_VERSION,
+                             'bmt_version': bmt_version(),
+                             'biolink_version': biolink_version,
+                             'predicates': {p: [s, list(a), list(c)] for p, (s, a, c) in self.predicates.items()},
+                             'categories': {c: list(a) for c, a in self.categories.items()},
+                             'enums': {e: {v: sorted(c) for v, c in values.items()} for e, values in self.enums.items()}})
+
+    def permissible_value_children(self, value, enum):
+        return self.enums.get(enum, {}).get(value, frozenset())
+
+
+def write_closure(path=CLOSURE_FILE):
+    tk = get_toolkit()
+    with open(path, 'wb') as outf:
+        outf.write(BiolinkClosure.from_toolkit(tk).to_json(tk.get_model_version()))
+
+
+_closure = None
+_closure_lock = threading.Lock()
+
+
+def get_biolink_closure():
+    global _closure
+    if _closure is None:
+        with _closure_lock:
+            if _closure is None:
+                closure = BiolinkClosure.from_file(CLOSURE_FILE)
+                if closure is None:
+                    closure = BiolinkClosure.from_toolkit(get_toolkit())
+                _closure = closure
+    return _closure
+
+
+if __name__ == '__main__':
+    write_closure(sys.argv[1] if len(sys.argv) > 1 else CLOSURE_FILE)
@@ -6,6 +6,10 @@ import orjson
 import gzip
 import requests
 import bmt
+from src.graph_coalescence import link_codec
+from src.graph_coalescence.count_keys import CountKeyBuilder
+from src.graph_coalescence.graph_data import link_partition_key
+from src.graph_coalescence.hubs import DEGREE_INDEX_FILE, DEGREE_INDEX_MIN_DEGREE
 
 try:
     from tqdm import tqdm
@@ -79,6 +83,11 @@ def get_filter_nodes():
     return set(blocklist)
 
 
+def node_metadata_record(categories, name):
+    """The db 6 value for a node: its labels and name, as they are written to nodelabels.txt and nodenames.txt."""
+    return orjson.dumps({'c': list(categories), 'n': f'{name}'}).decode()
+
+
 def quick_jsonl_file_iterator(json_file, is_gzip=False):
     with gzip.open(json_file, 'rt') if is_gzip \
             else open(json_file, 'r', encoding='utf-8') as fp:
@@ -86,7 +95,103 @@ def quick_jsonl_file_iterator(json_file, is_gzip=False):
             yield orjson.loads(line)
 
 
-def generate_ac_files(input_node_file, input_edge_file, output_dir):
+def link_dictionaries(nodes_to_links):
+    """The link_codec (node ids, predicate ids, dictionary id) for a build."""
+    node_ids = {node: i for i, node in enumerate(nodes_to_links)}
+    predicate_ids = {}
+    for links in nodes_to_links.values():
+        for link in links:
+            if link[1] not in predicate_ids:
+                predicate_ids[link[1]] = len(predicate_ids)
+    return node_ids, predicate_ids, link_codec.dictionary_id(node_ids, predicate_ids)
+
+
+def write_binary_links(nodes_to_links, output_dir):
+    """Write the links in the link_codec binary format: links.bin holds the encoded values, and
+    linkdict_nodes.txt / linkdict_predicates.txt / linkdict_id.txt the dictionaries they refer to."""
+    node_ids, predicate_ids, dict_id = link_dictionaries(nodes_to_links)
+    with open(os.path.join(output_dir, 'linkdict_nodes.txt'), 'w') as outf:
+        for node in node_ids:
+            outf.write(f'{node}\n')
+    with open(os.path.join(output_dir, 'linkdict_predicates.txt'), 'w') as outf:
+        for predicate in predicate_ids:
+            outf.write(f'{predicate}\n')
+    with open(os.path.join(output_dir, 'linkdict_id.txt'), 'w') as outf:
+        outf.write(f'{dict_id}\n')
+    with open(os.path.join(output_dir, 'links.bin'), 'wb') as outf:
+        for node, links in nodes_to_links.items():
+            link_codec.write_record(outf, node, link_codec.encode_links(links, node_ids, predicate_ids, dict_id))
+
+
+def partition_links(links):
+    """Split a node's links into {(bare predicate, node_is_source): the positions of its links}, in order."""
+    partitions = defaultdict(list)
+    bare_predicates = {}
+    for position, link in enumerate(links):
+        bare = bare_predicates.get(link[1])
+        if bare is None:
+            bare = bare_predicates[link[1]] = orjson.loads(link[1]).get('predicate', '')
+        partitions[(bare, link[2])].append(position)
+    return partitions
+
+
+def json_link_partition(links, positions):
+    """The linkparts.txt value of the links at positions: they go with their positions, so that the links of several
+    partitions can be put back in the order of the node's whole list."""
+    return json.dumps({"p": positions, "l": [links[i] for i in positions]})
+
+
+def write_link_partitions(nodes_to_links, output_dir, binary_links=True):
+    """Write each node's links again, split by bare predicate and direction, for lookups that only want one
+    predicate (see graph_data.link_partition_key).  With binary_links the values use the links.bin dictionaries and
+    go to linkparts.bin, otherwise they are json in linkparts.txt.  Either way each link goes with its position in the
+    node's whole list."""
+    if binary_links:
+        node_ids, predicate_ids, dict_id = link_dictionaries(nodes_to_links)
+        with open(os.path.join(output_dir, 'linkparts.bin'), 'wb') as outf:
+            for node, links in nodes_to_links.items():
+                for (bare, node_is_source), positions in partition_links(links).items():
+                    value = link_codec.encode_links([links[i] for i in positions], node_ids, predicate_ids, dict_id)
+                    link_codec.write_record(outf, link_partition_key(node, bare, node_is_source),
+                                            link_codec.encode_partition(positions, value))
+    else:
+        with open(os.path.join(output_dir, 'linkparts.txt'), 'w') as outf:
+            for node, links in nodes_to_links.items():
+                for (bare, node_is_source), positions in partition_links(links).items():
+                    outf.write(f'{link_partition_key(node, bare, node_is_source)}\t'
+                               f'{json_link_partition(links, positions)}\n')
+
+
+def node_degrees(links):
+    """(the number of links, {bare predicate: the number of links with it}) for a node's links."""
+    degrees = defaultdict(int)
+    for (bare, _), positions in partition_links(links).items():
+        degrees[bare] += len(positions)
+    return len(links), dict(degrees)
+
+
+def write_degree_index(nodes_to_links, output_dir, min_degree=DEGREE_INDEX_MIN_DEGREE):
+    """Write degrees.txt, the degree index of hubs.py: the degrees of the nodes with at least min_degree links."""
+    with open(os.path.join(output_dir, DEGREE_INDEX_FILE), 'wb') as outf:
+        for node, links in nodes_to_links.items():
+            if len(links) >= min_degree:
+                total, by_predicate = node_degrees(links)
+                outf.write(node.encode('utf-8') + b'\t' + orjson.dumps({'d': total, 'p': by_predicate}) + b'\n')
+
+
+def write_compact_counts(edgecounts, output_dir):
+    """Write the link counts with count_keys compact keys: backlinks.bin holds link_codec records of key -> count,
+    and countdict.json the predicate and category dictionaries."""
+    builder = CountKeyBuilder()
+    with open(os.path.join(output_dir, 'backlinks.bin'), 'wb') as outf:
+        for link, value in edgecounts.items():
+            link_codec.write_record(outf, builder.key(link), str(value).encode('utf-8'))
+    with open(os.path.join(output_dir, 'countdict.json'), 'wb') as outf:
+        outf.write(orjson.dumps({'predicates': builder.predicates, 'categories': builder.categories}))
+
+
+def generate_ac_files(input_node_file, input_edge_file, output_dir, binary_links=True, compact_count_keys=True,
+                      link_partitions=True, degree_index=True):
     """Given a dump of a graph a la robokop, produce 3 files:
     nodelabels.txt which is 2 columns, (id), (list of labels):
     CAID:CA13418922 ['named_thing', 'biological_entity', 'molecular_entity', 'genomic_entity', 'sequence_variant']
@@ -97,12 +202,22 @@ def generate_ac_files(input_node_file, input_edge_file, output_dir):
     links.txt:
     2 columns, id -> list of lists. Each element is (other_id, predicate, id is subject)
     CAID:CA13418922 [["MONDO:0005011", "has_phenotype", true], ["MONDO:0004955", "has_phenotype", true], ["EFO:0004612", "has_phenotype", true], ["EFO:0005110", "has_phenotype", true], ["EFO:0004639", "has_phenotype", true], ["EFO:0007759", "has_phenotype", true]
+    links.bin and linkdict_*.txt (if binary_links):
+    The same links in the compact link_codec format, see write_binary_links.  load_redis prefers these to links.txt
+    linkparts.bin or linkparts.txt (if link_partitions):
+    The links again, one value per node, bare predicate and direction, see write_link_partitions
+    degrees.txt (if degree_index):
+    The number of links of each node with many of them, in total and by bare predicate, see hubs.py
+    nodemetadata.txt: id -> json record holding both the labels and the name
+    MONDO:0005011   {"c":["biolink:Disease","biolink:DiseaseOrPhenotypicFeature","biolink:NamedThing"],"n":"Crohn disease"}
     backlinks.txt:
     Counts of how many of each type of link there are.
     ('CAID:CA13418922', 'has_phenotype', True, 'named_thing')       21
     ('CAID:CA13418922', 'has_phenotype', True, 'biological_entity') 21
     ('CAID:CA13418922', 'has_phenotype', True, 'disease')   3
     ('CAID:CA13418922', 'has_phenotype', True, 'disease_or_phenotypic_feature')     21
+    backlinks.bin and countdict.json (if compact_count_keys):
+    The same counts with compact keys, see write_compact_counts.  load_redis prefers these to backlinks.txt
     This version reads KGX node and edge json files
 
     We are filtering nodes that are in the ARS blocklist, and predicates that clutter.
@@ -112,6 +227,7 @@ def generate_ac_files(input_node_file, input_edge_file, output_dir):
     """
     output_nodelabels_filepath = os.path.join(output_dir, 'nodelabels.txt')
     output_nodenames_filepath = os.path.join(output_dir, 'nodenames.txt')
+    output_nodemetadata_filepath = os.path.join(output_dir, 'nodemetadata.txt')
     output_category_count_filepath = os.path.join(output_dir, 'category_count.txt')
     output_prov_filepath = os.path.join(output_dir, 'prov.txt')
     output_links_filepath = os.path.join(output_dir, 'links.txt')
@@ -122,7 +238,8 @@ def generate_ac_files(input_node_file, input_edge_file, output_dir):
     filter_nodes = get_filter_nodes()
     categories = {}
     catcount = defaultdict(int)
-    with open(output_nodelabels_filepath, 'w') as labelfile, open(output_nodenames_filepath, 'w') as namefile:
+    with open(output_nodelabels_filepath, 'w') as labelfile, open(output_nodenames_filepath, 'w') as namefile, \
+            open(output_nodemetadata_filepath, 'w') as metadatafile:
         for node in tqdm(quick_jsonl_file_iterator(input_node_file)) if TQDM_AVAILABLE else quick_jsonl_file_iterator(input_node_file):
             node_id = node["id"]
             if node_id.startswith('CAID') or node_id in filter_nodes:
@@ -136,6 +253,7 @@ def generate_ac_files(input_node_file, input_edge_file, output_dir):
             if name is not None:
                 name = name.encode('ascii', errors='ignore').decode(encoding="utf-8")
             namefile.write(f'{node_id}\t{name}\n')
+            metadatafile.write(f'{node_id}\t{node_metadata_record(node_category, name)}\n')
     nodes_to_links = defaultdict(list)
     edgecounts = defaultdict(int)
     with open(output_category_count_filepath, 'w') as catcountout:
@@ -184,11 +302,27 @@ def generate_ac_files(input_node_file, input_edge_file, output_dir):
             outf.write(f'{node}\t{json.dumps(links)}\n')
         print('links done')
 
+    if binary_links:
+        write_binary_links(nodes_to_links, output_dir)
+        print('binary links done')
+
+    if link_partitions:
+        write_link_partitions(nodes_to_links, output_dir, binary_links)
+        print('link partitions done')
+
+    if degree_index:
+        write_degree_index(nodes_to_links, output_dir)
+        print('degree index done')
+
     with open(output_backlinks_filepath, 'w') as outf:
         for key, value in edgecounts.items():
             outf.write(f'{key}\t{value}\n')
         print('backlinks done')
 
+    if compact_count_keys:
+        write_compact_counts(edgecounts, output_dir)
+        print('compact backlinks done')
+
 
 if __name__ == '__main__':
     generate_ac_files()
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""Bulk GETs against the coalescer's redis databases.
+
+Lookups for large MCQs touch tens of thousands of nodes and hundreds of thousands of link-count keys.  Rather than
+sending one pipeline chunk and waiting for it before sending the next, the keys are split into MGET chunks that are
+sent concurrently over several pooled connections (threads for the synchronous clients, asyncio.gather for the
+asyncio clients).
+
+Chunk sizes adapt per database: a small value (a count) and a large value (a hub node's link list) want very
+different chunk sizes, so each database keeps a running estimate of bytes and seconds per key and sizes its chunks
+to hit a target payload and latency.
+
+Every call records a FetchStats; recent_stats() returns the latest ones.
+
+Configuration (config.json, all optional):
+    redis_fetch_concurrency: chunks in flight at once per call
+    redis_fetch_target_bytes: payload to aim for per chunk
+    redis_fetch_target_seconds: latency to aim for per chunk
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from src.graph_coalescence.redis_pool import get_redis_registry, load_config
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TARGET_BYTES = 1 << 20
+DEFAULT_TARGET_SECONDS = 0.05
+MIN_CHUNK = 100
+MAX_CHUNK = 10000
+# Starting chunk size, before anything has been observed for a database
+INITIAL_CHUNK = 1000
+# Weight given to the newest observation in the running estimates
+EWMA_ALPHA = 0.3
+STATS_HISTORY = 1000
+
+
+@dataclass
+class FetchStats:
+    dbnum: int
+    keys: int
+    chunks: int
+    chunk_size: int
+    bytes: int
+    seconds: float
+    asynchronous: bool
+
+    def as_dict(self):
+        return {'dbnum': self.dbnum, 'keys': self.keys, 'chunks': self.chunks, 'chunk_size': self.chunk_size,
+                'bytes': self.bytes, 'seconds': self.seconds, 'async': self.asynchronous}
+
+
+class AdaptiveChunker:
+    """Picks an MGET chunk size for one database from what earlier chunks cost."""
+
+    def __init__(self, target_bytes=DEFAULT_TARGET_BYTES, target_seconds=DEFAULT_TARGET_SECONDS,
+                 min_chunk=MIN_CHUNK, max_chunk=MAX_CHUNK, initial_chunk=INITIAL_CHUNK):
+        self.target_bytes = target_bytes
+        self.target_seconds = target_seconds
+        self.min_chunk = min_chunk
+        self.max_chunk = max_chunk
+        self.initial_chunk = initial_chunk
+        self.bytes_per_key = None
+        self.seconds_per_key = None
+        self._lock = threading.Lock()
+
+    def observe(self, nkeys, nbytes, seconds):
+        if nkeys == 0:
+            return
+        bpk = nbytes / nkeys
+        spk = seconds / nkeys
+        with self._lock:
+            if self.bytes_per_key is None:
+                self.bytes_per_key, self.seconds_per_key = bpk, spk
+            else:
+                self.bytes_per_key += EWMA_ALPHA * (bpk - self.bytes_per_key)
+                self.seconds_per_key += EWMA_ALPHA * (spk - self.seconds_per_key)
+
+    def chunk_size(self):
+        with self._lock:
+            if self.bytes_per_key is None:
+                return self.initial_chunk
+            limits = [self.max_chunk]
+            if self.bytes_per_key > 0:
+                limits.append(self.target_bytes / self.bytes_per_key)
+            if self.seconds_per_key > 0:
+                limits.append(self.target_seconds / self.seconds_per_key)
+        return max(self.min_chunk, int(min(limits)))
+
+
+def payload_bytes(values):
+    return sum(len(v) for v in values if v is not None)
+
+
+def split(keys, chunk_size):
+    return [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+
+class BulkFetcher:
+    def __init__(self, conf, registry=None):
+        self.concurrency = max(1, int(conf.get('redis_fetch_concurrency', DEFAULT_CONCURRENCY)))
+        self.target_bytes = int(conf.get('redis_fetch_target_bytes', DEFAULT_TARGET_BYTES))
+        self.target_seconds = float(conf.get('redis_fetch_target_seconds', DEFAULT_TARGET_SECONDS))
+        self._registry = registry
+        self._chunkers = {}
+        self._stats = deque(maxlen=STATS_HISTORY)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = get_redis_registry()
+        return self._registry
+
+    def chunker(self, dbnum):
+        with self._lock:
+            chunker = self._chunkers.get(dbnum)
+            if chunker is None:
+                chunker = AdaptiveChunker(self.target_bytes, self.target_seconds)
+                self._chunkers[dbnum] = chunker
+        return chunker
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                    thread_name_prefix='redis-bulk-fetch')
+        return self._executor
+
+    def _timed_chunk(self, client, chunker, chunk):
+        start = time.perf_counter()
+        values = client.mget(chunk)
+        nbytes = payload_bytes(values)
+        chunker.observe(len(chunk), nbytes, time.perf_counter() - start)
+        return values, nbytes
+
+    async def _timed_chunk_async(self, client, chunker, chunk, semaphore):
+        async with semaphore:
+            start = time.perf_counter()
+            values = await client.mget(chunk)
+        nbytes = payload_bytes(values)
+        chunker.observe(len(chunk), nbytes, time.perf_counter() - start)
+        return values, nbytes
+
+    def _record(self, dbnum, keys, chunks, chunk_size, results, start, asynchronous):
+        values = []
+        nbytes = 0
+        for chunk_values, chunk_bytes in results:
+            values.extend(chunk_values)
+            nbytes += chunk_bytes
+        self._stats.append(FetchStats(dbnum, len(keys), len(chunks), chunk_size, nbytes,
+                                      time.perf_counter() - start, asynchronous))
+        return values
+
+    def mget(self, dbnum, keys):
+        """Values for keys (None where missing), in key order."""
+        keys = list(keys)
+        if not keys:
+            return []
+        start = time.perf_counter()
+        chunker = self.chunker(dbnum)
+        chunk_size = chunker.chunk_size()
+        chunks = split(keys, chunk_size)
+        client = self.registry.get_client(dbnum)
+        if len(chunks) == 1 or self.concurrency == 1:
+            results = [self._timed_chunk(client, chunker, chunk) for chunk in chunks]
+        else:
+            results = list(self.executor().map(lambda chunk: self._timed_chunk(client, chunker, chunk), chunks))
+        return self._record(dbnum, keys, chunks, chunk_size, results, start, False)
+
+    async def mget_async(self, dbnum, keys):
+        """mget, over the asyncio client for the running loop."""
+        keys = list(keys)
+        if not keys:
+            return []
+        start = time.perf_counter()
+        chunker = self.chunker(dbnum)
+        chunk_size = chunker.chunk_size()
+        chunks = split(keys, chunk_size)
+        client = self.registry.get_async_client(dbnum)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        results = await asyncio.gather(*[self._timed_chunk_async(client, chunker, chunk, semaphore)
+                                         for chunk in chunks])
+        return self._record(dbnum, keys, chunks, chunk_size, results, start, True)
+
+    def recent_stats(self, n=None):
+        stats = list(self._stats)
+        if n is not None:
+            stats = stats[-n:]
+        return [s.as_dict() for s in stats]
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_bulk_fetcher():
+    global _fetcher
+    if _fetcher is None:
+        with _fetcher_lock:
+            if _fetcher is None:
+                _fetcher = BulkFetcher(load_config())
+    return _fetcher
+
+
+def mget(dbnum, keys):
+    return get_bulk_fetcher().mget(dbnum, keys)
+
+
+async def mget_async(dbnum, keys):
+    return await get_bulk_fetcher().mget_async(dbnum, keys)
+
+
+def recent_stats(n=None):
+    return get_bulk_fetcher().recent_stats(n)
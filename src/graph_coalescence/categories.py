@@ -0,0 +1,67 @@
+"""Biolink categories as bitmasks.
+
+The node constraints of a query are checked against the categories of every node that its inputs link to.  The
+category lists that the build writes already hold every superclass of a node's categories, so a node meets the
+constraints when any of its categories is one of them: with a bit for each category, when the OR of its categories'
+bits ANDs to something non-zero with the OR of the constraints'.
+
+Bits are numbered in the order of the biolink model, with categories outside the model numbered as they show up.
+Masks are python ints, so there is no limit on the number of categories.  A mask is worked out once for each
+distinct category list and remembered; the lists themselves stay as they are, for building responses.
+
+The CSR store keeps its node categories as bitmasks too (node_categories.npy), numbered in the order of its own
+category list.
+"""
+import threading
+from src.graph_coalescence.biolink_closure import get_biolink_closure
+
+
+class CategoryBits:
+    def __init__(self, categories=()):
+        # category -> bit
+        self._bits = {}
+        # tuple of categories -> mask
+        self._masks = {}
+        self._lock = threading.Lock()
+        for category in categories:
+            self.bit(category)
+
+    def bit(self, category):
+        bit = self._bits.get(category)
+        if bit is None:
+            with self._lock:
+                bit = self._bits.get(category)
+                if bit is None:
+                    bit = self._bits[category] = 1 << len(self._bits)
+        return bit
+
+    def mask(self, categories):
+        """The mask of a list of categories; a single category may be given as a string."""
+        key = (categories,) if isinstance(categories, str) else tuple(categories)
+        mask = self._masks.get(key)
+        if mask is None:
+            mask = 0
+            for category in key:
+                mask |= self.bit(category)
+            self._masks[key] = mask
+        return mask
+
+    def categories(self, mask):
+        """The categories in mask, in bit order."""
+        return [category for category, bit in self._bits.items() if mask & bit]
+
+    def __len__(self):
+        return len(self._bits)
+
+
+_bits = None
+_bits_lock = threading.Lock()
+
+
+def get_category_bits():
+    global _bits
+    if _bits is None:
+        with _bits_lock:
+            if _bits is None:
+                _bits = CategoryBits(get_biolink_closure().categories)
+    return _bits
@@ -0,0 +1,123 @@
+"""Keys for the db 2 link counts.
+
+A count is for a link tuple (node, predicate_json, node_is_source, category).  The original keys are the python repr
+of that tuple, e.g.
+    ('NCBIGene:1017', '{"predicate": "biolink:affects"}', True, 'biolink:Disease')
+which repeats the predicate JSON and category text in every one of the ~166M keys, and has to be re-formatted with
+str() for every link on the hot path.
+
+Compact keys intern the predicate and category into small integer ids:
+    magic (2 bytes) | varint((predicate id << 1) | node_is_source) | varint(category id) | node curie (utf-8)
+The node stays as text: curies are short, and mapping millions of them back to ids would need a table far larger
+than anything it would save.
+
+The predicate and category dictionaries are stored in db 5 (DICTIONARY_KEYS).  A database without them still has
+the original keys, and legacy_count_key is used.
+"""
+import orjson
+
+MAGIC = b'\xacK'
+DICTIONARY_DB = 5
+PREDICATES_KEY = 'ac:countdict:predicates'
+CATEGORIES_KEY = 'ac:countdict:categories'
+DICTIONARY_KEYS = (PREDICATES_KEY, CATEGORIES_KEY)
+
+
+def legacy_count_key(link):
+    return str(link)
+
+
+def encode_varint(value):
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_count_key(predicate_id, node_is_source, category_id, node):
+    return MAGIC + encode_varint((predicate_id << 1) | bool(node_is_source)) + encode_varint(category_id) + \
+        node.encode('utf-8')
+
+
+class CountKeyCodec:
+    def __init__(self, predicates, categories):
+        self.predicates = list(predicates)
+        self.categories = list(categories)
+        self.predicate_ids = {p: i for i, p in enumerate(self.predicates)}
+        self.category_ids = {c: i for i, c in enumerate(self.categories)}
+        # (predicate, node_is_source, category) -> key prefix, or None if there can't be such a key
+        self._prefixes = {}
+
+    @classmethod
+    def from_redis_values(cls, predicates_value, categories_value):
+        """The codec for the stored dictionaries, or None if they aren't there (original keys)."""
+        if predicates_value is None or categories_value is None:
+            return None
+        return cls(orjson.loads(predicates_value), orjson.loads(categories_value))
+
+    def dictionary_values(self):
+        return orjson.dumps(self.predicates), orjson.dumps(self.categories)
+
+    def _prefix(self, predicate, node_is_source, category):
+        signature = (predicate, node_is_source, category)
+        try:
+            return self._prefixes[signature]
+        except KeyError:
+            pass
+        predicate_id = self.predicate_ids.get(predicate)
+        category_id = self.category_ids.get(category)
+        if predicate_id is None or category_id is None:
+            prefix = None
+        else:
+            prefix = encode_count_key(predicate_id, node_is_source, category_id, '')
+        self._prefixes[signature] = prefix
+        return prefix
+
+    def key(self, link):
+        """The key for a (node, predicate, node_is_source, category) tuple, or None if the predicate or category was
+        never counted (so the count is 0)."""
+        node, predicate, node_is_source, category = link
+        prefix = self._prefix(predicate, node_is_source, category)
+        if prefix is None:
+            return None
+        return prefix + node.encode('utf-8')
+
+    def decode(self, key):
+        """The link tuple for a compact key."""
+        if key[:2] != MAGIC:
+            raise ValueError('Not a compact count key')
+        values = []
+        offset = 2
+        for _ in range(2):
+            value = 0
+            shift = 0
+            while True:
+                b = key[offset]
+                offset += 1
+                value |= (b & 0x7f) << shift
+                if not b & 0x80:
+                    break
+                shift += 7
+            values.append(value)
+        packed, category_id = values
+        return (key[offset:].decode('utf-8'), self.predicates[packed >> 1], bool(packed & 1),
+                self.categories[category_id])
+
+
+class CountKeyBuilder(CountKeyCodec):
+    """A codec that assigns ids to new predicates and categories as it sees them; for writing counts."""
+
+    def __init__(self):
+        super().__init__([], [])
+
+    def key(self, link):
+        node, predicate, node_is_source, category = link
+        if predicate not in self.predicate_ids:
+            self.predicate_ids[predicate] = len(self.predicates)
+            self.predicates.append(predicate)
+        if category not in self.category_ids:
+            self.category_ids[category] = len(self.categories)
+            self.categories.append(category)
+        return super().key(link)
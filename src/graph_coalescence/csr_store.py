@@ -0,0 +1,547 @@
+"""Read-only, memory-mapped copy of a KG build in a compressed sparse row (CSR) layout.
+
+This is an alternative to redis for serving: a lookup is a few array reads from the page cache instead of a network
+round trip, and any number of worker processes that open the same directory share one copy of the data.
+
+build_csr_store reads the files written by generate_ac_files (or the tests/test_*.txt fixtures) and writes a
+directory of
+
+    meta.json              format version, predicate and category lists, category counts, sizes
+    nodes.blob             every curie, utf-8, back to back; node i is nodes.blob[node_offsets[i]:node_offsets[i+1]]
+    node_offsets.npy       int64, n + 1
+    node_hash.npy          int32 open-addressing table: crc32(curie) -> node id, -1 for empty slots
+    link_starts.npy        int64, n: node i's links are positions link_starts[i]:link_ends[i] of the link arrays
+    link_ends.npy
+    link_nodes.npy         int32, the other node of each link
+    link_predicates.npy    int32, (predicate id << 1) | node_is_source
+    node_categories.npy    uint64 (n, words) category bitmasks; bit c is category c of meta.json
+    names.blob, name_offsets.npy   node names, like the curies
+    count_keys.npy         int64, sorted:
+                           ((node id * 2 * npredicates + ((predicate id << 1) | node_is_source)) * ncategories
+                           + category id
+    count_values.npy       int64, the count for each key
+    prov_starts.npy        int64 per link position: the json provenance of the link is prov.blob[start:end]
+    prov_ends.npy
+    prov.blob
+    degrees.txt            the hubs.py degree index, copied from the build if it has one
+
+Provenance is attached to the subject side of an edge, the same as the "subject predicate object" keys of db 4.
+
+Lookups work on whole batches of curies with numpy; indexing the memory-mapped arrays one element at a time from
+python costs more than the redis round trip it replaces.
+
+CSRStore answers the same questions as the redis databases, with the same results as the graph_data loaders, except
+that a node's categories come back in the order of the category list rather than the order they were written in.
+"""
+import array
+import ast
+import mmap
+import os
+import shutil
+import zlib
+import numpy as np
+import orjson
+from src.graph_coalescence import link_codec
+from src.graph_coalescence.count_keys import CountKeyCodec
+from src.graph_coalescence.hubs import DEGREE_INDEX_FILE
+
+FORMAT_VERSION = 1
+META_FILE = 'meta.json'
+
+
+###
+# Reading the generate_ac_files outputs
+###
+
+def _input_path(datadir, prefix, name):
+    """The path of an input file; the test fixtures have a test_ prefix on all but category_count.txt."""
+    path = os.path.join(datadir, f'{prefix}{name}')
+    if not os.path.exists(path) and prefix:
+        unprefixed = os.path.join(datadir, name)
+        if os.path.exists(unprefixed):
+            return unprefixed
+    return path
+
+
+def _tab_lines(fname):
+    """(key, value) per line, split like load_redis.write_to does."""
+    with open(fname, 'r') as inf:
+        for line in inf:
+            x = line.strip().split('\t')
+            yield x[0], (x[1] if len(x) > 1 else '')
+
+
+def iter_links(datadir, prefix=''):
+    """(node, links) for every node, from links.bin if there is one, otherwise links.txt."""
+    binary = os.path.join(datadir, f'{prefix}links.bin')
+    if os.path.exists(binary):
+        with open(os.path.join(datadir, f'{prefix}linkdict_nodes.txt'), 'rb') as inf:
+            nodes_blob = inf.read().rstrip(b'\n')
+        with open(os.path.join(datadir, f'{prefix}linkdict_predicates.txt'), 'rb') as inf:
+            predicates_blob = inf.read().rstrip(b'\n')
+        with open(os.path.join(datadir, f'{prefix}linkdict_id.txt'), 'r') as inf:
+            dictionary = link_codec.LinkDictionary(int(inf.read()), nodes_blob, predicates_blob)
+        with open(binary, 'rb') as inf:
+            for node, value in link_codec.read_records(inf):
+                yield node, link_codec.decode_links(value, lambda _: dictionary)
+        return
+    for node, value in _tab_lines(_input_path(datadir, prefix, 'links.txt')):
+        yield node, orjson.loads(value)
+
+
+def iter_node_metadata(datadir, prefix=''):
+    """(node, categories, name) for every node, from nodemetadata.txt or else nodelabels.txt and nodenames.txt."""
+    metadata = _input_path(datadir, prefix, 'nodemetadata.txt')
+    if os.path.exists(metadata):
+        for node, value in _tab_lines(metadata):
+            record = orjson.loads(value)
+            yield node, record['c'], record['n']
+        return
+    names = dict(_tab_lines(_input_path(datadir, prefix, 'nodenames.txt')))
+    for node, value in _tab_lines(_input_path(datadir, prefix, 'nodelabels.txt')):
+        yield node, ast.literal_eval(value), names.pop(node, '')
+    for node, name in names.items():
+        yield node, [], name
+
+
+def iter_link_counts(datadir, prefix=''):
+    """((node, predicate, node_is_source, category), count) from backlinks.bin or else backlinks.txt."""
+    binary = os.path.join(datadir, f'{prefix}backlinks.bin')
+    if os.path.exists(binary):
+        with open(os.path.join(datadir, f'{prefix}countdict.json'), 'rb') as inf:
+            dictionaries = orjson.loads(inf.read())
+        codec = CountKeyCodec(dictionaries['predicates'], dictionaries['categories'])
+        with open(binary, 'rb') as inf:
+            for key, value in link_codec.read_records(inf, decode_keys=False):
+                yield codec.decode(key), int(value)
+        return
+    for key, value in _tab_lines(_input_path(datadir, prefix, 'backlinks.txt')):
+        yield ast.literal_eval(key), int(value)
+
+
+def iter_provs(datadir, prefix=''):
+    """(edge key, raw json provenance) from prov.txt, if there is one."""
+    fname = _input_path(datadir, prefix, 'prov.txt')
+    if os.path.exists(fname):
+        yield from _tab_lines(fname)
+
+
+def read_category_counts(datadir, prefix=''):
+    return {c: int(v) for c, v in _tab_lines(_input_path(datadir, prefix, 'category_count.txt')) if v}
+
+
+def split_prov_key(edge):
+    """(subject, predicate, object) for a "subject predicate object" prov key; the predicate json has spaces, the
+    curies don't."""
+    first = edge.index(' ')
+    last = edge.rindex(' ')
+    return edge[:first], edge[first + 1:last], edge[last + 1:]
+
+
+###
+# Building
+###
+
+def _write_blob(path, strings):
+    offsets = array.array('q', [0])
+    with open(path, 'wb') as outf:
+        for s in strings:
+            b = s.encode('utf-8')
+            outf.write(b)
+            offsets.append(offsets[-1] + len(b))
+    return np.frombuffer(offsets, dtype=np.int64)
+
+
+def node_hash_table(nodes):
+    """Open-addressing table, at most half full, of crc32(curie) -> node id."""
+    size = 1
+    while size < 2 * len(nodes):
+        size <<= 1
+    mask = size - 1
+    table = [-1] * size
+    for i, node in enumerate(nodes):
+        h = zlib.crc32(node.encode('utf-8')) & mask
+        while table[h] != -1:
+            h = (h + 1) & mask
+        table[h] = i
+    return np.array(table, dtype=np.int32)
+
+
+def build_csr_store(datadir, outdir, prefix=''):
+    """Build a CSR store in outdir from the generate_ac_files outputs in datadir.  prefix='test_' reads the test
+    fixtures."""
+    os.makedirs(outdir, exist_ok=True)
+    node_ids = {}
+    predicate_ids = {}
+    category_ids = {}
+
+    def node_id(curie):
+        i = node_ids.get(curie)
+        if i is None:
+            i = node_ids[curie] = len(node_ids)
+        return i
+
+    def predicate_id(predicate):
+        i = predicate_ids.get(predicate)
+        if i is None:
+            i = predicate_ids[predicate] = len(predicate_ids)
+        return i
+
+    def category_id(category):
+        i = category_ids.get(category)
+        if i is None:
+            i = category_ids[category] = len(category_ids)
+        return i
+
+    node_category_ids = {}
+    names = {}
+    for node, categories, name in iter_node_metadata(datadir, prefix):
+        i = node_id(node)
+        node_category_ids[i] = [category_id(c) for c in categories]
+        names[i] = name
+
+    rows = array.array('i')
+    row_starts = array.array('q')
+    link_nodes = array.array('i')
+    link_predicates = array.array('i')
+    for node, links in iter_links(datadir, prefix):
+        rows.append(node_id(node))
+        row_starts.append(len(link_nodes))
+        for other, predicate, node_is_source in links:
+            link_nodes.append(node_id(other))
+            link_predicates.append((predicate_id(predicate) << 1) | bool(node_is_source))
+
+    count_nodes = array.array('i')
+    count_predicates = array.array('q')
+    count_categories = array.array('q')
+    count_values = array.array('q')
+    for (node, predicate, node_is_source, category), count in iter_link_counts(datadir, prefix):
+        count_nodes.append(node_id(node))
+        count_predicates.append((predicate_id(predicate) << 1) | bool(node_is_source))
+        count_categories.append(category_id(category))
+        count_values.append(count)
+
+    n = len(node_ids)
+    nodes = list(node_ids)
+    np.save(os.path.join(outdir, 'node_offsets.npy'), _write_blob(os.path.join(outdir, 'nodes.blob'), nodes))
+    np.save(os.path.join(outdir, 'node_hash.npy'), node_hash_table(nodes))
+    np.save(os.path.join(outdir, 'name_offsets.npy'),
+            _write_blob(os.path.join(outdir, 'names.blob'), (names.get(i, '') for i in range(n))))
+
+    words = max(1, (len(category_ids) + 63) // 64)
+    node_categories = np.zeros((n, words), dtype=np.uint64)
+    for i, cids in node_category_ids.items():
+        for c in cids:
+            node_categories[i, c // 64] |= np.uint64(1 << (c % 64))
+    np.save(os.path.join(outdir, 'node_categories.npy'), node_categories)
+
+    # Links
+    rows = np.frombuffer(rows, dtype=np.int32)
+    row_starts = np.frombuffer(row_starts, dtype=np.int64)
+    nlinks = len(link_nodes)
+    link_starts = np.zeros(n, dtype=np.int64)
+    link_ends = np.zeros(n, dtype=np.int64)
+    link_starts[rows] = row_starts
+    link_ends[rows] = np.append(row_starts[1:], nlinks)
+    link_nodes = np.frombuffer(link_nodes, dtype=np.int32)
+    link_predicates = np.frombuffer(link_predicates, dtype=np.int32)
+    for name, values in (('link_starts', link_starts), ('link_ends', link_ends), ('link_nodes', link_nodes),
+                         ('link_predicates', link_predicates)):
+        np.save(os.path.join(outdir, f'{name}.npy'), values)
+
+    # Counts
+    npredicates = 2 * max(1, len(predicate_ids))
+    ncategories = max(1, len(category_ids))
+    if n * npredicates * ncategories >= 2 ** 63:
+        raise ValueError('KG too large for int64 count keys')
+    count_keys = (np.frombuffer(count_nodes, dtype=np.int32).astype(np.int64) * npredicates +
+                  np.frombuffer(count_predicates, dtype=np.int64)) * ncategories + \
+        np.frombuffer(count_categories, dtype=np.int64)
+    order = np.argsort(count_keys, kind='stable')
+    np.save(os.path.join(outdir, 'count_keys.npy'), count_keys[order])
+    np.save(os.path.join(outdir, 'count_values.npy'), np.frombuffer(count_values, dtype=np.int64)[order])
+
+    _build_prov(datadir, prefix, outdir, node_ids, predicate_ids, rows, row_starts, link_nodes, link_predicates)
+
+    degrees_file = _input_path(datadir, prefix, DEGREE_INDEX_FILE)
+    if os.path.exists(degrees_file):
+        shutil.copyfile(degrees_file, os.path.join(outdir, DEGREE_INDEX_FILE))
+
+    category_counts = read_category_counts(datadir, prefix)
+    with open(os.path.join(outdir, META_FILE), 'wb') as outf:
+        outf.write(orjson.dumps({'format_version': FORMAT_VERSION,
+                                 'nodes': n,
+                                 'links': nlinks,
+                                 'predicates': list(predicate_ids),
+                                 'categories': list(category_ids),
+                                 'category_counts': category_counts}))
+
+
+def _build_prov(datadir, prefix, outdir, node_ids, predicate_ids, rows, row_starts, link_nodes, link_predicates):
+    """Attach each prov.txt value to its subject-side link.  Both sides become one int64 key per
+    (subject, object, predicate) and are matched with a sort instead of a search per line."""
+    n = len(node_ids)
+    npredicates = 2 * max(1, len(predicate_ids))
+    if n * n * npredicates >= 2 ** 63:
+        raise ValueError('KG too large for the int64 edge keys used to attach provenance')
+    nlinks = len(link_nodes)
+    link_rows = np.repeat(rows, np.diff(np.append(row_starts, nlinks))).astype(np.int64)
+    link_keys = (link_rows * n + link_nodes) * npredicates + link_predicates
+    link_order = np.argsort(link_keys, kind='stable')
+    sorted_link_keys = link_keys[link_order]
+
+    prov_keys = array.array('q')
+    prov_line_starts = array.array('q')
+    prov_line_ends = array.array('q')
+    with open(os.path.join(outdir, 'prov.blob'), 'wb') as outf:
+        offset = 0
+        for edge, value in iter_provs(datadir, prefix):
+            subject, predicate, obj = split_prov_key(edge)
+            subject_id = node_ids.get(subject)
+            object_id = node_ids.get(obj)
+            pid = predicate_ids.get(predicate)
+            if subject_id is None or object_id is None or pid is None or not value:
+                continue
+            b = value.encode('utf-8')
+            outf.write(b)
+            prov_keys.append((subject_id * n + object_id) * npredicates + ((pid << 1) | 1))
+            prov_line_starts.append(offset)
+            offset += len(b)
+            prov_line_ends.append(offset)
+
+    prov_starts = np.zeros(nlinks, dtype=np.int64)
+    prov_ends = np.zeros(nlinks, dtype=np.int64)
+    prov_keys = np.frombuffer(prov_keys, dtype=np.int64)
+    if len(prov_keys) and nlinks:
+        # Later lines win, as they do with redis SET
+        _, last = np.unique(prov_keys[::-1], return_index=True)
+        last = len(prov_keys) - 1 - last
+        found = np.searchsorted(sorted_link_keys, prov_keys[last])
+        found_ok = found < nlinks
+        found_ok[found_ok] = sorted_link_keys[found[found_ok]] == prov_keys[last][found_ok]
+        positions = link_order[found[found_ok]]
+        prov_starts[positions] = np.frombuffer(prov_line_starts, dtype=np.int64)[last][found_ok]
+        prov_ends[positions] = np.frombuffer(prov_line_ends, dtype=np.int64)[last][found_ok]
+    np.save(os.path.join(outdir, 'prov_starts.npy'), prov_starts)
+    np.save(os.path.join(outdir, 'prov_ends.npy'), prov_ends)
+
+
+###
+# Serving
+###
+
+def _load_array(path):
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        # Empty arrays can't be mapped
+        return np.load(path)
+
+
+def _map_blob(path):
+    with open(path, 'rb') as inf:
+        if os.fstat(inf.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(inf.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class CSRStore:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE), 'rb') as inf:
+            meta = orjson.loads(inf.read())
+        if meta['format_version'] != FORMAT_VERSION:
+            raise ValueError(f'Unsupported CSR store version {meta["format_version"]}')
+        self.predicates = meta['predicates']
+        self.categories = meta['categories']
+        self.category_counts = meta['category_counts']
+        self.predicate_ids = {p: i for i, p in enumerate(self.predicates)}
+        self.category_ids = {c: i for i, c in enumerate(self.categories)}
+        self.bare_predicates = [orjson.loads(p).get('predicate') for p in self.predicates]
+        self._bare_predicate_ids = {}
+        # Distinct category bitmasks are few, so their lists are made once each
+        self._category_lists = {}
+        self.nodes_blob = _map_blob(os.path.join(path, 'nodes.blob'))
+        self.names_blob = _map_blob(os.path.join(path, 'names.blob'))
+        self.prov_blob = _map_blob(os.path.join(path, 'prov.blob'))
+        for name in ('node_offsets', 'node_hash', 'name_offsets', 'node_categories', 'link_starts', 'link_ends',
+                     'link_nodes', 'link_predicates', 'count_keys', 'count_values', 'prov_starts', 'prov_ends'):
+            setattr(self, name, _load_array(os.path.join(path, f'{name}.npy')))
+        self.hash_mask = len(self.node_hash) - 1
+        self.npredicates = 2 * max(1, len(self.predicates))
+        self.ncategories = max(1, len(self.categories))
+
+    def __len__(self):
+        return len(self.link_starts)
+
+    def node_ids(self, curies):
+        """int64 array of the ids of curies, -1 for those not in the KG."""
+        encoded = [curie.encode('utf-8') for curie in curies]
+        h = np.fromiter((zlib.crc32(b) for b in encoded), dtype=np.int64, count=len(encoded)) & self.hash_mask
+        ids = np.full(len(encoded), -1, dtype=np.int64)
+        pending = np.arange(len(encoded))
+        blob = self.nodes_blob
+        while len(pending):
+            candidates = self.node_hash[h[pending]].astype(np.int64)
+            occupied = candidates >= 0
+            pending = pending[occupied]
+            candidates = candidates[occupied]
+            starts = self.node_offsets[candidates].tolist()
+            ends = self.node_offsets[candidates + 1].tolist()
+            match = np.fromiter((blob[s:e] == encoded[p] for s, e, p in zip(starts, ends, pending.tolist())),
+                                dtype=bool, count=len(pending))
+            ids[pending[match]] = candidates[match]
+            pending = pending[~match]
+            h[pending] = (h[pending] + 1) & self.hash_mask
+        return ids
+
+    def node_id(self, curie):
+        i = int(self.node_ids([curie])[0])
+        return None if i < 0 else i
+
+    def curies(self, ids):
+        blob = self.nodes_blob
+        return [blob[s:e].decode('utf-8') for s, e in zip(self.node_offsets[ids].tolist(),
+                                                          self.node_offsets[ids + 1].tolist())]
+
+    def _predicate_ids_for(self, bare_predicates):
+        key = frozenset(bare_predicates)
+        pids = self._bare_predicate_ids.get(key)
+        if pids is None:
+            pids = [pid for pid, bare in enumerate(self.bare_predicates) if bare in key]
+            self._bare_predicate_ids[key] = pids
+        return pids
+
+    def _gather_links(self, nodes, bare_predicates=None):
+        """{node: links} for a list of unique nodes; bare_predicates, if given, is a list of bare predicate
+        collections, one per node, to keep."""
+        ids = self.node_ids(nodes)
+        found = ids >= 0
+        starts = np.zeros(len(nodes), dtype=np.int64)
+        lengths = np.zeros(len(nodes), dtype=np.int64)
+        starts[found] = self.link_starts[ids[found]]
+        lengths[found] = self.link_ends[ids[found]] - starts[found]
+        # Every link position of every node, in node order
+        row_offsets = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(starts - row_offsets[:-1], lengths) + np.arange(row_offsets[-1])
+        others = self.link_nodes[positions].astype(np.int64)
+        packed = self.link_predicates[positions]
+        if bare_predicates is not None:
+            rows = np.repeat(np.arange(len(nodes)), lengths)
+            keep = np.zeros(len(positions), dtype=bool)
+            groups = {}
+            for row, bares in enumerate(bare_predicates):
+                groups.setdefault(frozenset(bares), []).append(row)
+            for bares, group_rows in groups.items():
+                keep |= np.isin(rows, group_rows) & np.isin(packed >> 1, self._predicate_ids_for(bares))
+            others = others[keep]
+            packed = packed[keep]
+            row_offsets = np.concatenate(([0], np.cumsum(np.bincount(rows[keep], minlength=len(nodes)))))
+        predicates = self.predicates
+        links = [[curie, predicates[p >> 1], bool(p & 1)] for curie, p in zip(self.curies(others), packed.tolist())]
+        bounds = row_offsets.tolist()
+        return {node: links[bounds[k]:bounds[k + 1]] for k, node in enumerate(nodes)}
+
+    def links(self, nodes):
+        """{node: links}, like graph_data.load_links."""
+        return self._gather_links(list(dict.fromkeys(nodes)))
+
+    def link_partitions(self, node_to_predicates):
+        """{node: links} with only the links with the given bare predicates, like graph_data.load_link_partitions."""
+        nodes = list(node_to_predicates)
+        return self._gather_links(nodes, [node_to_predicates[node] for node in nodes])
+
+    def _category_list(self, words):
+        categories = self._category_lists.get(words)
+        if categories is None:
+            categories = []
+            for word_index, word in enumerate(words):
+                base = word_index * 64
+                while word:
+                    low = word & -word
+                    categories.append(self.categories[base + low.bit_length() - 1])
+                    word ^= low
+            self._category_lists[words] = categories
+        return categories
+
+    def node_metadata(self, nodes):
+        """({node: categories}, {node: name}), like graph_data.load_node_metadata."""
+        nodes = list(dict.fromkeys(nodes))
+        ids = self.node_ids(nodes)
+        found = ids >= 0
+        nodetypedict = {}
+        nodenames = {node: '' for node in nodes}
+        found_nodes = [node for node, ok in zip(nodes, found.tolist()) if ok]
+        found_ids = ids[found]
+        blob = self.names_blob
+        for node, words, s, e in zip(found_nodes, map(tuple, self.node_categories[found_ids].tolist()),
+                                     self.name_offsets[found_ids].tolist(), self.name_offsets[found_ids + 1].tolist()):
+            categories = self._category_list(words)
+            if categories:
+                # A copy, as the callers own what they get back
+                nodetypedict[node] = list(categories)
+            nodenames[node] = blob[s:e].decode('utf-8')
+        return nodetypedict, nodenames
+
+    def link_counts(self, unique_links):
+        """{link: count} for (node, predicate, node_is_source, category) tuples, like graph_data.load_link_counts."""
+        unique_links = list(unique_links)
+        ids = self.node_ids([link[0] for link in unique_links])
+        pids = np.fromiter((self.predicate_ids.get(link[1], -1) for link in unique_links), dtype=np.int64,
+                           count=len(unique_links))
+        cids = np.fromiter((self.category_ids.get(link[3], -1) for link in unique_links), dtype=np.int64,
+                           count=len(unique_links))
+        sources = np.fromiter((bool(link[2]) for link in unique_links), dtype=np.int64, count=len(unique_links))
+        known = (ids >= 0) & (pids >= 0) & (cids >= 0)
+        keys = (ids * self.npredicates + ((pids << 1) | sources)) * self.ncategories + cids
+        counts = np.zeros(len(unique_links), dtype=np.int64)
+        if len(self.count_keys):
+            j = np.searchsorted(self.count_keys, keys[known])
+            j_ok = j < len(self.count_keys)
+            j_ok[j_ok] = self.count_keys[j[j_ok]] == keys[known][j_ok]
+            known_counts = np.zeros(len(j), dtype=np.int64)
+            known_counts[j_ok] = self.count_values[j[j_ok]]
+            counts[known] = known_counts
+        return dict(zip(unique_links, counts.tolist()))
+
+    def prov_values(self, edges):
+        """The raw json provenance for "subject predicate object" keys, or None; like the db 4 values."""
+        split = [split_prov_key(edge) for edge in edges]
+        subject_ids = self.node_ids([subject for subject, _, _ in split]).tolist()
+        object_ids = self.node_ids([obj for _, _, obj in split]).tolist()
+        values = []
+        for (_, predicate, _), i, j in zip(split, subject_ids, object_ids):
+            pid = self.predicate_ids.get(predicate)
+            if i < 0 or j < 0 or pid is None:
+                values.append(None)
+                continue
+            start, end = int(self.link_starts[i]), int(self.link_ends[i])
+            matches = np.flatnonzero((self.link_nodes[start:end] == j) &
+                                     (self.link_predicates[start:end] == ((pid << 1) | 1)))
+            if len(matches) == 0:
+                values.append(None)
+                continue
+            position = start + int(matches[0])
+            prov_start, prov_end = int(self.prov_starts[position]), int(self.prov_ends[position])
+            values.append(self.prov_blob[prov_start:prov_end] if prov_end > prov_start else None)
+        return values
+
+    def category_count_values(self, categories):
+        """The db 5 category counts, as strings, or None."""
+        return [(str(self.category_counts[c]) if c in self.category_counts else None) for c in categories]
+
+    def close(self):
+        for blob in (self.nodes_blob, self.names_blob, self.prov_blob):
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    ap = argparse.ArgumentParser(description='Build a memory-mapped CSR store from generate_ac_files outputs.')
+    ap.add_argument('-d', '--datadir', help='Directory holding the generate_ac_files outputs', required=True)
+    ap.add_argument('-o', '--outdir', help='Directory to write the store to', required=True)
+    ap.add_argument('--prefix', help='File name prefix, e.g. test_ for the test fixtures', default='')
+    args = ap.parse_args()
+    build_csr_store(args.datadir, args.outdir, args.prefix)
@@ -1,51 +1,37 @@
 from collections import defaultdict
-from scipy.stats import hypergeom, poisson, binom, norm
+from itertools import chain, count
+from operator import itemgetter
 from src.components import Enrichment
 from src.util import LoggingUtil
+from src.graph_coalescence.graph_data import grouper, check_prov_value_type, get_edge_symmetric
+from src.graph_coalescence.predicates import PredicateMatcher, get_predicate_registry
+from src.graph_coalescence.categories import get_category_bits
+from src.graph_coalescence.hubs import HubPruning, get_hub_policy
+from src.graph_coalescence.link_filter import BLOCKLIST, LinkFilter
+from src.graph_coalescence.predicate_hierarchy import filter_result_hierarchies
+from src.graph_coalescence.link_store import get_link_store
+from src.graph_coalescence.member_set_cache import MemberSetState, get_member_set_cache
+from src.graph_coalescence.redis_pool import load_config
+from src.pvalue_cache import cached_sf_and_log_sf, get_pvalue_cache
+from src.enrichment_pool import get_enrichment_pool, pack_node_sets, run_in_pool, unpack_node_sets
+import asyncio
+import heapq
 import logging
-import os
-import redis
-from redis.backoff import ExponentialBackoff
-from redis.retry import Retry
-import redis.exceptions
-import json
-import ast
-import itertools
+import numpy as np
 import orjson
-import bmt
+from scipy.sparse import csc_matrix
+import os
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
 
 logger = LoggingUtil.init_logging('graph_coalescer', level=logging.WARNING, format='long', logFilePath=this_dir + '/')
-tk = bmt.Toolkit()
-
-
-def grouper(n, iterable):
-    it = iter(iterable)
-    while True:
-        chunk = tuple(itertools.islice(it, n))
-        if not chunk:
-            break
-        yield chunk
-
-
-def get_redis_pipeline(dbnum):
-    jpath = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'config.json')
-    with open(jpath, 'r') as inf:
-        conf = json.load(inf)
-    retry = Retry(ExponentialBackoff(cap=10, base=0.5), retries=5)
-    kwargs = dict(
-        host=conf['redis_host'],
-        port=int(conf['redis_port']),
-        db=dbnum,
-        retry=retry,
-        retry_on_error=[redis.exceptions.BusyLoadingError, redis.exceptions.ConnectionError, redis.exceptions.TimeoutError],
-    )
-    if 'redis_password' in conf and len(conf['redis_password']) > 0:
-        kwargs['password'] = conf['redis_password']
-    typeredis = redis.Redis(**kwargs)
-    p = typeredis.pipeline(transaction=False)
-    return p
+DEFAULT_SCORING_ENGINE = 'poisson'
+ENRICHMENT_ENGINES = ('dict', 'sparse')
+DEFAULT_ENRICHMENT_ENGINE = 'dict'
+
+# Build the predicate tables and the category bits now rather than in the first request
+get_predicate_registry()
+get_category_bits()
 
 
 def filter_links_by_predicate(nodes_to_links, predicate_constraints, predicate_constraint_style, match_type="exact"):
@@ -67,35 +53,10 @@ def filter_links_by_predicate(nodes_to_links, predicate_constraints, predicate_c
     """
     if len(predicate_constraints) == 0:
         return nodes_to_links
-
-    def matches_constraint(link_str, constraint, match_type):
-        try:
-            link_dict = json.loads(link_str)
-        except (json.JSONDecodeError, TypeError):
-            return False
-        if match_type == "exact":
-            # all keys and values must match exactly
-            return all(link_dict.get(k) == v for k, v in constraint.items())
-        elif match_type == "partial":
-            # only match on predicate key, ignore additional qualifiers in link
-            return link_dict.get("predicate") == constraint.get("predicate")
-        return False
-
-    new_nodes_to_links = {}
-    for node, links in nodes_to_links.items():
-        new_links = []
-        for link in links:
-            matched = any(
-                matches_constraint(link[1], constraint, match_type)
-                for constraint in predicate_constraints
-            )
-            if predicate_constraint_style == "include" and matched:
-                new_links.append(link)
-            elif predicate_constraint_style == "exclude" and not matched:
-                new_links.append(link)
-        new_nodes_to_links[node] = new_links
-
-    return new_nodes_to_links
+    if predicate_constraint_style not in ("include", "exclude"):
+        return {node: [] for node in nodes_to_links}
+    return filter_links_by_matcher(nodes_to_links, PredicateMatcher(predicate_constraints, match_type),
+                                   keep=predicate_constraint_style == "include")
 
 
 def filter_links_by_context(nodes_to_links, context_qualifiers):
@@ -106,38 +67,30 @@ def filter_links_by_context(nodes_to_links, context_qualifiers):
     """
     if not context_qualifiers:
         return nodes_to_links
-    new_nodes_to_links = {}
-    for node, links in nodes_to_links.items():
-        new_links = []
-        for link in links:
-            try:
-                link_dict = orjson.loads(link[1])
-            except (ValueError, TypeError):
-                continue
-            if all(link_dict.get(k) == v for k, v in context_qualifiers.items()):
-                new_links.append(link)
-        new_nodes_to_links[node] = new_links
-    return new_nodes_to_links
+    return filter_links_by_matcher(nodes_to_links, PredicateMatcher(context_qualifiers=context_qualifiers))
+
+
+def filter_links_by_matcher(nodes_to_links, matcher, keep=True):
+    """The links whose predicate meets the constraints of a PredicateMatcher (or with keep=False, doesn't)."""
+    return {node: matcher.filter(links, keep) for node, links in nodes_to_links.items()}
 
 
 def filter_links_by_node_type(nodes_to_links, node_constraints, link_node_types):
     """Filter out links that don't meet the node constraints
     node constraints is a list of acceptable node types for the returned nodes.  The node type of the other node
     in the links is used to determine if the link is kept.  Fortunately, link_node_types holds all of the superclasses
-    of the node type, so we can just check if the link node type is in the set of acceptable types.
+    of the node type, so we can just check if the link node type is in the set of acceptable types.  That check is
+    an AND of category bitmasks (see categories), with the mask of each link node worked out once.
 
-    Also, we want to filter out links that end up with block-list nodes
+    Also, we want to filter out links that end up with block-list nodes (BLOCKLIST)
     """
-    # These are trash curies that we never want to see
-    blocklist = {"HP:0000118", "MONDO:0000001", "MONDO:0700096", "UMLS:C1333305", "CHEBI:24431", "CHEBI:23367",
-                 "CHEBI:33579", "CHEBI:36357", "CHEBI:33675", "CHEBI:33302", "CHEBI:33304", "CHEBI:33582",
-                 "CHEBI:25806", "CHEBI:50860", "CHEBI:51143", "CHEBI:32988", "CHEBI:33285", "CHEBI:33256",
-                 "CHEBI:36962", "CHEBI:35352", "CHEBI:36963", "CHEBI:25367", "CHEBI:72695", "CHEBI:33595",
-                 "CHEBI:33832", "CHEBI:37577", "CHEBI:24532", "CHEBI:5686", "NCBITaxon:9606"}
 
     # Collect the accepted types, which are any subclass of what gets passed into node constraints.
     # We're going to special case named thing - if that's in there, we just bypass all the type checks.
     accept_all_types = ("biolink:NamedThing" in node_constraints)
+    category_bits = get_category_bits()
+    accepted_mask = category_bits.mask(node_constraints)
+    node_masks = {}
 
     new_nodes_to_links = {}
     for node, links in nodes_to_links.items():
@@ -147,15 +100,17 @@ def filter_links_by_node_type(nodes_to_links, node_constraints, link_node_types)
                 othernode = link[0]
             else:
                 othernode = link
-            if othernode in blocklist:
+            if othernode in BLOCKLIST:
                 continue
             if accept_all_types:
                 new_links.append(link)
             else:
                 # we have 2 lists: node constraints and link_node_types_othernode.  We want to see if there is any overlap
                 # between the two lists.  If there is, then we want to keep the link.
-                accepted_types = set(node_constraints) & set(link_node_types[othernode])
-                if len(accepted_types) > 0:
+                node_mask = node_masks.get(othernode)
+                if node_mask is None:
+                    node_mask = node_masks[othernode] = category_bits.mask(link_node_types[othernode])
+                if node_mask & accepted_mask:
                     new_links.append(link)
         new_nodes_to_links[node] = new_links
 
@@ -165,7 +120,8 @@ def filter_links_by_node_type(nodes_to_links, node_constraints, link_node_types)
 async def coalesce_by_graph(input_ids, input_node_type,
                             node_constraints=None, predicate_constraints=None, predicate_constraint_style="exclude",
                             pvalue_threshold=None, max_results=None, filter_predicate_hierarchies=False,
-                            context_qualifiers=None):
+                            context_qualifiers=None, scoring_engine=None, exclude_ids=None, enrichment_engine=None,
+                            incremental=False, hub_pruning=None):
     """
     Given a list of input_ids, find nodes that are enriched.
     Return a list of Enrichment objects describing each enrichment.
@@ -182,171 +138,272 @@ async def coalesce_by_graph(input_ids, input_node_type,
     max_results determines if we want more answers than we started with, so we need to parameterize.
     filter_predicate_hierarchies mainly in edgar to exclude/add symmetric edges inline
     (in create_node_to_link) and filter predicate hierarchies in get_enriched_link enrichment_results
+    scoring_engine picks the distribution for the p-values: "poisson" (the default), "binom" or "hypergeom".
+    exclude_ids are nodes that are not to be returned as enriched nodes (e.g. the inputs of an EDGAR query).
+    enrichment_engine is "dict" or "sparse" (see get_enriched_links), by default the one in config.json.
+    incremental lets the enrichment start from a recent input set that overlaps this one, when the member set cache
+    is on (see member_set_cache); the enrichments are the same either way.
+    hub_pruning, a hubs.HubPruning, counts the links to hubs that the hub policy in config.json pruned (see hubs).
     """
     logger.info(f'Start of processing.')
     if node_constraints is None:
         node_constraints = ["biolink:NamedThing"]
     if predicate_constraints is None:
         predicate_constraints = []
-    # Get the links for all the input nodes
-    nodes_to_links = create_nodes_to_links(input_ids)
-    # Filter by context qualifiers if the query specifies them (e.g. species_context_qualifier)
-    if context_qualifiers:
-        nodes_to_links = filter_links_by_context(nodes_to_links, context_qualifiers)
-    # We don't want to do the exlusion here because we want to do it after we've found the enrichments
-    # But we can narrow down by the inclusion constraints
-    if predicate_constraint_style == "include":
-        nodes_to_links = filter_links_by_predicate(nodes_to_links, predicate_constraints, predicate_constraint_style)
-    # Find the unique link nodes and get their types
-    unique_link_nodes, unique_links = uniquify_links(nodes_to_links, input_node_type)
-    nodetypedict = get_node_types(unique_link_nodes)
-    # Now that we know the types, get rid of any links that don't meet the node constraints.
-    # For EDGAR, the default node constraint of NamedThing will let everything be used.
-    nodes_to_links = filter_links_by_node_type(nodes_to_links, node_constraints, nodetypedict)
-    # Having filtered some links out, we need to recompute the unique links
-    unique_link_nodes, unique_links = uniquify_links(nodes_to_links, input_node_type)
-    lcounts = get_link_counts(unique_links)
-
-    total_node_counts = get_total_node_counts(input_node_type)
+    store = get_link_store()
+    settings = enrichment_settings(predicate_constraints, predicate_constraint_style, filter_predicate_hierarchies,
+                                   scoring_engine, pvalue_threshold, max_results, enrichment_engine)
+    filters = (node_constraints, predicate_constraints, predicate_constraint_style, context_qualifiers, exclude_ids)
+    member_sets = get_member_set_cache() if incremental else None
+    # Incremental enrichment keeps the links of each member on their own, which the (EDGAR) predicate hierarchy
+    # exclusions, looking across members, and repeated members don't fit
+    if member_sets is not None and member_sets.enabled and len(set(input_ids)) == len(input_ids) and \
+            not (filter_predicate_hierarchies and predicate_constraint_style == 'exclude'):
+        state = await member_set_state(member_sets, store, input_ids, input_node_type, *filters)
+        if hub_pruning is not None:
+            for node in input_ids:
+                hub_pruning.add(node, state.hub_pruned.get(node, 0))
+        selected = await asyncio.to_thread(select_member_set_links, state, input_ids, input_node_type,
+                                           get_pvalue_cache(), *settings[2:6])
+        nodetypedict = state.table.nodetypedict
+        enriched_links = build_enrichments(selected, len(input_ids),
+                                           state.total_node_counts[input_node_type], nodetypedict)
+        await augment_enrichments_async(enriched_links, nodetypedict, state.table.nodenamedict)
+        return enriched_links
+
+    nodetypedict, nodenamedict, lcounts = {}, {}, {}
+    nodes_to_links = await fetch_filtered_links(store, input_ids, input_node_type, *filters,
+                                                nodetypedict, nodenamedict, lcounts, hub_pruning)
+
+    total_node_counts = await store.fetch_total_node_counts(input_node_type)
+    return await enrich_fetched_links(input_ids, input_node_type, nodes_to_links, lcounts, nodetypedict, nodenamedict,
+                                      total_node_counts, settings)
+
+
+async def coalesce_batch_by_graph(queries):
+    """coalesce_by_graph for each of queries, dicts of its keyword arguments other than incremental, as a list of
+    enrichment lists in the same order.
+
+    The queries share their fetches.  The links of all their inputs are fetched together (one fetch for each set of
+    predicates that the queries' include constraints ask for, so that each query sees its links in the order that
+    it would on its own), then the metadata of all their link nodes, then the counts of all their links, and the total
+    node counts of each input type, each once.  The enrichments then run side by side."""
+    if not queries:
+        return []
+    store = get_link_store()
+    queries = [batch_query_arguments(**query) for query in queries]
+    # Group the inputs by the link partitions they need; None for whole link lists
+    predicate_groups = {}
+    for query in queries:
+        bare_predicates = link_fetch_predicates(query['predicate_constraints'], query['predicate_constraint_style'])
+        key = tuple(bare_predicates) if bare_predicates else None
+        predicate_groups.setdefault(key, {}).update(dict.fromkeys(query['input_ids']))
+    fetched = await asyncio.gather(*[store.fetch_links(list(nodes)) if key is None
+                                     else store.fetch_link_partitions({node: list(key) for node in nodes})
+                                     for key, nodes in predicate_groups.items()])
+    group_links = dict(zip(predicate_groups, fetched))
+    # A store that can't split the links by predicate gives None for a group; its whole link lists are fetched instead
+    unsplit = [key for key, links in group_links.items() if links is None]
+    if unsplit:
+        fetched = await asyncio.gather(*[store.fetch_links(list(predicate_groups[key])) for key in unsplit])
+        group_links.update(zip(unsplit, fetched))
+
+    degree_index = await store.fetch_degree_index() if get_hub_policy().active else None
+    link_filters = []
+    query_links = []
+    link_nodes = set()
+    for query in queries:
+        bare_predicates = link_fetch_predicates(query['predicate_constraints'], query['predicate_constraint_style'])
+        links = group_links[tuple(bare_predicates) if bare_predicates else None]
+        link_filter = LinkFilter(query['input_node_type'], query['node_constraints'], query['predicate_constraints'],
+                                 query['predicate_constraint_style'], query['context_qualifiers'],
+                                 query['exclude_ids'], degree_index, query['hub_pruning'])
+        nodes_to_links, query_link_nodes = link_filter.first_pass({node: links[node] for node in query['input_ids']})
+        link_filters.append(link_filter)
+        query_links.append(nodes_to_links)
+        link_nodes |= query_link_nodes
+    nodetypedict, nodenamedict, lcounts = {}, {}, {}
+    await fetch_missing_node_metadata(store, link_nodes, nodetypedict, nodenamedict)
+
+    query_links, query_unique_links = zip(*[link_filter.second_pass(nodes_to_links, nodetypedict)
+                                            for link_filter, nodes_to_links in zip(link_filters, query_links)])
+    await fetch_missing_link_counts(store, set().union(*query_unique_links), lcounts)
+    input_types = list(dict.fromkeys(query['input_node_type'] for query in queries))
+    total_node_counts = dict(zip(input_types, await asyncio.gather(*map(store.fetch_total_node_counts,
+                                                                        input_types))))
+    logger.info(f'Batch of {len(queries)} queries: {sum(map(len, group_links.values()))} link lists, '
+                f'{len(link_nodes)} link nodes and {len(lcounts)} link counts fetched.')
+
+    return await asyncio.gather(*[
+        enrich_fetched_links(query['input_ids'], query['input_node_type'], nodes_to_links,
+                             {link: lcounts[link] for link in unique_links}, nodetypedict, nodenamedict,
+                             total_node_counts[query['input_node_type']],
+                             enrichment_settings(query['predicate_constraints'], query['predicate_constraint_style'],
+                                                 query['filter_predicate_hierarchies'], query['scoring_engine'],
+                                                 query['pvalue_threshold'], query['max_results'],
+                                                 query['enrichment_engine']))
+        for query, nodes_to_links, unique_links in zip(queries, query_links, query_unique_links)])
+
+
+def batch_query_arguments(input_ids, input_node_type, node_constraints=None, predicate_constraints=None,
+                          predicate_constraint_style="exclude", pvalue_threshold=None, max_results=None,
+                          filter_predicate_hierarchies=False, context_qualifiers=None, scoring_engine=None,
+                          exclude_ids=None, enrichment_engine=None, hub_pruning=None):
+    """The coalesce_by_graph arguments of a coalesce_batch_by_graph query, with the defaults filled in."""
+    if node_constraints is None:
+        node_constraints = ["biolink:NamedThing"]
+    if predicate_constraints is None:
+        predicate_constraints = []
+    return {'input_ids': input_ids, 'input_node_type': input_node_type, 'node_constraints': node_constraints,
+            'predicate_constraints': predicate_constraints, 'predicate_constraint_style': predicate_constraint_style,
+            'pvalue_threshold': pvalue_threshold, 'max_results': max_results,
+            'filter_predicate_hierarchies': filter_predicate_hierarchies, 'context_qualifiers': context_qualifiers,
+            'scoring_engine': scoring_engine, 'exclude_ids': exclude_ids, 'enrichment_engine': enrichment_engine,
+            'hub_pruning': hub_pruning}
 
-    # In a test from test_bigs, we can see that we call sf 1.46M times.  But, we only call with 250k unique parametersets
-    # so we're gonna cache those
-    sf_cache = {}
 
-    enriched_links = get_enriched_links(input_ids, input_node_type, nodes_to_links, lcounts, sf_cache, nodetypedict,
-                                        total_node_counts, predicate_constraints, predicate_constraint_style,
-                                        filter_predicate_hierarchies)
+def enrichment_settings(predicate_constraints, predicate_constraint_style, filter_predicate_hierarchies,
+                        scoring_engine, pvalue_threshold, max_results, enrichment_engine):
+    """The get_enriched_links arguments after total_node_counts, with the defaults filled in."""
+    return (predicate_constraints, predicate_constraint_style, filter_predicate_hierarchies,
+            scoring_engine or DEFAULT_SCORING_ENGINE, pvalue_threshold, max_results,
+            enrichment_engine or load_config().get('enrichment_engine', DEFAULT_ENRICHMENT_ENGINE))
 
-    if pvalue_threshold:
-        enriched_links = [link for link in enriched_links if link.p_value < pvalue_threshold]
-    if max_results:
-        enriched_links = enriched_links[:max_results]
 
-    augment_enrichments(enriched_links, nodetypedict)
+async def enrich_fetched_links(input_ids, input_node_type, nodes_to_links, lcounts, nodetypedict, nodenamedict,
+                               total_node_counts, settings):
+    """The enrichments for the fetched and filtered links of input_ids, named; settings from enrichment_settings."""
+    # In a test from test_bigs, we can see that we call sf 1.46M times.  But, we only call with 250k unique parametersets
+    # so we're gonna cache those, in a cache that later requests share
+    sf_cache = get_pvalue_cache()
+
+    # The enrichment itself is pure CPU, so keep it off the event loop, in a thread or in the enrichment process pool.
+    # The threshold and the limit go along, so that the enrichments that would be cut don't get built, or named, or
+    # have their provenance fetched.
+    if get_enrichment_pool() is None:
+        enriched_links = await asyncio.to_thread(get_enriched_links, input_ids, input_node_type, nodes_to_links,
+                                                 lcounts, sf_cache, nodetypedict, total_node_counts, *settings)
+    else:
+        packed = await asyncio.to_thread(pack_enrichment_inputs, input_ids, input_node_type, nodes_to_links, lcounts,
+                                         total_node_counts)
+        result = await run_in_pool(select_packed_enriched_links, packed, *settings)
+        enriched_links = build_enrichments(unpack_selected_links(result, packed), len(input_ids),
+                                           total_node_counts[input_node_type], nodetypedict)
+
+    await augment_enrichments_async(enriched_links, nodetypedict, nodenamedict)
 
     return enriched_links
 
 
-def augment_enrichments(enriched_links, nodetypes):
+async def fetch_filtered_links(store, input_ids, input_node_type, node_constraints, predicate_constraints,
+                               predicate_constraint_style, context_qualifiers, exclude_ids, nodetypedict, nodenamedict,
+                               lcounts, hub_pruning=None):
+    """The links of input_ids that can become enrichments under the constraints, as {node: links}.  The metadata of
+    the nodes they link to goes into nodetypedict and nodenamedict, and their counts into lcounts; whatever those
+    already hold isn't fetched again.  Links to hubs are pruned under the hub policy, and counted in hub_pruning."""
+    if not input_ids:
+        return {}
+    # Get the links for all the input nodes.  With include constraints, only the matching predicates are needed.
+    # Stores that can't split the links by predicate (e.g. redis without the partitions) give None, and the whole
+    # link lists are fetched instead.
+    nodes_to_links = None
+    bare_predicates = link_fetch_predicates(predicate_constraints, predicate_constraint_style)
+    if bare_predicates:
+        nodes_to_links = await store.fetch_link_partitions({node: bare_predicates for node in input_ids})
+    if nodes_to_links is None:
+        nodes_to_links = await store.fetch_links(input_ids)
+    degree_index = await store.fetch_degree_index() if get_hub_policy().active else None
+    link_filter = LinkFilter(input_node_type, node_constraints, predicate_constraints, predicate_constraint_style,
+                             context_qualifiers, exclude_ids, degree_index, hub_pruning)
+    # Everything that doesn't need the link node types, finding the link nodes as it goes
+    nodes_to_links, unique_link_nodes = link_filter.first_pass(nodes_to_links)
+    # Names come back with the types, so there's no separate name lookup for the enriched nodes later
+    await fetch_missing_node_metadata(store, unique_link_nodes, nodetypedict, nodenamedict)
+    # Now that we know the types, get rid of any links that don't meet the node constraints, finding the unique links
+    # as it goes.  For EDGAR, the default node constraint of NamedThing will let everything be used.
+    nodes_to_links, unique_links = link_filter.second_pass(nodes_to_links, nodetypedict)
+    logger.info(f'Links dropped by filter: {link_filter.drops}')
+    await fetch_missing_link_counts(store, unique_links, lcounts)
+    return nodes_to_links
+
+
+def link_fetch_predicates(predicate_constraints, predicate_constraint_style):
+    """The bare predicates to fetch link partitions for, or None when whole link lists are needed."""
+    if predicate_constraint_style == "include":
+        return constraint_bare_predicates(predicate_constraints)
+    return None
+
+
+async def fetch_missing_node_metadata(store, nodes, nodetypedict, nodenamedict):
+    """Add the metadata of the nodes that nodenamedict doesn't have yet to nodetypedict and nodenamedict."""
+    new_nodes = [node for node in nodes if node not in nodenamedict]
+    if new_nodes:
+        new_types, new_names = await store.fetch_node_metadata(new_nodes)
+        nodetypedict.update(new_types)
+        nodenamedict.update(new_names)
+
+
+async def fetch_missing_link_counts(store, unique_links, lcounts):
+    """Add the counts of the links that lcounts doesn't have yet to lcounts."""
+    new_links = [link for link in unique_links if link not in lcounts]
+    if new_links:
+        lcounts.update(await store.fetch_link_counts(new_links))
+
+
+def augment_enrichments(enriched_links, nodetypes, nodenamedict=None):
     """Having found the set of enrichments we want to return, make sure that each enrichment has the node name and the node type."""
-    enriched_curies = set([link.enriched_node.new_curie for link in enriched_links])
-    nodenamedict = get_node_names(enriched_curies)
+    if nodenamedict is None:
+        enriched_curies = set([link.enriched_node.new_curie for link in enriched_links])
+        nodenamedict = get_node_names(enriched_curies)
     for enrichment in enriched_links:
         enrichment.add_extra_node_name_and_label(nodenamedict, nodetypes)
     add_provs(enriched_links)
 
 
-def add_provs(enrichments):
-    def process_prov(prov_data):
-        if isinstance(prov_data, (str, bytes)):
-            prov_data = orjson.loads(prov_data)
-        return [{'resource_id': check_prov_value_type(v), 'resource_role': check_prov_value_type(k)} for k, v in
-                prov_data.items()]
+async def augment_enrichments_async(enriched_links, nodetypes, nodenamedict=None):
+    """augment_enrichments, fetching the names and provenance with the asyncio data access layer."""
+    if nodenamedict is None:
+        enriched_curies = set([link.enriched_node.new_curie for link in enriched_links])
+        nodenamedict = (await get_link_store().fetch_node_metadata(enriched_curies))[1]
+    for enrichment in enriched_links:
+        enrichment.add_extra_node_name_and_label(nodenamedict, nodetypes)
+    prov = await get_link_store().fetch_provs(collect_prov_links(enriched_links))
+    for enrichment in enriched_links:
+        enrichment.add_provenance(prov)
+
 
-    # Collect and deduplicate edges before hitting Redis
+def collect_prov_links(enrichments):
+    # Collect and deduplicate edges before hitting the store
     all_edges = set()
     for enrichment in enrichments:
         all_edges.update(enrichment.get_prov_links())
-    unique_edges = list(all_edges)
-
-    prov = {}
-
-    with get_redis_pipeline(4) as p:
-        for edgegroup in grouper(1000, unique_edges):
-            for edge in edgegroup:
-                p.get(edge)
-            ns = p.execute()
-            symmetric_edges = []
-            inverted_to_original = {}
-            for edge, n in zip(edgegroup, ns):
-                if n:
-                    prov[edge] = process_prov(n)
-                else:
-                    inverted = get_edge_symmetric(edge)
-                    symmetric_edges.append(inverted)
-                    inverted_to_original[inverted] = edge
-            if symmetric_edges:
-                for sym_edge in symmetric_edges:
-                    p.get(sym_edge)
-                sym_ns = p.execute()
-                for sym_edge, sn in zip(symmetric_edges, sym_ns):
-                    original = inverted_to_original[sym_edge]
-                    if sn:
-                        prov[original] = process_prov(sn)
-                    else:
-                        prov[original] = []
+    return list(all_edges)
+
+
+def add_provs(enrichments):
+    prov = get_link_store().provs(collect_prov_links(enrichments))
 
     for enrichment in enrichments:
         enrichment.add_provenance(prov)
 
 
 def get_node_types(unique_link_nodes):
-    # p = get_redis_pipeline(1)
-    nodetypedict = {}
-    with get_redis_pipeline(1) as p:
-        for ncg in grouper(2000, unique_link_nodes):
-            for newcurie in ncg:
-                p.get(newcurie)
-            all_typestrings = p.execute()
-            for newcurie, nodetypestring in zip(ncg, all_typestrings):
-                if nodetypestring:
-                    node_types = ast.literal_eval(nodetypestring.decode())
-                    nodetypedict[newcurie] = node_types
-    return nodetypedict
+    return get_link_store().node_metadata(unique_link_nodes)[0]
+
+
+def get_node_metadata(nodes):
+    """({node: categories}, {node: name}) in one lookup; see LinkStore.node_metadata."""
+    return get_link_store().node_metadata(nodes)
 
 
 def get_node_names(unique_link_nodes):
-    # p = get_redis_pipeline(3)
-    nodenames = {}
-    with get_redis_pipeline(3) as p:
-        for ncg in grouper(1000, unique_link_nodes):
-            for newcurie in ncg:
-                p.get(newcurie)
-            all_names = p.execute()
-            for newcurie, name in zip(ncg, all_names):
-                try:
-                    nodenames[newcurie] = name.decode('UTF-8')
-                except:
-                    nodenames[newcurie] = ''
-    return nodenames
+    return get_link_store().node_metadata(unique_link_nodes)[1]
 
 
 def get_link_counts(unique_links):
-    # Now we are going to hit redis to get the counts for all of the links.
+    # Now we are going to hit the store to get the counts for all of the links.
     # our unique_links are the keys
-    # p = get_redis_pipeline(2)
-    lcounts = {}
-    with get_redis_pipeline(2) as p:
-        for ulg in grouper(1000, unique_links):
-            for ul in ulg:
-                s = str(ul)
-                p.get(s)
-            ns = p.execute()
-            for ul, n in zip(ulg, ns):
-                try:
-                    lcounts[ul] = int(n)
-                except:
-                    # this can happen becuase we're inferring the category type from the qgraph.  But if we have 0 we have 0
-                    lcounts[ul] = 0
-    return lcounts
-
-
-def check_prov_value_type(value):
-    if isinstance(value, list):
-        val = ','.join(value)
-    else:
-        val = value
-    # I noticed some values are lists eg. ['infores:sri-reference-kg']
-    # This function coerce such to string
-    # Also, the newer pydantic accepts 'primary_knowledge_source' instead of 'biolink:primary_knowledge_source' in the old
-    return val.replace('biolink:', '')
-
-
-def get_edge_symmetric(edge):
-    subject, b = edge.split('{')
-    edge_predicate, obj = b.split('}')
-    edge_predicate = '{' + edge_predicate + '}'
-    return f'{obj.lstrip()} {edge_predicate} {subject.rstrip()}'
+    return get_link_store().link_counts(unique_links)
 
 
 def filter_opportunities(opportunities, nodes_to_links):
@@ -366,17 +423,14 @@ def uniquify_links(nodes_to_links, input_type):
     # Create the total unique set of links
     unique_links = set()
     unique_link_nodes = set()
-    #This is for caching the edge types as symmetric or not because we are parsing json every time.
-    predicate_is_symmetric = {}
+    registry = get_predicate_registry()
     for n in nodes_to_links:
         for l in nodes_to_links[n]:
             # The link as defined uses the input node as is_source, but the lookup into redis uses the
             # linked node as the is_source, so gotta flip it.   But there is a gross wrinkle here - if the
             # link is symmetric, then we want the link to always be "True" (Don't flip if it already says True)
             lplus = l + [input_type]
-            if (l[1] not in predicate_is_symmetric):
-                predicate_is_symmetric[l[1]] = predicate_string_is_symmetric(l[1])
-            if predicate_is_symmetric[l[1]]:
+            if registry.info(l[1]).symmetric:
                 lplus[2] = True
             else:
                 lplus[2] = not lplus[2]
@@ -388,19 +442,22 @@ def uniquify_links(nodes_to_links, input_type):
 
 def predicate_string_is_symmetric(predicate: str) -> bool:
     """Check if a predicate string is symmetric. The predicate here is the whole qualified mess as a string"""
-    bare_predicate = orjson.loads(predicate)["predicate"]
-    element = tk.get_element(bare_predicate)
-    if element is None:
-        return False
-    return element["symmetric"] is True
+    return get_predicate_registry().info(predicate).symmetric
 
 
 def predicate_matches(param_predicate_str, link_predicate_str):
     """Check if a param predicate's key-value pairs are all present in the link predicate.
     This handles the new DB format where links have extra context qualifiers."""
-    param_dict = orjson.loads(param_predicate_str)
-    link_dict = orjson.loads(link_predicate_str)
-    return param_dict.items() <= link_dict.items()
+    return get_predicate_registry().matches(param_predicate_str, link_predicate_str)
+
+
+def constraint_bare_predicates(predicate_constraints):
+    """The bare predicates that links must have to meet include-style predicate constraints, or None if there is
+    a constraint that doesn't name one (so whole link lists are needed)."""
+    bare_predicates = [constraint.get("predicate") for constraint in predicate_constraints]
+    if not bare_predicates or not all(bare_predicates):
+        return None
+    return bare_predicates
 
 
 def create_nodes_to_links(allnodes, param_predicates=[]):
@@ -425,23 +482,30 @@ def create_nodes_to_links(allnodes, param_predicates=[]):
 
     unique_nodes = list(dict.fromkeys(allnodes))
 
-    with get_redis_pipeline(0) as p:
-        for group in grouper(1000, unique_nodes):
-            for node in group:
-                p.get(node)
-            linkstrings = p.execute()
-            for node, linkstring in zip(group, linkstrings):
-                if linkstring is None:
-                    links = []
-                else:
-                    links = orjson.loads(linkstring)
-                predicates_for_node = node_to_predicates.get(node)
-                if predicates_for_node:
-                    nodes_to_links[node] = [link for link in links
-                                            if any(predicate_matches(pp, link[1])
-                                                   for pp in predicates_for_node)]
-                else:
-                    nodes_to_links[node] = links
+    # When every node has predicates, only the links with their bare predicates are needed
+    loaded = None
+    if node_to_predicates:
+        registry = get_predicate_registry()
+        node_to_bare = {node: [registry.bare(pp) for pp in predicates]
+                        for node, predicates in node_to_predicates.items()}
+        if all(all(bares) for bares in node_to_bare.values()):
+            loaded = get_link_store().link_partitions(node_to_bare)
+    if loaded is None:
+        loaded = get_link_store().links(unique_nodes)
+
+    # One matcher for each distinct list of predicates, shared by the nodes that have it
+    registry = get_predicate_registry()
+    matchers = {}
+    for node, links in loaded.items():
+        predicates_for_node = node_to_predicates.get(node)
+        if predicates_for_node:
+            key = tuple(predicates_for_node)
+            matcher = matchers.get(key)
+            if matcher is None:
+                matcher = matchers[key] = PredicateMatcher([registry.info(pp).parsed for pp in dict.fromkeys(key)])
+            nodes_to_links[node] = matcher.filter(links)
+        else:
+            nodes_to_links[node] = links
     return nodes_to_links
 
 
@@ -490,121 +554,463 @@ def enrich_equal_qnode(qnode_hash, best_enrich_node):
 
 def get_enriched_links(nodes, semantic_type, nodes_to_links, lcounts, sfcache, typecache, total_node_counts,
                        predicate_constraints=None, predicate_constraint_style='exclude',
-                       filter_predicate_hierarchies=False):
+                       filter_predicate_hierarchies=False, scoring_engine=DEFAULT_SCORING_ENGINE,
+                       pvalue_threshold=None, max_results=None, enrichment_engine=DEFAULT_ENRICHMENT_ENGINE):
     """Given a set of nodes and the links that they share, as well as some counts, return the enrichments based
     on the links.
     If you want to restrict the answers, then you filter nodes_to_links ahead of time.'
     The enrichments are of the form
     (enrichp, newcurie, predicate, is_source, ndraws, n, total_node_count, nodeset, node_types)
-    and are sorted so that the lowest p-values (best enrichment) are first.  The enrichp is the pvalue of the enrichment.
+    and are sorted so that the lowest p-values (best enrichment) are first.  The enrichp is the pvalue of the enrichment,
+    from the scoring_engine distribution ("poisson", "binom" or "hypergeom").
+    Only enrichments with a p-value below pvalue_threshold are returned, and only the max_results best of those; the
+    rest are never built.
+    enrichment_engine is how the links are grouped by the input nodes that share them: "dict" or "sparse" (see
+    sparse_links_by_nodeset); both give the same enrichments.
     """
+    selected = select_enriched_links(nodes, semantic_type, nodes_to_links, lcounts, sfcache, total_node_counts,
+                                     predicate_constraints, predicate_constraint_style, filter_predicate_hierarchies,
+                                     scoring_engine, pvalue_threshold, max_results, enrichment_engine)
+    return build_enrichments(selected, len(nodes), total_node_counts[semantic_type], typecache)
+
+
+def build_enrichments(selected, ndraws, total_node_count, typecache):
+    """Enrichments for select_enriched_links output."""
+    # get the real labels/types of the enriched node
+    return [Enrichment(p_value, newcurie, predicate, newcurie_is_source, ndraws, n, total_node_count, nodeset,
+                       typecache[newcurie])
+            for p_value, newcurie, predicate, newcurie_is_source, n, nodeset in selected]
+
+
+def select_enriched_links(nodes, semantic_type, nodes_to_links, lcounts, sfcache, total_node_counts,
+                          predicate_constraints=None, predicate_constraint_style='exclude',
+                          filter_predicate_hierarchies=False, scoring_engine=DEFAULT_SCORING_ENGINE,
+                          pvalue_threshold=None, max_results=None, enrichment_engine=DEFAULT_ENRICHMENT_ENGINE):
+    """The work of get_enriched_links, without the Enrichments: a list of
+    (p_value, newcurie, predicate, newcurie_is_source, n, nodeset) in get_enriched_links order."""
     logger.info(f'{len(nodes)} enriched node links to process.')
 
     # Get the most enriched connected node for a group of nodes.
     logger.debug('start get_shared_links()')
 
-    constraint_triples = {}
-    links_to_nodes = defaultdict(list)
-    for node in nodes:
-        for link in nodes_to_links[node]:
-            links_to_nodes[tuple(link)].append(node)
-
-            # Let's just using this block to save what we might need in edgar
-            if orjson.loads(link[1]).get("predicate") in predicate_constraints:
-                if link[2]:
-                    constraint_triples.setdefault((link[0], node), set()).add(link[1])
-                else:
-                    constraint_triples.setdefault((node, link[0]), set()).add(link[1])
-
+    registry = get_predicate_registry()
+    constraint_triples = None
     # For edgar use
     if filter_predicate_hierarchies and predicate_constraint_style == 'exclude':
-        # Use the constraint_triples to sifter the links
-        links_to_nodes = filter_links_to_nodes(links_to_nodes, constraint_triples, predicate_constraints)
+        constraint_triples = collect_constraint_triples(nodes, nodes_to_links, predicate_constraints)
 
-    nodeset_to_links = defaultdict(list)
-    for link, snodes in links_to_nodes.items():
-        nodeset_to_links[frozenset(snodes)].append(link)
+    if enrichment_engine == 'dict':
+        links, draws, nodeset_of = links_by_nodeset(nodes, nodes_to_links, constraint_triples, predicate_constraints)
+    elif enrichment_engine == 'sparse':
+        links, draws, nodeset_of = sparse_links_by_nodeset(nodes, nodes_to_links, constraint_triples,
+                                                           predicate_constraints)
+    else:
+        raise ValueError(f'Unknown enrichment engine {enrichment_engine}; use one of {", ".join(ENRICHMENT_ENGINES)}')
 
     logger.debug('end get_shared_links()')
 
-    logger.debug(f'{len(nodeset_to_links)} nodeset links discovered.')
+    logger.info(f'{len(links)} possible shared links discovered.')
+
+    # Gather every candidate before scoring any of them, so that the p-values come from one batched sf call
+    # rather than one call per link.
+    candidates = []
+    link_counts = []
+    symmetric = {}
+    # For each tuple: ('HP:0001907', 'biolink:treats', True)
+    for newcurie, predicate, is_source in links:
+        # We only want to do this if the predicate is symmetric
+        if predicate not in symmetric:
+            symmetric[predicate] = registry.info(predicate).symmetric
+        newcurie_is_source = True if symmetric[predicate] else not is_source
+        candidates.append((newcurie, predicate, newcurie_is_source))
+        link_counts.append(lcounts[(newcurie, predicate, newcurie_is_source, semantic_type)])
+
+    return score_candidates(candidates, draws, link_counts, nodeset_of, len(nodes), semantic_type,
+                            total_node_counts[semantic_type], sfcache, filter_predicate_hierarchies, scoring_engine,
+                            pvalue_threshold, max_results)
+
+
+def score_candidates(candidates, draws, link_counts, nodeset_of, ndraws, semantic_type, total_node_count, sfcache,
+                     filter_predicate_hierarchies=False, scoring_engine=DEFAULT_SCORING_ENGINE, pvalue_threshold=None,
+                     max_results=None):
+    """The scoring half of select_enriched_links: its output for the grouped links, given as their
+    (newcurie, predicate, newcurie_is_source) candidates, x (draws) and n (link_counts)."""
+    # x is the number of input nodes that share the link: the draws with the property
+    x = np.asarray(draws, dtype=np.int64)
+    n = np.array(link_counts, dtype=np.int64)
+    unlinked = (x > 0) & (n == 0)
+    if unlinked.any():
+        logger.info(f'{int(unlinked.sum())} links have x > 0 but n == 0 for {semantic_type}')
+    # I only care about things that occur more than by chance, not less than by chance
+    chance = x < n * ndraws / total_node_count
+    if chance.any():
+        logger.info(f'{int(chance.sum())} links for {semantic_type} occur less than by chance')
+    keep = np.flatnonzero(~(unlinked | chance))
+
+    enrichps, log_enrichps = enrichment_pvalues_and_logs(x[keep], n[keep], ndraws, total_node_count, sfcache,
+                                                         scoring_engine)
 
+    if filter_predicate_hierarchies:
+        # The hierarchy filter compares p-values within each enriched node, so it has to see every candidate before
+        # the threshold and the limit; it gets light stand-ins rather than Enrichments.
+        scored = [ScoredLink(enrichps[i], candidates[ix][0], candidates[ix][1], i) for i, ix in enumerate(keep.tolist())]
+        selected = np.array(sorted(scored.index for scored in filter_result_hierarchies(scored)), dtype=np.int64)
+    else:
+        selected = np.arange(len(keep))
+    if pvalue_threshold:
+        selected = selected[enrichps[selected] < pvalue_threshold]
+    # Order by p-value, with the log p-values telling apart the enrichments whose p-values underflow to 0, and the
+    # remaining ties in gathering order; the sort by p-value below then breaks ties the same way as scoring one link
+    # at a time did.
+    if max_results:
+        selected = heapq.nsmallest(max_results, selected.tolist(), key=lambda i: (enrichps[i], log_enrichps[i], i))
+    else:
+        selected = selected[np.lexsort((selected, log_enrichps[selected], enrichps[selected]))].tolist()
+
+    # Only the candidates that made it this far are turned into Enrichments.
     results = []
+    for i in selected:
+        newcurie, predicate, newcurie_is_source = candidates[keep[i]]
+        results.append((float(enrichps[i]), newcurie, predicate, newcurie_is_source, int(n[keep[i]]),
+                        nodeset_of(int(keep[i]))))
 
-    logger.info(f'{len(nodeset_to_links.items())} possible shared links discovered.')
+    results.sort(key=lambda x: x[0])
 
-    total_node_count = total_node_counts[semantic_type]
-    for nodeset, possible_links in nodeset_to_links.items():
-        enriched = []
-
-        for ix, (newcurie, predicate, is_source) in enumerate(possible_links):
-            # For each tuple: ('HP:0001907', 'biolink:treats', True)
-            # The hypergeometric distribution models drawing objects from a bin.
-            # M is the total number of objects (nodes) ,
-            # n is total number of Type I objects (nodes with that property).
-            # The random variate represents the number of Type I objects in N drawn
-            #  without replacement from the total population (len curies).
-            # length of the set of chemicals that mapped to the tuple
-
-            x = len(nodeset)  # draws with the property
-
-            # We only want to do this if the predicate is symmetric
-            #if tk.get_element(orjson.loads(predicate)["predicate"])["symmetric"]:
-            if predicate_string_is_symmetric(predicate):
-                newcurie_is_source = True
-            else:
-                newcurie_is_source = not is_source
+    logger.debug('end get_enriched_links()')
 
-            n = lcounts[(newcurie, predicate, newcurie_is_source, semantic_type)]
+    return results
 
-            if x > 0 and n == 0:
-                logger.info(f"x == {x}; n == 0??? : {newcurie} {predicate} {newcurie_is_source} {semantic_type} ")
-                continue
 
-            ndraws = len(nodes)
+class ScoredLink:
+    """A scored candidate for get_enriched_links, with what filter_result_hierarchies looks at in an Enrichment."""
+    __slots__ = ('p_value', 'new_curie', 'predicate', 'index')
 
-            # I only care about things that occur more than by chance, not less than by chance
-            if x < n * ndraws / total_node_count:
-                logger.info(
-                    f"x == {x} < {n * ndraws / total_node_count} : {newcurie} {predicate} {newcurie_is_source} {semantic_type} occur less than by chance")
-                continue
+    def __init__(self, p_value, new_curie, predicate, index):
+        self.p_value = p_value
+        self.new_curie = new_curie
+        self.predicate = predicate
+        self.index = index
 
-            # The correct distribution to calculate here is the hypergeometric.  However, it's the slowest.
-            # For most cases, it is ok to approximate it.  There are multiple levels of approximation as described
-            # here: https://riskwiki.vosesoftware.com/ApproximationstotheHypergeometricdistribution.php
-            # Ive tested and each approximation is faster, while the quality decreases.
-            # Norm is a bad approximation for this data
-            # the other three are fine.  Poisson very occassionaly is off by a factor of two or so, but that's not
-            # terribly important here.  It's also almost 2x faster than the hypergeometric.
-            # So we're going to use poisson, but if we have problems with it we should drop back to binom rather than hypergeom
+    @property
+    def enriched_node(self):
+        return self
 
-            # tuple -> (enrichnode,edge, typemapped)
 
-            args = (x - 1, total_node_count, n, ndraws)
-            if args not in sfcache:
-                sfcache[args] = poisson.sf(x - 1, n * ndraws / total_node_count)
+def collect_constraint_triples(nodes, nodes_to_links, predicate_constraints):
+    """{(subject, object): predicates} for the links of the input nodes whose predicate is one of the (excluded)
+    predicate_constraints; see filter_links_to_nodes."""
+    registry = get_predicate_registry()
+    constraint_triples = {}
+    if not predicate_constraints:
+        return constraint_triples
+    for node in nodes:
+        for link in nodes_to_links[node]:
+            if registry.info(link[1]).bare in predicate_constraints:
+                if link[2]:
+                    constraint_triples.setdefault((link[0], node), set()).add(link[1])
+                else:
+                    constraint_triples.setdefault((node, link[0]), set()).add(link[1])
+    return constraint_triples
 
-            # Enrichment pvalue
-            enrichp = sfcache[args]
 
-            # get the real labels/types of the enriched node
-            node_types = typecache[newcurie]
+def links_by_nodeset(nodes, nodes_to_links, constraint_triples=None, predicate_constraints=None):
+    """The links of the input nodes, grouped by the set of input nodes that share them:
+    ([link tuples], [number of input nodes sharing each link], a function from a link's index to that set of nodes).
+    Links sharing a set of nodes are together, the sets in the order that they first show up.  With constraint_triples,
+    the links that filter_links_to_nodes takes out are left out."""
+    links_to_nodes = defaultdict(list)
+    for node in nodes:
+        for link in nodes_to_links[node]:
+            links_to_nodes[tuple(link)].append(node)
 
-            enrichment = Enrichment(enrichp, newcurie, predicate, newcurie_is_source, ndraws, n, total_node_count,
-                                    nodeset, node_types)
-            enriched.append(enrichment)
+    if constraint_triples is not None:
+        # Use the constraint_triples to sifter the links
+        links_to_nodes = filter_links_to_nodes(links_to_nodes, constraint_triples, predicate_constraints)
 
-        if len(enriched) > 0:
-            results += enriched
+    nodeset_to_links = defaultdict(list)
+    for link, snodes in links_to_nodes.items():
+        nodeset_to_links[frozenset(snodes)].append(link)
 
-    if filter_predicate_hierarchies:
-        results = filter_result_hierarchies(results)
+    logger.debug(f'{len(nodeset_to_links)} nodeset links discovered.')
 
-    results.sort(key=lambda x: x.p_value)
+    links = []
+    draws = []
+    nodesets = []
+    for nodeset, possible_links in nodeset_to_links.items():
+        links.extend(possible_links)
+        draws.extend([len(nodeset)] * len(possible_links))
+        nodesets.extend([nodeset] * len(possible_links))
+    return links, draws, nodesets.__getitem__
+
+
+def sparse_links_by_nodeset(nodes, nodes_to_links, constraint_triples=None, predicate_constraints=None):
+    """links_by_nodeset, from an input node by link incidence matrix rather than from dicts keyed by sets of nodes.
+
+    Nodes and links are numbered in the order that they first show up, and each (node, link) pair is an entry in a
+    scipy.sparse CSC matrix, so that a link's column holds the rows of its nodes in order.  x is the number of entries
+    in each column.  Columns with the same rows are found by hashing the rows (and checked), and the node sets are
+    only built for the links that become enrichments.  For MCQs with thousands of inputs, that's much less hashing
+    and memory than a frozenset for every link."""
+    node_list = list(dict.fromkeys(nodes))
+    node_index = {node: i for i, node in enumerate(node_list)}
+    link_lengths = [len(nodes_to_links[node]) for node in nodes]
+    nentries = sum(link_lengths)
+    if nentries == 0:
+        return [], np.zeros(0, dtype=np.int64), None
+    links, cols = number_in_order(map(tuple, chain.from_iterable(map(nodes_to_links.__getitem__, nodes))), nentries)
+    rows = np.repeat(np.array([node_index[node] for node in nodes], dtype=cols.dtype), link_lengths)
+    incidence = csc_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(len(node_index), len(links)))
+    # Canonical form: the rows of each column sorted, and a link listed twice for a node counted once
+    incidence.sum_duplicates()
+
+    if constraint_triples is not None:
+        # filter_links_to_nodes looks at the first node of each link, which is the first row of its column
+        first_rows = incidence.indices[incidence.indptr[:-1]].tolist()
+        keep = [i for i, (link, row) in enumerate(zip(links, first_rows))
+                if not link_is_constrained(link, node_list[row], constraint_triples, predicate_constraints)]
+        if len(keep) < len(links):
+            links = [links[i] for i in keep]
+            incidence = incidence[:, keep]
+            if not links:
+                return [], np.zeros(0, dtype=np.int64), None
+
+    order, draws, nodeset_of = group_columns(incidence, node_list)
+    return [links[i] for i in order.tolist()], draws, nodeset_of
+
+
+def group_columns(incidence, node_list):
+    """The links_by_nodeset grouping of the columns of a canonical CSC incidence matrix whose rows are node_list:
+    (the columns in links_by_nodeset order, the number of rows of each, a function from a position in that order to
+    the frozenset of its nodes)."""
+    indptr = incidence.indptr
+    indices = incidence.indices
+    draws = np.diff(indptr)
+    group_first = same_column_groups(indptr, indices, draws)
+    # The links_by_nodeset order: the groups in the order of their first link, and then the links in order
+    order = np.lexsort((np.arange(len(draws)), group_first))
+    columns = order.tolist()
+    column_groups = group_first.tolist()
+    starts = indptr.tolist()
+    # Links in the same group share their node set, as they do from links_by_nodeset
+    nodesets = {}
+
+    def nodeset_of(i):
+        column = columns[i]
+        group = column_groups[column]
+        nodeset = nodesets.get(group)
+        if nodeset is None:
+            nodeset = nodesets[group] = frozenset(map(node_list.__getitem__,
+                                                      indices[starts[column]:starts[column + 1]].tolist()))
+        return nodeset
+
+    logger.debug(f'{len(np.unique(group_first))} nodeset links discovered.')
+    return order, draws[order], nodeset_of
+
+
+def member_set_settings(input_node_type, node_constraints, predicate_constraints, predicate_constraint_style,
+                        context_qualifiers, exclude_ids):
+    """What the filtered links of a member depend on, as a key for the member set cache."""
+    hub_policy = get_hub_policy()
+    return (input_node_type, tuple(node_constraints), orjson.dumps(predicate_constraints, option=orjson.OPT_SORT_KEYS),
+            predicate_constraint_style, orjson.dumps(context_qualifiers or {}, option=orjson.OPT_SORT_KEYS),
+            frozenset(exclude_ids or ()), (hub_policy.kind, hub_policy.degree_threshold, hub_policy.max_links))
+
+
+async def member_set_state(member_sets, store, input_ids, input_node_type, *filters):
+    """The MemberSetState for input_ids, from the closest kept set when there is one: only the members that it lacks
+    are fetched and filtered, and only the link nodes and links that its table lacks are looked up."""
+    settings = member_set_settings(input_node_type, *filters)
+    base, (added, dropped) = member_sets.nearest(settings, input_ids)
+    if base is not None and not added and not dropped:
+        return base
+    table = base.table if base is not None else member_sets.table(settings, input_node_type)
+    hub_pruning = HubPruning()
+    nodes_to_links = await fetch_filtered_links(store, [node for node in input_ids if node in added], input_node_type,
+                                                *filters, table.nodetypedict, table.nodenamedict, table.lcounts,
+                                                hub_pruning)
+    member_links = {node: table.number(nodes_to_links.get(node, [])) if node in added else base.member_links[node]
+                    for node in input_ids}
+    if base is not None:
+        hub_pruning.links.update((node, n) for node, n in base.hub_pruned.items() if node not in dropped)
+        total_node_counts = base.total_node_counts
+    else:
+        total_node_counts = await store.fetch_total_node_counts(input_node_type)
+    logger.info(f'Member set enrichment from {"scratch" if base is None else "a kept set"}: '
+                f'{len(added)} members added, {len(dropped)} dropped.')
+    state = MemberSetState(member_links, table, total_node_counts, hub_pruning.links)
+    member_sets.store(settings, state)
+    return state
+
+
+def select_member_set_links(state, nodes, semantic_type, sfcache, filter_predicate_hierarchies=False,
+                            scoring_engine=DEFAULT_SCORING_ENGINE, pvalue_threshold=None, max_results=None):
+    """select_enriched_links for the members of a MemberSetState, in the order of nodes, which are all different.
+
+    The incidence matrix comes straight from the link numbers of the members, renumbered in the order that the links
+    first show up, so the links are grouped and ordered just as sparse_links_by_nodeset has them."""
+    member_links = [state.member_links[node] for node in nodes]
+    lengths = [len(links) for links in member_links]
+    if sum(lengths) == 0:
+        return []
+    numbers, first_entries, cols = np.unique(np.concatenate(member_links), return_index=True, return_inverse=True)
+    in_order = np.argsort(first_entries)
+    renumber = np.empty(len(numbers), dtype=np.int64)
+    renumber[in_order] = np.arange(len(numbers))
+    rows = np.repeat(np.arange(len(nodes)), lengths)
+    incidence = csc_matrix((np.ones(len(rows), dtype=np.int8), (rows, renumber[cols])),
+                           shape=(len(nodes), len(numbers)))
+    incidence.sum_duplicates()
+    order, draws, nodeset_of = group_columns(incidence, list(nodes))
+    logger.info(f'{len(order)} possible shared links discovered.')
+    table = state.table
+    link_numbers = numbers[in_order][order].tolist()
+    candidates = list(map(table.candidates.__getitem__, link_numbers))
+    link_counts = np.fromiter(map(table.counts.__getitem__, link_numbers), dtype=np.int64, count=len(link_numbers))
+    return score_candidates(candidates, draws, link_counts, nodeset_of, len(nodes), semantic_type,
+                            state.total_node_counts[semantic_type], sfcache, filter_predicate_hierarchies,
+                            scoring_engine, pvalue_threshold, max_results)
+
+
+def number_in_order(values, nvalues):
+    """(the distinct values in the order they first show up, the number of each of the nvalues values in that list).
+    values are hashable and may be an iterator.
+
+    This is one pass over the values, in C: each gets the position of its first occurrence.  The distinct values are
+    the dict's keys, in the same order, which numbers the first positions in order."""
+    index_dtype = np.int32 if nvalues < np.iinfo(np.int32).max else np.int64
+    first_positions = {}
+    positions = np.fromiter(map(first_positions.setdefault, values, count()), dtype=index_dtype, count=nvalues)
+    distinct = list(first_positions)
+    del first_positions
+    number_of_position = np.zeros(nvalues, dtype=index_dtype)
+    number_of_position[positions == np.arange(nvalues, dtype=index_dtype)] = np.arange(len(distinct),
+                                                                                      dtype=index_dtype)
+    return distinct, number_of_position[positions]
+
+
+def pack_enrichment_inputs(nodes, semantic_type, nodes_to_links, lcounts, total_node_counts):
+    """get_enriched_links inputs as string tables and arrays, to send to the enrichment process pool; see
+    select_packed_enriched_links.  Each node's links are numbers in a table of the distinct links, which is in turn
+    numbers in tables of the curies and predicates."""
+    node_list = list(dict.fromkeys(nodes))
+    link_lengths = np.array([len(nodes_to_links[node]) for node in node_list], dtype=np.int64)
+    links, link_ids = number_in_order(map(tuple, chain.from_iterable(map(nodes_to_links.__getitem__, node_list))),
+                                      int(link_lengths.sum()))
+    curie_index = {}
+    predicate_index = {}
+    # Only the counts for the semantic type get looked up
+    count_keys = [key for key in lcounts if key[3] == semantic_type]
+    return {'nodes': list(nodes),
+            'semantic_type': semantic_type,
+            'total_node_counts': total_node_counts,
+            'link_lengths': link_lengths,
+            'link_ids': link_ids,
+            'link_curies': np.fromiter((curie_index.setdefault(link[0], len(curie_index)) for link in links),
+                                       dtype=np.int32, count=len(links)),
+            'link_predicates': np.fromiter((predicate_index.setdefault(link[1], len(predicate_index))
+                                            for link in links), dtype=np.int32, count=len(links)),
+            'link_is_source': np.fromiter(map(itemgetter(2), links), dtype=bool, count=len(links)),
+            'count_curies': np.fromiter((curie_index.setdefault(key[0], len(curie_index)) for key in count_keys),
+                                        dtype=np.int32, count=len(count_keys)),
+            'count_predicates': np.fromiter((predicate_index.setdefault(key[1], len(predicate_index))
+                                             for key in count_keys), dtype=np.int32, count=len(count_keys)),
+            'count_is_source': np.fromiter(map(itemgetter(2), count_keys), dtype=bool, count=len(count_keys)),
+            'counts': np.fromiter(map(lcounts.__getitem__, count_keys), dtype=np.int64, count=len(count_keys)),
+            'curies': list(curie_index),
+            'predicates': list(predicate_index)}
+
+
+def unpack_enrichment_inputs(packed):
+    """(nodes, semantic_type, nodes_to_links, lcounts, total_node_counts) from pack_enrichment_inputs."""
+    curies = packed['curies']
+    predicates = packed['predicates']
+    semantic_type = packed['semantic_type']
+    links = [[curies[c], predicates[p], s] for c, p, s in zip(packed['link_curies'].tolist(),
+                                                               packed['link_predicates'].tolist(),
+                                                               packed['link_is_source'].tolist())]
+    # Nodes with the same link share its list, as they can from a link store
+    node_links = list(map(links.__getitem__, packed['link_ids'].tolist()))
+    ends = np.cumsum(packed['link_lengths']).tolist()
+    nodes_to_links = {node: node_links[end - length:end]
+                      for node, length, end in zip(dict.fromkeys(packed['nodes']), packed['link_lengths'].tolist(),
+                                                   ends)}
+    lcounts = {(curies[c], predicates[p], s, semantic_type): n
+               for c, p, s, n in zip(packed['count_curies'].tolist(), packed['count_predicates'].tolist(),
+                                     packed['count_is_source'].tolist(), packed['counts'].tolist())}
+    return packed['nodes'], semantic_type, nodes_to_links, lcounts, packed['total_node_counts']
+
+
+def select_packed_enriched_links(packed, *args):
+    """select_enriched_links for pack_enrichment_inputs inputs, in an enrichment pool worker.  The results come back
+    as arrays too: the curies and predicates are positions in the packed tables, and the node sets are packed with
+    pack_node_sets."""
+    nodes, semantic_type, nodes_to_links, lcounts, total_node_counts = unpack_enrichment_inputs(packed)
+    selected = select_enriched_links(nodes, semantic_type, nodes_to_links, lcounts, get_pvalue_cache(),
+                                     total_node_counts, *args)
+    curie_index = {curie: i for i, curie in enumerate(packed['curies'])}
+    predicate_index = {predicate: i for i, predicate in enumerate(packed['predicates'])}
+    node_index = {node: i for i, node in enumerate(dict.fromkeys(nodes))}
+    member_offsets, members = pack_node_sets([nodeset for *_, nodeset in selected], node_index)
+    return {'p_values': np.array([s[0] for s in selected], dtype=np.float64),
+            'curies': np.array([curie_index[s[1]] for s in selected], dtype=np.int32),
+            'predicates': np.array([predicate_index[s[2]] for s in selected], dtype=np.int32),
+            'is_source': np.array([s[3] for s in selected], dtype=bool),
+            'n': np.array([s[4] for s in selected], dtype=np.int64),
+            'member_offsets': member_offsets,
+            'members': members}
+
+
+def unpack_selected_links(result, packed):
+    """select_enriched_links output from select_packed_enriched_links output."""
+    nodesets = unpack_node_sets(list(dict.fromkeys(packed['nodes'])), result['member_offsets'], result['members'])
+    curies = packed['curies']
+    predicates = packed['predicates']
+    return [(p_value, curies[c], predicates[p], s, n, nodeset)
+            for p_value, c, p, s, n, nodeset in zip(result['p_values'].tolist(), result['curies'].tolist(),
+                                                    result['predicates'].tolist(), result['is_source'].tolist(),
+                                                    result['n'].tolist(), nodesets)]
+
+
+def same_column_groups(indptr, indices, counts):
+    """For each column of a canonical CSC matrix, the first column with exactly the same rows."""
+    ncols = len(counts)
+    columns = np.arange(ncols)
+    # Two independent sums of random 64 bit weights, one per row, tell columns apart
+    weights = np.random.default_rng(0).integers(0, np.iinfo(np.uint64).max, size=(2, int(indices.max()) + 1),
+                                                dtype=np.uint64, endpoint=True)
+    h1 = np.add.reduceat(weights[0][indices], indptr[:-1])
+    h2 = np.add.reduceat(weights[1][indices], indptr[:-1])
+    order = np.lexsort((columns, h2, h1, counts))
+    starts = np.ones(ncols, dtype=bool)
+    starts[1:] = (counts[order][1:] != counts[order][:-1]) | (h1[order][1:] != h1[order][:-1]) | \
+                 (h2[order][1:] != h2[order][:-1])
+    group_first = np.empty(ncols, dtype=np.int64)
+    group_first[order] = order[np.flatnonzero(starts)][np.cumsum(starts) - 1]
+    # Check that every column really has the rows of the first column of its group
+    entry_columns = np.repeat(columns, counts)
+    offsets = np.arange(len(indices)) - indptr[entry_columns]
+    if np.array_equal(indices, indices[indptr[group_first][entry_columns] + offsets]):
+        return group_first
+    # A collision: group the columns by their rows exactly
+    first = {}
+    return np.array([first.setdefault(indices[indptr[c]:indptr[c + 1]].tobytes(), c) for c in range(ncols)],
+                    dtype=np.int64)
+
+
+def enrichment_pvalues_and_logs(x, n, ndraws, total_node_count, sfcache=None,
+                                scoring_engine=DEFAULT_SCORING_ENGINE):
+    """The enrichment p-value and its log for each pair of x (draws with the property) and n (nodes with the
+    property), as two arrays; see enrichment_stats for the scoring engines.  sfcache is a pvalue_cache cache to take
+    the p-values already computed from and to add the new ones to, or None.
+    Poisson very occassionaly is off by a factor of two or so from the exact hypergeometric, but that's not terribly
+    important here, so it stays the default.
+    """
+    return cached_sf_and_log_sf(x, n, ndraws, total_node_count, scoring_engine, sfcache)
 
-    logger.debug('end get_enriched_links()')
 
-    return results
+def enrichment_pvalues(x, n, ndraws, total_node_count, sfcache=None, scoring_engine=DEFAULT_SCORING_ENGINE):
+    """The enrichment p-values; see enrichment_pvalues_and_logs."""
+    return enrichment_pvalues_and_logs(x, n, ndraws, total_node_count, sfcache, scoring_engine)[0]
 
 
 def filter_links_to_nodes(links_to_nodes, constraint_triples_to_filter, predicate_constraints):
@@ -616,520 +1022,39 @@ def filter_links_to_nodes(links_to_nodes, constraint_triples_to_filter, predicat
     """
     new_links_to_nodes = {}
     for link, snodes in links_to_nodes.items():
-        link_predicate_only = orjson.loads(link[1]).get("predicate")
-
-        # Takes out the predicate constraints
-        if link_predicate_only in predicate_constraints:
-            continue
-
-        # if any one of the links is connected to the new_curie by the predicate, then all is connected.
-        # To save time, we will consider only the first link
-        # Takes out the predicate constraints ancestors
-        if link[2]:
-            source = link[0]
-            target = snodes[0]
-        else:
-            source = snodes[0]
-            target = link[0]
-        if (source, target) in constraint_triples_to_filter:
-            if any(link_predicate_only in get_ancestors(orjson.loads(preds).get("predicate"))
-                   for preds in constraint_triples_to_filter.get((source, target))):
-                continue
-
         # if none of the constraint applies
-        new_links_to_nodes[link] = snodes
+        if not link_is_constrained(link, snodes[0], constraint_triples_to_filter, predicate_constraints):
+            new_links_to_nodes[link] = snodes
     return new_links_to_nodes
 
 
-def filter_result_hierarchies(results):
-    enrichment_group_dict = {};
-
-    for result in results:
-        # Group results by enriched_node
-        enrichment_group_dict.setdefault(result.enriched_node.new_curie, []).append(result)
-
-    # Now filter by predicate hierarchies
-    new_results = process_enrichment_group(enrichment_group_dict)
-
-    return new_results
+def link_is_constrained(link, first_node, constraint_triples_to_filter, predicate_constraints):
+    """Whether filter_links_to_nodes takes out link, shared by first_node and maybe other input nodes."""
+    registry = get_predicate_registry()
+    link_predicate_only = registry.info(link[1]).bare
 
+    # Takes out the predicate constraints
+    if link_predicate_only in predicate_constraints:
+        return True
 
-def process_enrichment_group(enrichment_group_dict):
-    new_results = set()
-
-    for enriched_node, enriched_results in enrichment_group_dict.items():
-        # predicate_counts = {}
-        #  if enriched_node == "HP:0001337": #or any node of interest
-        #     #Copy the details to test_graph_coalesce.py to test the filter_result_hierarchies logic
-        #     details = [(enriched_result.p_value, enriched_result.enriched_node.new_curie, enriched_result.predicate,
-        #                 enriched_result.is_source, enriched_result.counts[0], enriched_result.counts[1],
-        #                 enriched_result.counts[2], enriched_result.linked_curies,
-        #                 enriched_result.enriched_node.newnode_type[0]) for enriched_result in enriched_results]
-        #     for enriched_result in enriched_results:
-        #         predicate = enriched_result.predicate
-        #         if predicate in predicate_counts:
-        #             predicate_counts[predicate] += 1
-        #         else:
-        #             predicate_counts[predicate] = 1
-        #     A = 'Stop Over Here!!'
-        #     print("WAIT!!!!! I wanna see the result")
-
-        if len(enriched_results) == 1:
-            new_results.update(enriched_results)
-        else:
-            # Re_group by p_value:
-            p_value_group_dict = {}
-            for enriched_result in enriched_results:
-                p_value_group_dict.setdefault(enriched_result.p_value, []).append(enriched_result)
-
-            # For each group, find the most specific predicates in each p_value group and put in specific results
-            specific_results = get_specific_results(p_value_group_dict)
-
-            # Pick the most specific in the specific results
-            if len(specific_results) == 1:
-                new_results.update(specific_results)
-                continue
-            # Else we pick the best representative of an enrichment node from the combined group result by min pvalue
-            # OR Hierarchy again, Most especially if we can get further specificity
-            # Filtering by predicate hierarchy and p_value scoring
-            children_to_parent = children_parent_mapping(specific_results)
-            pvalue_dict = {specific_result.predicate: specific_result.p_value for
-                           specific_result in specific_results}
-            most_preferred = streamline_children_to_parent(children_to_parent, pvalue_dict)
-
-            for specific_result in specific_results:
-                pred = specific_result.predicate
-                if pred in most_preferred:
-                    new_results.add(specific_result)
-    return list(new_results)
-
-
-def streamline_children_to_parent(children_to_parent, pvalues):
-    """
-    Given,
-         pvalue_dict = {
-                'biolink:contributes_to': 5.62677119993497e-16,
-                'biolink:related_to': 6.984714344422767e-26,
-                'biolink:treats_or_applied_or_studied_to_treat': 2.688166355839941e-06,
-                'biolink:has_adverse_event': 2.8008696832786763e-17,
-                'biolink:causes': 3.9591314521010225e-08
-        }
-
-    And child-parent dependencies between the predicates, we want to choose the one with best predicate in each case
-
-        children_to_parent_dict = {
-            'biolink:causes': {'biolink:contributes_to', 'biolink:related_to'},
-            'biolink:contributes_to': {'biolink:related_to'},
-            'biolink:has_adverse_event': {'biolink:related_to'}
-        }
-
-    since `biolink:related_to` has the best pvalue compared with the key,value pair in each item
-
-    Then our results returns:
-            {'biolink:related_to'}
-
-    """
-    streamlined_set = set()
-    items_to_remove = set()
-
-    # Let's gather all unique predicates from children_to_parent and their children
-    all_keys = set(children_to_parent.keys())
-    for children in children_to_parent.values():
-        all_keys.update(children)
-
-    # Get the p-values
-    pvalue_lookup = {key: pvalues.get(key, float('inf')) for key in all_keys}
-
-    # Streamline the children_to_parent dictionary
-    for child, parents in list(children_to_parent.items()):
-        if parents:
-            # Select the element with the smallest p-value
-            best_element = min([child] + list(parents), key=lambda x: pvalue_lookup[x])
-            streamlined_set.add(best_element)
-            continue
-        # If a child has no parents, it needs to be compared with others
-        candidates = set()
-        for other_child, other_parents in children_to_parent.items():
-            candidates.add(other_child)
-            candidates.update(other_parents)
-        candidates = candidates - items_to_remove
-        grouping = group_by_predicate(candidates).get(orjson.loads(child).get("predicate"), [])
-        if len(grouping) == 1 and child == grouping[0]:
-            streamlined_set.add(child)
-            items_to_remove.add(child)
-        if len(grouping) > 1:
-            best_element = min(grouping, key=lambda x: pvalue_lookup[x])
-            streamlined_set.add(best_element)
-            items_to_remove.update(grouping)
-
-    # # Remove items marked for deletion, if it exists
-    # for item in items_to_remove:
-    #     del children_to_parent[item]
-
-    if len(streamlined_set) == 1:
-        return streamlined_set
-
-    # Check to be sure the set aren't dependent on each other
-    if len(streamlined_set) == 2:
-        streamlist = list(streamlined_set)
-        if streamlist[0] in children_to_parent.get(streamlist[1], []):
-            # 0 is the parent but return the one with least pvalue
-            if pvalues.get(streamlist[0]) < pvalues.get(streamlist[1]):
-                return {streamlist[0]}
-            else:
-                return {streamlist[1]}
-        elif streamlist[1] in children_to_parent.get(streamlist[0], []):
-            # 1 is the parent but return the one with least pvalue
-            if pvalues.get(streamlist[1]) < pvalues.get(streamlist[0]):
-                return {streamlist[1]}
-            else:
-                return {streamlist[0]}
-        else:
-            streamlist0_pred_only = orjson.loads(streamlist[0]).get('predicate')
-            streamlist1_pred_only = orjson.loads(streamlist[1]).get('predicate')
-            # For the last time:
-            if streamlist0_pred_only in get_ancestors(streamlist1_pred_only):
-                if pvalues.get(streamlist[0]) < pvalues.get(streamlist[1]):
-                    return {streamlist[0]}
-                else:
-                    return {streamlist[1]}
-            if streamlist1_pred_only in get_ancestors(streamlist0_pred_only):
-                if pvalues.get(streamlist[1]) < pvalues.get(streamlist[0]):
-                    return {streamlist[1]}
-                else:
-                    return {streamlist[0]}
-            # None is the parent of the other
-            return streamlined_set
-
-    if len(streamlined_set) > 2:
-        new_children_to_parent = children_parent_mapping(list(streamlined_set))
-        if new_children_to_parent == children_to_parent:
-            return streamlined_set
-        return streamline_children_to_parent(new_children_to_parent, pvalues)
-
-    return streamlined_set
-
-
-def group_by_predicate(items):
-    """
-    groups a list of predicate strings by the predicate only
-    """
-    grouped_items = {}
-
-    for item in items:
-        parsed_item = json.loads(item)
-        predicate = parsed_item.get('predicate')
-
-        if predicate not in grouped_items:
-            grouped_items[predicate] = []
-        grouped_items[predicate].append(item)
-
-    return grouped_items
-
-
-def children_parent_mapping(specific_results):
-    def merge_dict(d):
-        """
-        For each key-value pair, check if any of the values are keys in the dictionary.
-        If they are, merge their value sets and mark the key for removal.
-        """
-        # Make a new dictionary to merge all the items results
-        merged_dict = {key: set(values) for key, values in d.items()}
-
-        merging_needed = True
-        while merging_needed:
-            merging_needed = False
-            keys_to_remove = set()
-            temp_dict = {}
-
-            for key, values in merged_dict.items():
-                # W need a temporary set to avoid modifying the original set during iteration
-                new_values = set(values)
-                for value in values:
-                    if value in merged_dict:
-                        # Merge the value's set into the new set
-                        new_values.update(merged_dict[value])
-                        # Mark the key for removal
-                        keys_to_remove.add(value)
-                        # Mark merging as needed
-                        merging_needed = True
-
-                temp_dict[key] = new_values
-
-            # Let's update the merged dictionary with the temporary dictionary
-            merged_dict.update(temp_dict)
-
-            # Then remove the merged keys
-            for key in keys_to_remove:
-                if key in merged_dict:
-                    del merged_dict[key]
-
-        return merged_dict
-
-    children_to_parent = {}
-
-    def bare_pred(full_predicate_str):
-        return orjson.loads(full_predicate_str).get("predicate")
-
-    # Map bare predicate -> set of full predicate strings that share it
-    bare_to_full = {}
-    for result in specific_results:
-        pred = result if isinstance(result, str) else result.predicate
-        bp = bare_pred(pred)
-        bare_to_full.setdefault(bp, set()).add(pred)
-
-    current_predicate = specific_results[0] if isinstance(specific_results[0], str) else specific_results[0].predicate
-
-    for j in range(1, len(specific_results)):
-        next_predicate = specific_results[j] if isinstance(specific_results[j], str) else specific_results[j].predicate
-
-        if bare_pred(current_predicate) in get_ancestors(bare_pred(next_predicate)):
-            children_to_parent.setdefault(next_predicate, set()).add(current_predicate)
-
-        elif bare_pred(next_predicate) in get_ancestors(bare_pred(current_predicate)):
-            children_to_parent.setdefault(current_predicate, set()).add(next_predicate)
-
-        current_predicate = next_predicate
-
-    allowable_predicates = {specific_result if isinstance(specific_results[0], str) else specific_result.predicate for
-                            specific_result in specific_results}
-
-    # Case where there are some misses; we need to somehow figure out how to store it in the children_to_parent_dict
-    for result in specific_results:
-        pred = result if isinstance(result, str) else result.predicate
-        if pred in children_to_parent:
-            continue
-        if any(pred in values for values in children_to_parent.values()):
-            continue
-        pred_ancestors = get_ancestors(bare_pred(pred))
-        if pred_ancestors:
-            # Find allowable predicates whose bare predicate is an ancestor
-            matching = set()
-            for ap in allowable_predicates:
-                if bare_pred(ap) in pred_ancestors:
-                    matching.add(ap)
-            children_to_parent[pred] = matching
-        else:
-            pred_children = get_children(bare_pred(pred))
-            if pred_children:
-                matching = set()
-                for ap in allowable_predicates:
-                    if bare_pred(ap) in pred_children:
-                        matching.add(ap)
-                for pred_child in matching:
-                    if pred_child in children_to_parent:
-                        children_to_parent.setdefault(pred_child, set()).add(pred)
-            else:
-                children_to_parent.setdefault(pred, set()).add(pred)
-
-    return merge_dict(children_to_parent)
-
-
-def is_child_in(child, parent, qualifier_enum):
-    """Eg: activity_or_abundance is used in cases where the specificity of the relationship can not be determined to be either activity or abundance.
-    In general, a more specific value from this enumeration should be used, if it is present in the result being filtered.
-    """
-    children = tk.get_permissible_value_children(parent, qualifier_enum) or []
-    return child in children
-
-
-def has_qualifier(predicate):
-    # https://biolink.github.io/biolink-model/qualifiers.html
-    qualifiers = {"object_aspect_qualifier", "object_direction_qualifier"}
-    return any(q in predicate for q in qualifiers)
-
-
-def get_ancestors(predicate):
-    return tk.get_ancestors(predicate, formatted=True, reflexive=False) or []
-
-
-def get_children(predicate):
-    return tk.get_children(predicate, formatted=True) or []
-
-
-# def get_specific_results(pvalue_group_dict):
-#     """
-#     This function accepts:
-#         enrichment result grouped by pvalue, and most-likely, different predicates
-#         for instance:
-#                 0.0001: [(enriched_node1, causes), (enriched_node1, contributes_to)]
-#                 0.0002: [(enriched_node1, has_advert_event), (enriched_node1, affects)]
-#                 0.0003: [(enriched_node1, treats_or_applied_or_studied_to_treat), (enriched_node1, treats)]
-#     to return specific list representative of enriched_node1:
-#                 [(enriched_node1, causes),(enriched_node1, has_advert_event), (enriched_node1, treats)]
-#
-#     NB: No scoring is performed since each group compared shares the same p_value
-#     """
-#     # https://biolink.github.io/biolink-model/#enumerations
-#     biolink_aspect_qualifier_enumeration = "GeneOrGeneProductOrChemicalEntityAspectEnum"
-#
-#     specific_results = []
-#
-#     for results in pvalue_group_dict.values():
-#         if len(results) == 1:
-#             specific_results.extend(results)
-#             continue
-#
-#         most_specific_result = results[0]
-#
-#         for j in range(1, len(results)):
-#             result_i = most_specific_result
-#             result_j = results[j]
-#
-#             pred_i = orjson.loads(result_i.predicate)
-#             pred_j = orjson.loads(result_j.predicate)
-#
-#             if pred_i.get("predicate") == pred_j.get("predicate"):
-#                 # Equal predicates? then lets dig further down to the qualifier
-#                 if any("qualifier" in key for key in pred_i) or any("qualifier" in key for key in pred_j):
-#                     c_pred = pred_i
-#                     n_pred = pred_j
-#
-#                     curr_qualifier = c_pred.get("object_aspect_qualifier") or c_pred.get("object_direction_qualifier")
-#                     next_qualifier = n_pred.get("object_aspect_qualifier") or n_pred.get("object_direction_qualifier")
-#
-#                     if curr_qualifier and next_qualifier:
-#                         if curr_qualifier == next_qualifier:
-#                             if ("object_direction_qualifier" in c_pred) != ("object_direction_qualifier" in n_pred):
-#                                 most_specific_result = result_i if "object_direction_qualifier" in c_pred else result_j
-#
-#                         elif is_child_in(curr_qualifier, next_qualifier, biolink_aspect_qualifier_enumeration):
-#                             most_specific_result = result_i
-#
-#                         elif is_child_in(next_qualifier, curr_qualifier, biolink_aspect_qualifier_enumeration):
-#                             most_specific_result = result_j
-#
-#                     elif has_qualifier(c_pred) and not has_qualifier(n_pred):
-#                         most_specific_result = result_i
-#
-#                     elif has_qualifier(n_pred) and not has_qualifier(c_pred):
-#                         most_specific_result = result_j
-#
-#                 else:
-#                     most_specific_result = results[0]
-#
-#             else:
-#                 top_ancestral_result = max([result_i, result_j], key=lambda result: len(
-#                     get_ancestors(orjson.loads(result.predicate).get("predicate"))))
-#                 most_specific_result = top_ancestral_result
-#
-#         specific_results.append(most_specific_result)
-#
-#     return specific_results
-
-
-def get_specific_results(pvalue_group_dict):
-    """
-    This function accepts:
-        enrichment result grouped by pvalue, and most-likely, different predicates
-        for instance:
-                0.0001: [(enriched_node1, causes), (enriched_node1, contributes_to)]
-                0.0002: [(enriched_node1, has_advert_event), (enriched_node1, affects)]
-                0.0003: [(enriched_node1, treats_or_applied_or_studied_to_treat), (enriched_node1, treats)]
-    to return specific list representative of enriched_node1:
-                [(enriched_node1, causes),(enriched_node1, has_advert_event), (enriched_node1, treats)]
-
-    NB: No scoring is performed since each group compared shares the same p_value
-    """
-    # https://biolink.github.io/biolink-model/#enumerations
-    biolink_aspect_qualifier_enumeration = "GeneOrGeneProductOrChemicalEntityAspectEnum"
-    biolink_direction_qualifier_enumeration = "DirectionQualifierEnum"
-
-    specific_results = []
-
-    for results in pvalue_group_dict.values():
-        if len(results) == 1:
-            specific_results.extend(results)
-            continue
-
-        most_specific_result = results[0]
-
-        for j in range(1, len(results)):
-            result_i = most_specific_result
-            result_j = results[j]
-
-            pred_i = orjson.loads(result_i.predicate)
-            pred_j = orjson.loads(result_j.predicate)
-
-            if pred_i.get("predicate") == pred_j.get("predicate"):
-                # Equal predicates? then lets dig further down to the qualifier
-                if any("qualifier" in key for key in pred_i) or any("qualifier" in key for key in pred_j):
-                    c_pred = pred_i
-                    n_pred = pred_j
-
-                    # Handle ASPECT qualifiers separately from DIRECTION qualifiers
-                    curr_aspect = c_pred.get("object_aspect_qualifier")
-                    next_aspect = n_pred.get("object_aspect_qualifier")
-                    curr_direction = c_pred.get("object_direction_qualifier")
-                    next_direction = n_pred.get("object_direction_qualifier")
-
-                    # Compare aspect qualifiers (if both have them)
-                    if curr_aspect and next_aspect:
-                        if curr_aspect == next_aspect:
-                            # Same aspect, prefer the one with direction qualifier
-                            if curr_direction and not next_direction:
-                                most_specific_result = result_i
-                            elif next_direction and not curr_direction:
-                                most_specific_result = result_j
-                            # Both have or both lack direction - keep current
-                        else:
-                            # Different aspects - check hierarchy
-                            try:
-                                if is_child_in(curr_aspect, next_aspect, biolink_aspect_qualifier_enumeration):
-                                    most_specific_result = result_i
-                                elif is_child_in(next_aspect, curr_aspect, biolink_aspect_qualifier_enumeration):
-                                    most_specific_result = result_j
-                            except ValueError:
-                                # If enum lookup fails, keep current
-                                pass
-
-                    # Compare direction qualifiers (if both have them and no aspect difference)
-                    elif curr_direction and next_direction:
-                        if curr_direction != next_direction:
-                            try:
-                                if is_child_in(curr_direction, next_direction, biolink_direction_qualifier_enumeration):
-                                    most_specific_result = result_i
-                                elif is_child_in(next_direction, curr_direction, biolink_direction_qualifier_enumeration):
-                                    most_specific_result = result_j
-                            except ValueError:
-                                # If enum lookup fails, keep current
-                                pass
-
-                    # One has qualifier, one doesn't - prefer the one with qualifier
-                    elif (curr_aspect or curr_direction) and not (next_aspect or next_direction):
-                        most_specific_result = result_i
-                    elif (next_aspect or next_direction) and not (curr_aspect or curr_direction):
-                        most_specific_result = result_j
-
-                else:
-                    most_specific_result = results[0]
-
-            else:
-                top_ancestral_result = max([result_i, result_j], key=lambda result: len(
-                    get_ancestors(orjson.loads(result.predicate).get("predicate"))))
-                most_specific_result = top_ancestral_result
-
-        specific_results.append(most_specific_result)
-
-    return specific_results
+    # if any one of the links is connected to the new_curie by the predicate, then all is connected.
+    # To save time, we will consider only the first link
+    # Takes out the predicate constraints ancestors
+    if link[2]:
+        source = link[0]
+        target = first_node
+    else:
+        source = first_node
+        target = link[0]
+    if (source, target) in constraint_triples_to_filter:
+        if any(link_predicate_only in registry.info(preds).ancestor_set
+               for preds in constraint_triples_to_filter.get((source, target))):
+            return True
+    return False
 
 
 def get_total_node_counts(semantic_type):
-    counts = {}
-    # needs to be first so that counts will fill it first
-    semantic_list = ['biolink:NamedThing', semantic_type]
-    with get_redis_pipeline(5) as p:
-        for st in semantic_list:
-            p.get(st)
-        allcounts = p.execute()
-    for st, stc in zip(semantic_list, allcounts):
-        if stc is not None:
-            counts[st] = float(stc)
-        elif not stc and 'biolink:NamedThing' in counts:
-            # If we can't find a type, just use the biggest number.  We could improve this a bit
-            # by fiddling around in the biolink model and using a more closely related superclass.
-            counts[st] = counts['biolink:NamedThing']
-    return counts
+    return get_link_store().total_node_counts(semantic_type)
 
 
 def get_total_node_count(semantic_type):
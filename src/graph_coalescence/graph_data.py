@@ -0,0 +1,509 @@
+"""Data access for the graph coalescer.
+
+The redis layout is
+    db 0: node -> json list of links [other_node, predicate_json, node_is_source], or the same in the binary
+          format of link_codec
+    db 1: node -> python repr of its category list
+    db 2: count key for (node, predicate_json, node_is_source, category) -> count; see count_keys for the two
+          key schemes
+    db 3: node -> name
+    db 4: "subject predicate_json object" -> json provenance dict
+    db 5: category -> number of nodes with that category
+    db 6: node -> json node metadata record {"c": category list, "n": name}
+    db 7: link_partition_key(node, bare predicate, node_is_source) -> the part of the node's db 0 links with that
+          bare predicate and direction, with the positions of the links in the whole list: json
+          {"p": positions, "l": links}, or the link partition format of link_codec
+
+db 6 replaces dbs 1 and 3 for lookups, so that categories and names come back in one round trip and without a
+literal_eval.  Databases loaded before it existed don't have it, so nodes missing from db 6 are looked up in dbs 1
+and 3 instead.
+
+db 7 lets lookups that only want one predicate (lookup_single, lookup_batch, include-style MCQs) skip the rest of a
+node's links, which for hub nodes is nearly all of them.  The partitions are separate keys rather than hash fields so
+that they go through the same chunked MGETs as everything else.  The links of a node's partitions are put back in
+the order of its whole list, which is the order enrichments are gathered in and so breaks their ties.  load_redis
+sets LINK_PARTITIONS_KEY in db 5 to LINK_PARTITIONS_FORMAT when it loads them; without it (or with partitions of an
+older format, which had no positions), whole link lists are fetched and filtered as before.
+
+The degree index of hubs.py is one json value in db 5 under DEGREE_INDEX_KEY.  It is read on first use and again
+whenever the link cache sees a new KG version.
+
+The load_* and fetch_* functions here are the redis backend of link_store.RedisLinkStore; the coalescer goes through
+link_store.get_link_store() so that other backends can stand in.
+
+The decode_* helpers turn raw redis values into what the coalescer works with and are shared by the synchronous
+functions in graph_coalescer.py and the asyncio fetchers here.  The fetchers use redis.asyncio (through bulk_fetch)
+so that concurrent requests can overlap their redis waits on a single event loop.
+"""
+import ast
+import asyncio
+import heapq
+import itertools
+import threading
+from operator import itemgetter
+import orjson
+from src.graph_coalescence import link_codec
+from src.graph_coalescence.count_keys import CountKeyCodec, DICTIONARY_KEYS as COUNT_DICTIONARY_KEYS, \
+    legacy_count_key
+from src.graph_coalescence.redis_pool import get_redis_registry
+from src.graph_coalescence.bulk_fetch import mget, mget_async
+from src.graph_coalescence.hubs import DegreeIndex, DEGREE_INDEX_KEY
+from src.graph_coalescence.link_cache import get_link_cache, KG_VERSION_DB, KG_VERSION_KEY
+
+LINKS_DB = 0
+NODE_TYPES_DB = 1
+LINK_COUNTS_DB = 2
+NODE_NAMES_DB = 3
+PROV_DB = 4
+CATEGORY_COUNTS_DB = 5
+NODE_METADATA_DB = 6
+LINK_PARTITIONS_DB = 7
+LINK_PARTITIONS_KEY = 'ac:linkparts'
+LINK_PARTITIONS_FORMAT = '2'
+
+
+def grouper(n, iterable):
+    it = iter(iterable)
+    while True:
+        chunk = tuple(itertools.islice(it, n))
+        if not chunk:
+            break
+        yield chunk
+
+
+# What the link cache charges for a binary-encoded link, about the size of one link in the JSON format
+ENCODED_LINK_BYTES = 80
+
+_link_dictionary = None
+_link_dictionary_lock = threading.Lock()
+
+
+def get_link_dictionary(dict_id):
+    """The link_codec dictionary with id dict_id.  It's read from redis the first time a value written with it is
+    seen, and replaced when values from a new build show up."""
+    global _link_dictionary
+    dictionary = _link_dictionary
+    if dictionary is None or dictionary.id != dict_id:
+        with _link_dictionary_lock:
+            dictionary = _link_dictionary
+            if dictionary is None or dictionary.id != dict_id:
+                client = get_redis_registry().get_client(link_codec.DICTIONARY_DB)
+                nodes_blob, predicates_blob = client.mget(link_codec.dictionary_keys(dict_id))
+                if nodes_blob is None or predicates_blob is None:
+                    raise ValueError(f'Link dictionary {dict_id} is not loaded')
+                dictionary = link_codec.LinkDictionary(dict_id, nodes_blob, predicates_blob)
+                _link_dictionary = dictionary
+    return dictionary
+
+
+def decode_links(linkstring):
+    if linkstring is None:
+        return []
+    if link_codec.is_encoded(linkstring):
+        return link_codec.decode_links(linkstring, get_link_dictionary)
+    return orjson.loads(linkstring)
+
+
+def links_size(linkstring, links):
+    """The size the link cache charges for a decoded link list."""
+    if not linkstring:
+        return 0
+    if link_codec.is_encoded(linkstring) or link_codec.is_encoded_partition(linkstring):
+        return len(links) * ENCODED_LINK_BYTES
+    return len(linkstring)
+
+
+def decode_link_partition(value):
+    """(positions, links) of a db 7 value, the positions being those of the links in the node's whole list."""
+    if value is None:
+        return [], []
+    if link_codec.is_encoded_partition(value):
+        positions, linkstring = link_codec.decode_partition(value)
+        return positions, decode_links(linkstring)
+    partition = orjson.loads(value)
+    return partition['p'], partition['l']
+
+
+def link_partition_key(node, bare_predicate, node_is_source):
+    return f'{node} {bare_predicate} {int(bool(node_is_source))}'
+
+
+def link_partition_keys(node_to_predicates):
+    """[(node, key)] for every partition of the bare predicates in node_to_predicates, in both directions."""
+    return [(node, link_partition_key(node, bare, node_is_source))
+            for node, bare_predicates in node_to_predicates.items()
+            for bare in dict.fromkeys(bare_predicates)
+            for node_is_source in (True, False)]
+
+
+def decode_node_types(typestring):
+    if not typestring:
+        return None
+    return ast.literal_eval(typestring.decode())
+
+
+def decode_node_name(name):
+    try:
+        return name.decode('UTF-8')
+    except:
+        return ''
+
+
+def encode_node_metadata(categories, name):
+    return orjson.dumps({'c': categories, 'n': name})
+
+
+def decode_node_metadata(value):
+    record = orjson.loads(value)
+    return record['c'], record['n']
+
+
+def split_node_metadata(nodes, values):
+    """Decode node metadata records into ({node: categories}, {node: name}, [nodes without a record])."""
+    nodetypedict = {}
+    nodenames = {}
+    missing = []
+    for node, value in zip(nodes, values):
+        if value is None:
+            missing.append(node)
+            continue
+        nodetypedict[node], nodenames[node] = decode_node_metadata(value)
+    return nodetypedict, nodenames, missing
+
+
+def merge_legacy_node_metadata(missing, typestrings, names, nodetypedict, nodenames):
+    """Fill in nodes that had no metadata record from their db 1 and db 3 values."""
+    for node, typestring, name in zip(missing, typestrings, names):
+        node_types = decode_node_types(typestring)
+        if node_types is not None:
+            nodetypedict[node] = node_types
+        nodenames[node] = decode_node_name(name)
+
+
+def decode_link_count(n):
+    try:
+        return int(n)
+    except:
+        # this can happen becuase we're inferring the category type from the qgraph.  But if we have 0 we have 0
+        return 0
+
+
+def check_prov_value_type(value):
+    if isinstance(value, list):
+        val = ','.join(value)
+    else:
+        val = value
+    # I noticed some values are lists eg. ['infores:sri-reference-kg']
+    # This function coerce such to string
+    # Also, the newer pydantic accepts 'primary_knowledge_source' instead of 'biolink:primary_knowledge_source' in the old
+    return val.replace('biolink:', '')
+
+
+def decode_prov(prov_data):
+    if isinstance(prov_data, (str, bytes)):
+        prov_data = orjson.loads(prov_data)
+    return [{'resource_id': check_prov_value_type(v), 'resource_role': check_prov_value_type(k)} for k, v in
+            prov_data.items()]
+
+
+def get_edge_symmetric(edge):
+    subject, b = edge.split('{')
+    edge_predicate, obj = b.split('}')
+    edge_predicate = '{' + edge_predicate + '}'
+    return f'{obj.lstrip()} {edge_predicate} {subject.rstrip()}'
+
+
+def total_node_count_types(semantic_type):
+    # needs to be first so that counts will fill it first
+    return ['biolink:NamedThing', semantic_type]
+
+
+def decode_total_node_counts(semantic_list, allcounts):
+    counts = {}
+    for st, stc in zip(semantic_list, allcounts):
+        if stc is not None:
+            counts[st] = float(stc)
+        elif not stc and 'biolink:NamedThing' in counts:
+            # If we can't find a type, just use the biggest number.  We could improve this a bit
+            # by fiddling around in the biolink model and using a more closely related superclass.
+            counts[st] = counts['biolink:NamedThing']
+    return counts
+
+
+def resolve_provs(edges, values):
+    """Decode the prov values found for edges.  Returns ({edge: prov}, [edges with no prov]); the latter should be
+    looked up again under their symmetric key and passed to resolve_symmetric_provs."""
+    prov = {}
+    missing = []
+    for edge, n in zip(edges, values):
+        if n:
+            prov[edge] = decode_prov(n)
+        else:
+            missing.append(edge)
+    return prov, missing
+
+
+def resolve_symmetric_provs(missing, symmetric_values):
+    return {edge: (decode_prov(sn) if sn else []) for edge, sn in zip(missing, symmetric_values)}
+
+
+###
+# Per-KG-build state: the KG version (which the link cache is tied to) and the count key dictionaries.  Both live in
+# db 5 and are re-read together every link_cache_version_check_seconds.
+###
+
+_count_key_codec = None
+_link_partitions_loaded = False
+# The raw dictionary values the codec was built from; a list, so that it never equals a fresh read on first use
+_count_key_dictionaries = []
+
+
+def _kg_state_keys():
+    return [KG_VERSION_KEY, LINK_PARTITIONS_KEY, *COUNT_DICTIONARY_KEYS]
+
+
+def _update_kg_state(values):
+    global _count_key_codec, _count_key_dictionaries, _link_partitions_loaded
+    version, link_partitions, predicates_value, categories_value = values
+    get_link_cache().set_version(version)
+    _link_partitions_loaded = link_partitions is not None and link_partitions.decode() == LINK_PARTITIONS_FORMAT
+    if (predicates_value, categories_value) != _count_key_dictionaries:
+        _count_key_codec = CountKeyCodec.from_redis_values(predicates_value, categories_value)
+        _count_key_dictionaries = (predicates_value, categories_value)
+
+
+def refresh_kg_state():
+    if get_link_cache().version_check_due():
+        _update_kg_state(mget(KG_VERSION_DB, _kg_state_keys()))
+
+
+async def fetch_kg_state():
+    if get_link_cache().version_check_due():
+        _update_kg_state(await _get_values(KG_VERSION_DB, _kg_state_keys()))
+
+
+def get_count_key_codec():
+    """The CountKeyCodec for the loaded KG, or None if it uses the original count keys."""
+    refresh_kg_state()
+    return _count_key_codec
+
+
+def link_partitions_available():
+    refresh_kg_state()
+    return _link_partitions_loaded
+
+
+_degree_index = None
+# The link cache invalidation count the degree index was read at
+_degree_index_invalidations = None
+
+
+def _degree_index_stale():
+    return _degree_index is None or _degree_index_invalidations != get_link_cache().invalidations
+
+
+def _set_degree_index(value):
+    global _degree_index, _degree_index_invalidations
+    _degree_index = DegreeIndex.from_redis_value(value)
+    _degree_index_invalidations = get_link_cache().invalidations
+    return _degree_index
+
+
+def load_degree_index():
+    """The DegreeIndex of the loaded KG, empty if load_redis didn't load one."""
+    refresh_kg_state()
+    if _degree_index_stale():
+        return _set_degree_index(mget(KG_VERSION_DB, [DEGREE_INDEX_KEY])[0])
+    return _degree_index
+
+
+def link_count_keys(codec, unique_links):
+    """The db 2 keys for the link tuples; None for links that can't have a count."""
+    if codec is None:
+        return [legacy_count_key(ul) for ul in unique_links]
+    return [codec.key(ul) for ul in unique_links]
+
+
+def decode_link_counts(unique_links, keys, values):
+    """{link: count} from the values fetched for the non-None keys."""
+    values = iter(values)
+    return {ul: (decode_link_count(next(values)) if key is not None else 0) for ul, key in zip(unique_links, keys)}
+
+
+def load_link_counts(unique_links):
+    """{link: count} for (node, predicate, node_is_source, category) tuples."""
+    unique_links = list(unique_links)
+    keys = link_count_keys(get_count_key_codec(), unique_links)
+    values = mget(LINK_COUNTS_DB, [key for key in keys if key is not None])
+    return decode_link_counts(unique_links, keys, values)
+
+
+def _merge_cached_links(cache, unique_nodes, cached, missing, linkstrings):
+    for node, linkstring in zip(missing, linkstrings):
+        links = decode_links(linkstring)
+        cache.put(node, links, links_size(linkstring, links))
+        cached[node] = links
+    return {node: cached[node] for node in unique_nodes}
+
+
+def _merge_link_partitions(cache, node_to_predicates, partition_keys, cached, missing, values):
+    """{node: links} from the partitions, whether cached or just fetched, with each node's links in the order of its
+    whole list.  Partitions are cached under their keys, which have spaces and so can't collide with a curie."""
+    for key, value in zip(missing, values):
+        partition = decode_link_partition(value)
+        if cache.enabled:
+            cache.put(key, partition, links_size(value, partition[1]))
+        cached[key] = partition
+    node_partitions = {node: [] for node in node_to_predicates}
+    for node, key in partition_keys:
+        positions, links = cached[key]
+        node_partitions[node].append(zip(positions, links))
+    return {node: [link for _, link in heapq.merge(*partitions, key=itemgetter(0))]
+            for node, partitions in node_partitions.items()}
+
+
+def load_link_partitions(node_to_predicates):
+    """{node: links} with only the links whose bare predicate is one of node_to_predicates[node], or None if the
+    partitions aren't loaded (fall back to load_links)."""
+    if not link_partitions_available():
+        return None
+    partition_keys = link_partition_keys(node_to_predicates)
+    keys = list(dict.fromkeys(key for _, key in partition_keys))
+    cache = get_link_cache()
+    cached, missing = cache.get_many(keys) if cache.enabled else ({}, keys)
+    linkstrings = mget(LINK_PARTITIONS_DB, missing)
+    return _merge_link_partitions(cache, node_to_predicates, partition_keys, cached, missing, linkstrings)
+
+
+def load_links(nodes):
+    """Synchronous fetch_links."""
+    unique_nodes = list(dict.fromkeys(nodes))
+    refresh_kg_state()
+    cache = get_link_cache()
+    if not cache.enabled:
+        linkstrings = mget(LINKS_DB, unique_nodes)
+        return {node: decode_links(linkstring) for node, linkstring in zip(unique_nodes, linkstrings)}
+    cached, missing = cache.get_many(unique_nodes)
+    linkstrings = mget(LINKS_DB, missing)
+    return _merge_cached_links(cache, unique_nodes, cached, missing, linkstrings)
+
+
+def load_node_metadata(nodes):
+    """({node: categories}, {node: name}) for nodes.  Nodes with no categories are left out of the first dict, and
+    nodes with no name get ''; the same as get_node_types and get_node_names."""
+    nodes = list(dict.fromkeys(nodes))
+    nodetypedict, nodenames, missing = split_node_metadata(nodes, mget(NODE_METADATA_DB, nodes))
+    if missing:
+        merge_legacy_node_metadata(missing, mget(NODE_TYPES_DB, missing), mget(NODE_NAMES_DB, missing),
+                                   nodetypedict, nodenames)
+    return nodetypedict, nodenames
+
+
+def load_provs(edges):
+    """{edge: prov} for the prov-link strings in edges, falling back to the symmetric edge when needed."""
+    edges = list(dict.fromkeys(edges))
+    prov, missing = resolve_provs(edges, mget(PROV_DB, edges))
+    if missing:
+        symmetric_values = mget(PROV_DB, [get_edge_symmetric(edge) for edge in missing])
+        prov.update(resolve_symmetric_provs(missing, symmetric_values))
+    return prov
+
+
+def load_total_node_counts(semantic_type):
+    semantic_list = total_node_count_types(semantic_type)
+    return decode_total_node_counts(semantic_list, mget(CATEGORY_COUNTS_DB, semantic_list))
+
+
+###
+# asyncio fetchers
+###
+
+async def _get_values(dbnum, keys):
+    """GET every key in keys from dbnum.  Returns values in key order."""
+    return await mget_async(dbnum, keys)
+
+
+async def fetch_links(nodes):
+    """{node: links} for the unique nodes in nodes.  The link lists may come from the link cache, so don't modify
+    them."""
+    unique_nodes = list(dict.fromkeys(nodes))
+    await fetch_kg_state()
+    cache = get_link_cache()
+    if not cache.enabled:
+        linkstrings = await _get_values(LINKS_DB, unique_nodes)
+        return {node: decode_links(linkstring) for node, linkstring in zip(unique_nodes, linkstrings)}
+    cached, missing = cache.get_many(unique_nodes)
+    linkstrings = await _get_values(LINKS_DB, missing)
+    return _merge_cached_links(cache, unique_nodes, cached, missing, linkstrings)
+
+
+async def fetch_link_partitions(node_to_predicates):
+    """Async load_link_partitions."""
+    await fetch_kg_state()
+    if not _link_partitions_loaded:
+        return None
+    partition_keys = link_partition_keys(node_to_predicates)
+    keys = list(dict.fromkeys(key for _, key in partition_keys))
+    cache = get_link_cache()
+    cached, missing = cache.get_many(keys) if cache.enabled else ({}, keys)
+    linkstrings = await _get_values(LINK_PARTITIONS_DB, missing)
+    return _merge_link_partitions(cache, node_to_predicates, partition_keys, cached, missing, linkstrings)
+
+
+async def fetch_node_types(nodes):
+    nodes = list(nodes)
+    typestrings = await _get_values(NODE_TYPES_DB, nodes)
+    nodetypedict = {}
+    for node, typestring in zip(nodes, typestrings):
+        node_types = decode_node_types(typestring)
+        if node_types is not None:
+            nodetypedict[node] = node_types
+    return nodetypedict
+
+
+async def fetch_node_names(nodes):
+    nodes = list(nodes)
+    names = await _get_values(NODE_NAMES_DB, nodes)
+    return {node: decode_node_name(name) for node, name in zip(nodes, names)}
+
+
+async def fetch_node_metadata(nodes):
+    nodes = list(dict.fromkeys(nodes))
+    nodetypedict, nodenames, missing = split_node_metadata(nodes, await _get_values(NODE_METADATA_DB, nodes))
+    if missing:
+        typestrings, names = await asyncio.gather(_get_values(NODE_TYPES_DB, missing),
+                                                  _get_values(NODE_NAMES_DB, missing))
+        merge_legacy_node_metadata(missing, typestrings, names, nodetypedict, nodenames)
+    return nodetypedict, nodenames
+
+
+async def fetch_link_counts(unique_links):
+    unique_links = list(unique_links)
+    await fetch_kg_state()
+    keys = link_count_keys(_count_key_codec, unique_links)
+    values = await _get_values(LINK_COUNTS_DB, [key for key in keys if key is not None])
+    return decode_link_counts(unique_links, keys, values)
+
+
+async def fetch_provs(edges):
+    """{edge: prov} for the prov-link strings in edges, falling back to the symmetric edge when needed."""
+    edges = list(dict.fromkeys(edges))
+    values = await _get_values(PROV_DB, edges)
+    prov, missing = resolve_provs(edges, values)
+    if missing:
+        symmetric_values = await _get_values(PROV_DB, [get_edge_symmetric(edge) for edge in missing])
+        prov.update(resolve_symmetric_provs(missing, symmetric_values))
+    return prov
+
+
+async def fetch_degree_index():
+    await fetch_kg_state()
+    if _degree_index_stale():
+        return _set_degree_index((await _get_values(KG_VERSION_DB, [DEGREE_INDEX_KEY]))[0])
+    return _degree_index
+
+
+async def fetch_total_node_counts(semantic_type):
+    semantic_list = total_node_count_types(semantic_type)
+    allcounts = await _get_values(CATEGORY_COUNTS_DB, semantic_list)
+    return decode_total_node_counts(semantic_list, allcounts)
@@ -0,0 +1,185 @@
+"""Hub nodes, and what to do with the links to them.
+
+A few nodes (very general diseases and phenotypes, chemical classes, taxa) link to a large part of the KG.  As
+enriched nodes they are meaningless, and the links to them make the groupings of coalesce_by_graph and the second
+hop lookups of infer far bigger than they need to be.
+
+generate_ac_files writes a degree index, degrees.txt, with the number of links of every node that has at least
+DEGREE_INDEX_MIN_DEGREE of them, in total and for each bare predicate:
+
+    MONDO:0000001   {"d": 120345, "p": {"biolink:subclass_of": 118000, "biolink:has_phenotype": 2345}}
+
+load_redis puts the whole index in db 5 under DEGREE_INDEX_KEY; the CSR and in-memory link stores read the file.
+
+A link goes to a hub when its other node has more than hub_degree_threshold links with the link's bare predicate.
+The hub policy says what happens to the hub links of each input node:
+
+    none    nothing (the default)
+    skip    they are dropped
+    cap     the hub_max_links of them to the least connected hubs are kept
+    sample  hub_max_links of them, picked at random with the input node as the seed, are kept
+
+Only nodes in the index can be hubs, so the threshold should be at least the DEGREE_INDEX_MIN_DEGREE of the build.
+The links pruned are counted by input node in a HubPruning, which the callers report in the TRAPI logs.
+
+Configuration (config.json, all optional):
+    hub_policy: "none", "skip", "cap" or "sample"
+    hub_degree_threshold: links to nodes with more than this many links with the same bare predicate are hub links
+    hub_max_links: for "cap" and "sample", the hub links to keep for each input node
+"""
+import random
+import threading
+import zlib
+import orjson
+from src.graph_coalescence.predicates import get_predicate_registry
+from src.graph_coalescence.redis_pool import load_config
+
+HUB_POLICIES = ('none', 'skip', 'cap', 'sample')
+DEFAULT_HUB_POLICY = 'none'
+DEFAULT_DEGREE_THRESHOLD = 10000
+DEFAULT_MAX_HUB_LINKS = 100
+DEGREE_INDEX_MIN_DEGREE = 1000
+DEGREE_INDEX_FILE = 'degrees.txt'
+DEGREE_INDEX_KEY = 'ac:degrees'
+
+
+class DegreeIndex:
+    def __init__(self, degrees=None):
+        # node -> (total degree, {bare predicate: degree})
+        self._degrees = degrees or {}
+
+    @classmethod
+    def from_records(cls, records):
+        """From (node, {"d": total, "p": {bare predicate: degree}}) pairs."""
+        return cls({node: (record['d'], record['p']) for node, record in records})
+
+    @classmethod
+    def from_file(cls, fname):
+        return cls.from_records(iter_degree_records(fname))
+
+    @classmethod
+    def from_redis_value(cls, value):
+        """From the db 5 value that load_redis writes, a json object of degrees.txt records; empty for None."""
+        if value is None:
+            return cls()
+        return cls.from_records(orjson.loads(value).items())
+
+    def __len__(self):
+        return len(self._degrees)
+
+    def __contains__(self, node):
+        return node in self._degrees
+
+    def degree(self, node, bare_predicate=None):
+        """The number of links of node, with bare_predicate if it's given; 0 for nodes not in the index."""
+        degrees = self._degrees.get(node)
+        if degrees is None:
+            return 0
+        if bare_predicate is None:
+            return degrees[0]
+        return degrees[1].get(bare_predicate, 0)
+
+
+def iter_degree_records(fname):
+    """(node, degrees record) for each line of a degrees.txt."""
+    with open(fname, 'rb') as inf:
+        for line in inf:
+            node, value = line.rstrip(b'\n').split(b'\t', 1)
+            yield node.decode('utf-8'), orjson.loads(value)
+
+
+class HubPolicy:
+    def __init__(self, kind=DEFAULT_HUB_POLICY, degree_threshold=DEFAULT_DEGREE_THRESHOLD,
+                 max_links=DEFAULT_MAX_HUB_LINKS):
+        if kind not in HUB_POLICIES:
+            raise ValueError(f'Unknown hub policy {kind}; use one of {", ".join(HUB_POLICIES)}')
+        self.kind = kind
+        self.degree_threshold = degree_threshold
+        self.max_links = max_links
+
+    @property
+    def active(self):
+        return self.kind != 'none'
+
+    def kept(self, node, positions, degrees):
+        """Which of a node's hub links, at positions with the hub degrees, to keep."""
+        if self.kind == 'skip' or self.max_links <= 0:
+            return ()
+        if len(positions) <= self.max_links:
+            return positions
+        if self.kind == 'cap':
+            return [positions[i] for i in sorted(range(len(positions)), key=degrees.__getitem__)[:self.max_links]]
+        return random.Random(zlib.crc32(node.encode('utf-8'))).sample(positions, self.max_links)
+
+
+class HubPruning:
+    """The hub links pruned for one request, by input node."""
+    def __init__(self):
+        self.links = {}
+
+    def add(self, node, pruned):
+        if pruned:
+            self.links[node] = self.links.get(node, 0) + pruned
+
+    @property
+    def total(self):
+        return sum(self.links.values())
+
+    def metadata(self):
+        return {"hub_pruned_links": self.total, "hub_pruned_inputs": len(self.links)}
+
+
+def prune_hub_links(nodes_to_links, degree_index, policy, pruning=None):
+    """nodes_to_links with the hub links of each node pruned under policy; counted in pruning if it is given."""
+    if not policy.active or not degree_index:
+        return nodes_to_links
+    registry = get_predicate_registry()
+    pruned_links = {}
+    for node, links in nodes_to_links.items():
+        pruned_links[node] = prune_node_hub_links(node, links, degree_index, policy, registry)
+        if pruning is not None:
+            pruning.add(node, len(links) - len(pruned_links[node]))
+    return pruned_links
+
+
+def prune_node_hub_links(node, links, degree_index, policy, registry):
+    """The links of node with its hub links pruned under policy, which is active; links itself if none are."""
+    threshold = policy.degree_threshold
+    positions = []
+    degrees = []
+    for i, link in enumerate(links):
+        if link[0] in degree_index:
+            degree = degree_index.degree(link[0], registry.info(link[1]).bare)
+            if degree > threshold:
+                positions.append(i)
+                degrees.append(degree)
+    if not positions:
+        return links
+    dropped = set(positions).difference(policy.kept(node, positions, degrees))
+    return [link for i, link in enumerate(links) if i not in dropped]
+
+
+_policy = None
+_policy_lock = threading.Lock()
+
+
+def create_hub_policy(conf):
+    return HubPolicy(conf.get('hub_policy', DEFAULT_HUB_POLICY),
+                     int(conf.get('hub_degree_threshold', DEFAULT_DEGREE_THRESHOLD)),
+                     int(conf.get('hub_max_links', DEFAULT_MAX_HUB_LINKS)))
+
+
+def get_hub_policy():
+    global _policy
+    if _policy is None:
+        with _policy_lock:
+            if _policy is None:
+                _policy = create_hub_policy(load_config())
+    return _policy
+
+
+def set_hub_policy(policy):
+    """Use policy for this process, e.g. in a test; None goes back to the one in config.json."""
+    global _policy
+    with _policy_lock:
+        _policy = policy
@@ -0,0 +1,157 @@
+"""In-process cache of decoded link lists, keyed by curie.
+
+A handful of hub curies (common genes, diseases, chemicals) show up as inputs in most MCQ and EDGAR requests, and
+their link lists run to megabytes of JSON.  Keeping the decoded lists in memory saves both the DB0 fetch and the
+orjson parse.
+
+The cache is bounded by the size of the raw JSON it has decoded (a stand-in for the memory held by the decoded
+lists).  Eviction is LRU, or with policy "lfu" the least-used of the oldest few entries is evicted, which keeps a
+hub that is hit on most requests from being pushed out by a burst of one-off curies.
+
+Cached lists are shared between requests: callers must not modify them.
+
+Entries are tied to the KG build.  load_redis writes a build version to KG_VERSION_KEY; the cache re-reads it at
+most every version_check_seconds and drops everything when it changes.
+
+Configuration (config.json, all optional):
+    link_cache_max_bytes: byte budget, 0 turns the cache off
+    link_cache_policy: "lru" or "lfu"
+    link_cache_version_check_seconds: how often to look for a new KG build
+"""
+import threading
+import time
+from collections import OrderedDict
+from src.graph_coalescence.redis_pool import load_config
+
+KG_VERSION_DB = 5
+KG_VERSION_KEY = 'ac:kg_version'
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_POLICY = 'lru'
+DEFAULT_VERSION_CHECK_SECONDS = 30
+# Number of least-recently-used entries considered for eviction under the lfu policy
+LFU_SAMPLE = 8
+# Rough per-entry overhead, so that caching many empty link lists still counts against the budget
+ENTRY_OVERHEAD = 64
+
+
+class LinkCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, policy=DEFAULT_POLICY,
+                 version_check_seconds=DEFAULT_VERSION_CHECK_SECONDS):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f'Unknown link cache policy {policy}')
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.version_check_seconds = version_check_seconds
+        # curie -> [links, nbytes, uses]
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._version = None
+        self._version_checked = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get_many(self, curies):
+        """Returns ({curie: links} for the cached curies, [curies that are not cached])."""
+        found = {}
+        missing = []
+        with self._lock:
+            for curie in curies:
+                entry = self._entries.get(curie)
+                if entry is None:
+                    missing.append(curie)
+                    continue
+                self._entries.move_to_end(curie)
+                entry[2] += 1
+                found[curie] = entry[0]
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put(self, curie, links, nbytes):
+        nbytes += ENTRY_OVERHEAD
+        if not self.enabled or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(curie, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[curie] = [links, nbytes, 1]
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._evict_one()
+
+    def _evict_one(self):
+        if self.policy == 'lfu':
+            oldest = []
+            for curie, entry in self._entries.items():
+                oldest.append((entry[2], len(oldest), curie))
+                if len(oldest) == LFU_SAMPLE:
+                    break
+            victim = min(oldest)[2]
+        else:
+            victim = next(iter(self._entries))
+        self._bytes -= self._entries.pop(victim)[1]
+        self.evictions += 1
+
+    def version_check_due(self):
+        return self._version_checked is None or time.monotonic() - self._version_checked >= self.version_check_seconds
+
+    def set_version(self, version):
+        """Record the KG version just read from redis, clearing the cache if it has changed."""
+        with self._lock:
+            if self._version_checked is not None and version != self._version:
+                self._entries.clear()
+                self._bytes = 0
+                self.invalidations += 1
+            self._version = version
+            self._version_checked = time.monotonic()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'entries': len(self._entries),
+                    'bytes': self._bytes,
+                    'max_bytes': self.max_bytes,
+                    'policy': self.policy,
+                    'kg_version': self._version.decode() if isinstance(self._version, bytes) else self._version,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_link_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                conf = load_config()
+                _cache = LinkCache(max_bytes=int(conf.get('link_cache_max_bytes', DEFAULT_MAX_BYTES)),
+                                   policy=conf.get('link_cache_policy', DEFAULT_POLICY),
+                                   version_check_seconds=float(conf.get('link_cache_version_check_seconds',
+                                                                        DEFAULT_VERSION_CHECK_SECONDS)))
+    return _cache
+
+
+def reset_link_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
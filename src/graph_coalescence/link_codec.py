@@ -0,0 +1,243 @@
+"""Compact binary encoding of a node's links.
+
+The JSON link lists in DB0 repeat the full qualified predicate text and the other node's curie in every link.  The
+binary format replaces both with integer ids into dictionaries shared by the whole KG build:
+
+    magic (2 bytes) | format version (1 byte) | varints...
+
+where the varints are
+    dictionary id, number of links, then per link: node id, (predicate id << 1) | node_is_source
+
+Varints are unsigned LEB128: 7 bits per byte, high bit set on every byte but the last.
+
+The dictionary id ties a value to the node and predicate dictionaries it was written with (it is a checksum of
+them), so a process holding an old dictionary notices a new build and reloads.  The dictionaries live in db 5 under
+dictionary_keys(dictionary_id).
+
+decode_links gives back exactly what orjson.loads gives for the JSON value: a list of [curie, predicate, bool].
+
+The db 7 link partitions (see graph_data) put the positions of their links in the node's whole link list in front:
+
+    partition magic (2 bytes) | format version (1 byte) | varints... | encoded links
+
+where the varints are the number of positions, then each position less the one before.
+"""
+import array
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b'\xacL'
+FORMAT_VERSION = 1
+HEADER = MAGIC + bytes([FORMAT_VERSION])
+PARTITION_MAGIC = b'\xacP'
+PARTITION_HEADER = PARTITION_MAGIC + bytes([FORMAT_VERSION])
+DICTIONARY_DB = 5
+# Below this many bytes of varints, a plain python loop is quicker than setting up numpy
+NUMPY_MIN_BYTES = 256
+
+
+def is_encoded(value):
+    return value[:2] == MAGIC
+
+
+def is_encoded_partition(value):
+    return value[:2] == PARTITION_MAGIC
+
+
+def dictionary_keys(dictionary_id):
+    return f'ac:linkdict:{dictionary_id}:nodes', f'ac:linkdict:{dictionary_id}:predicates'
+
+
+def dictionary_id(nodes, predicates):
+    crc = zlib.crc32(b'\n'.join(n.encode('utf-8') for n in nodes))
+    return zlib.crc32(b'\n'.join(p.encode('utf-8') for p in predicates), crc)
+
+
+def encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode_links(links, node_ids, predicate_ids, dict_id):
+    """links: [(other_node, predicate, node_is_source), ...]; node_ids and predicate_ids map those to their ids."""
+    out = bytearray(HEADER)
+    encode_varint(dict_id, out)
+    encode_varint(len(links), out)
+    for other_node, predicate, node_is_source in links:
+        encode_varint(node_ids[other_node], out)
+        encode_varint((predicate_ids[predicate] << 1) | bool(node_is_source), out)
+    return bytes(out)
+
+
+def encode_partition(positions, value):
+    """A link partition value: positions, increasing, then value, the partition's encoded links."""
+    out = bytearray(PARTITION_HEADER)
+    encode_varint(len(positions), out)
+    previous = 0
+    for position in positions:
+        encode_varint(position - previous, out)
+        previous = position
+    return bytes(out) + value
+
+
+def read_varint(value, offset):
+    """(the varint at offset, the offset after it)."""
+    result = 0
+    shift = 0
+    while True:
+        b = value[offset]
+        result |= (b & 0x7f) << shift
+        offset += 1
+        if not b & 0x80:
+            return result, offset
+        shift += 7
+
+
+def decode_partition(value):
+    """(positions, encoded links) of an encoded link partition."""
+    if value[:2] != PARTITION_MAGIC:
+        raise ValueError('Not an encoded link partition')
+    if value[2] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported link format version {value[2]}')
+    count, offset = read_varint(value, len(PARTITION_HEADER))
+    positions = []
+    position = 0
+    for _ in range(count):
+        delta, offset = read_varint(value, offset)
+        position += delta
+        positions.append(position)
+    return positions, value[offset:]
+
+
+def decode_varints_python(buf, offset=0):
+    values = []
+    value = 0
+    shift = 0
+    for b in buf[offset:]:
+        value |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    if shift:
+        raise ValueError('Truncated varint')
+    return values
+
+
+def decode_varints(buf, offset=0):
+    """All the varints in buf[offset:] as a uint64 array, without a python-level loop."""
+    b = np.frombuffer(buf, dtype=np.uint8, offset=offset)
+    if len(b) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(b < 0x80)
+    if len(ends) == 0 or ends[-1] != len(b) - 1:
+        raise ValueError('Truncated varint')
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Each byte's position within its varint gives its shift
+    position = np.arange(len(b)) - np.repeat(starts, ends - starts + 1)
+    parts = (b & 0x7f).astype(np.uint64) << (position * 7).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+class LinkDictionary:
+    """The node and predicate dictionaries of one KG build.
+
+    Nodes are kept as one utf-8 blob plus offsets rather than millions of python strings; curies are only made for
+    the links being decoded.  The offsets are arrays (compact, and quick to index one at a time) with numpy views
+    for indexing many at once."""
+
+    def __init__(self, dict_id, nodes_blob, predicates_blob):
+        self.id = dict_id
+        self.nodes_blob = nodes_blob
+        separators = np.flatnonzero(np.frombuffer(nodes_blob, dtype=np.uint8) == ord('\n'))
+        self.node_starts = array.array('q', np.concatenate(([0], separators + 1)).astype(np.int64).tobytes())
+        self.node_ends = array.array('q', np.concatenate((separators, [len(nodes_blob)])).astype(np.int64).tobytes())
+        self._np_starts = np.frombuffer(self.node_starts, dtype=np.int64)
+        self._np_ends = np.frombuffer(self.node_ends, dtype=np.int64)
+        self.predicates = predicates_blob.decode('utf-8').split('\n') if predicates_blob else []
+
+    @classmethod
+    def from_lists(cls, dict_id, nodes, predicates):
+        return cls(dict_id, '\n'.join(nodes).encode('utf-8'), '\n'.join(predicates).encode('utf-8'))
+
+    def __len__(self):
+        return len(self.node_starts)
+
+    def curies(self, node_ids):
+        """Curies for an array of node ids."""
+        blob = self.nodes_blob
+        return [blob[s:e].decode('utf-8') for s, e in zip(self._np_starts[node_ids].tolist(),
+                                                          self._np_ends[node_ids].tolist())]
+
+    def curie(self, node_id):
+        return self.nodes_blob[self.node_starts[node_id]:self.node_ends[node_id]].decode('utf-8')
+
+
+def read_header(value):
+    """(dictionary id, offset of the link count) for an encoded value."""
+    if value[:2] != MAGIC:
+        raise ValueError('Not an encoded link list')
+    if value[2] != FORMAT_VERSION:
+        raise ValueError(f'Unsupported link format version {value[2]}')
+    dict_id = 0
+    shift = 0
+    offset = len(HEADER)
+    while True:
+        b = value[offset]
+        dict_id |= (b & 0x7f) << shift
+        offset += 1
+        if not b & 0x80:
+            return dict_id, offset
+        shift += 7
+
+
+def decode_links(value, get_dictionary):
+    """Decode an encoded link list.  get_dictionary(dictionary_id) returns the LinkDictionary it was written with."""
+    dict_id, offset = read_header(value)
+    dictionary = get_dictionary(dict_id)
+    predicates = dictionary.predicates
+    if len(value) - offset < NUMPY_MIN_BYTES:
+        varints = decode_varints_python(value, offset)
+        check_count(varints)
+        curie = dictionary.curie
+        return [[curie(n), predicates[p >> 1], bool(p & 1)] for n, p in zip(varints[1::2], varints[2::2])]
+    varints = decode_varints(value, offset)
+    check_count(varints)
+    curies = dictionary.curies(varints[1::2].astype(np.int64))
+    return [[curie, predicates[p >> 1], bool(p & 1)] for curie, p in zip(curies, varints[2::2].tolist())]
+
+
+def check_count(varints):
+    if len(varints) != 1 + 2 * int(varints[0]):
+        raise ValueError(f'Expected {int(varints[0])} links, found {(len(varints) - 1) / 2}')
+
+
+###
+# The file that generate_ac_files writes and load_redis reads: a sequence of records, each
+# a 4 byte big-endian key length, the key, a 4 byte big-endian value length and the value.
+###
+
+def write_record(outf, key, value):
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    outf.write(struct.pack('>I', len(key)))
+    outf.write(key)
+    outf.write(struct.pack('>I', len(value)))
+    outf.write(value)
+
+
+def read_records(inf, decode_keys=True):
+    while True:
+        size = inf.read(4)
+        if not size:
+            return
+        key = inf.read(struct.unpack('>I', size)[0])
+        value = inf.read(struct.unpack('>I', inf.read(4))[0])
+        yield (key.decode('utf-8') if decode_keys else key), value
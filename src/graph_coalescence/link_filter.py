@@ -0,0 +1,113 @@
+"""The filters that coalesce_by_graph runs over the fetched links of its inputs, fused into two passes.
+
+The node constraints need the categories of the link nodes, which are fetched in between, so there are two passes:
+
+    first_pass    context qualifiers and include predicate constraints, excluded ids, the blocklist and the hub
+                  policy; collects the link nodes, for the metadata fetch
+    second_pass   the node constraints; collects the unique links, for the count fetch
+
+Each pass goes over the links of each input once, keeping a link or counting why it was dropped, rather than building a
+new nodes_to_links for every filter and going over the result again to find the unique link nodes and links.
+"""
+from operator import itemgetter
+from src.graph_coalescence.categories import get_category_bits
+from src.graph_coalescence.hubs import get_hub_policy, prune_node_hub_links
+from src.graph_coalescence.predicates import PredicateMatcher, get_predicate_registry
+
+# These are trash curies that we never want to see.  Hubs in general are handled by the hub policy (see hubs), but
+# these never make sense as enrichments, whatever it is.
+BLOCKLIST = frozenset({"HP:0000118", "MONDO:0000001", "MONDO:0700096", "UMLS:C1333305", "CHEBI:24431", "CHEBI:23367",
+                       "CHEBI:33579", "CHEBI:36357", "CHEBI:33675", "CHEBI:33302", "CHEBI:33304", "CHEBI:33582",
+                       "CHEBI:25806", "CHEBI:50860", "CHEBI:51143", "CHEBI:32988", "CHEBI:33285", "CHEBI:33256",
+                       "CHEBI:36962", "CHEBI:35352", "CHEBI:36963", "CHEBI:25367", "CHEBI:72695", "CHEBI:33595",
+                       "CHEBI:33832", "CHEBI:37577", "CHEBI:24532", "CHEBI:5686", "NCBITaxon:9606"})
+LINK_FILTERS = ('predicate', 'excluded', 'blocklist', 'hub', 'node_type')
+
+
+class LinkFilter:
+    """The link filters of one query.  Hub links are pruned when the hub policy is active and degree_index (which
+    the caller fetches) isn't empty, and counted in hub_pruning.  drops counts the links that each of LINK_FILTERS
+    dropped."""
+    def __init__(self, input_node_type, node_constraints, predicate_constraints, predicate_constraint_style,
+                 context_qualifiers, exclude_ids, degree_index=None, hub_pruning=None):
+        self.input_node_type = input_node_type
+        self.node_constraints = node_constraints
+        # We don't want to do the exclusion here because we want to do it after we've found the enrichments, but we
+        # can narrow down by the inclusion constraints
+        include = predicate_constraints if predicate_constraint_style == "include" and predicate_constraints else None
+        if include or context_qualifiers:
+            self.matcher = PredicateMatcher(include, context_qualifiers=context_qualifiers)
+        else:
+            self.matcher = None
+        self.exclude_ids = exclude_ids or ()
+        self.hub_policy = get_hub_policy()
+        self.degree_index = degree_index
+        self.hub_pruning = hub_pruning
+        self.drops = dict.fromkeys(LINK_FILTERS, 0)
+
+    def first_pass(self, nodes_to_links):
+        """(nodes_to_links filtered by everything but the node constraints, the link nodes left)."""
+        matcher = self.matcher
+        exclude_ids = self.exclude_ids
+        prune_hubs = self.hub_policy.active and bool(self.degree_index)
+        registry = get_predicate_registry()
+        drops = self.drops
+        link_nodes = set()
+        kept_links = {}
+        for node, links in nodes_to_links.items():
+            kept = []
+            for link in links:
+                if matcher is not None and not matcher(link[1]):
+                    drops['predicate'] += 1
+                elif link[0] in exclude_ids:
+                    drops['excluded'] += 1
+                elif link[0] in BLOCKLIST:
+                    drops['blocklist'] += 1
+                else:
+                    kept.append(link)
+            if prune_hubs:
+                unpruned = len(kept)
+                kept = prune_node_hub_links(node, kept, self.degree_index, self.hub_policy, registry)
+                drops['hub'] += unpruned - len(kept)
+                if self.hub_pruning is not None:
+                    self.hub_pruning.add(node, unpruned - len(kept))
+            kept_links[node] = kept
+            link_nodes.update(map(itemgetter(0), kept))
+        return kept_links, link_nodes
+
+    def second_pass(self, nodes_to_links, nodetypedict):
+        """(nodes_to_links filtered by the node constraints, given the categories of the link nodes, and the unique
+        links left as (link node, predicate, link node is source, input type) count keys)."""
+        # We're going to special case named thing - if that's in there, we just bypass all the type checks.
+        accept_all_types = "biolink:NamedThing" in self.node_constraints
+        category_bits = get_category_bits()
+        accepted_mask = category_bits.mask(self.node_constraints)
+        node_masks = {}
+        registry = get_predicate_registry()
+        symmetric = {}
+        input_node_type = self.input_node_type
+        unique_links = set()
+        kept_links = {}
+        dropped = 0
+        for node, links in nodes_to_links.items():
+            kept = []
+            for link in links:
+                other = link[0]
+                if not accept_all_types:
+                    node_mask = node_masks.get(other)
+                    if node_mask is None:
+                        node_mask = node_masks[other] = category_bits.mask(nodetypedict[other])
+                    if not node_mask & accepted_mask:
+                        dropped += 1
+                        continue
+                kept.append(link)
+                # The link as defined uses the input node as is_source, but the count key uses the linked node as
+                # the is_source, so it gets flipped; symmetric links are always True
+                predicate = link[1]
+                is_symmetric = symmetric.get(predicate)
+                if is_symmetric is None:
+                    is_symmetric = symmetric[predicate] = registry.info(predicate).symmetric
+                unique_links.add((other, predicate, True if is_symmetric else not link[2], input_node_type))
+            kept_links[node] = kept
+        self.drops['node_type'] += dropped
+        return kept_links, unique_links
@@ -0,0 +1,267 @@
+"""Where the graph coalescer gets its KG data from.
+
+A LinkStore answers the coalescer's questions about a KG build (links, node metadata, link counts, provenance,
+category totals and the hubs.DegreeIndex) without saying how they are stored:
+
+    RedisLinkStore      the redis databases described in graph_data (the default)
+    CSRLinkStore        a memory-mapped csr_store.CSRStore
+    InMemoryLinkStore   python dicts, e.g. loaded from the tests/test_*.txt fixtures; for running and timing the
+                        coalescer without a redis server
+
+Every question has a synchronous form and an async fetch_ form.  Only redis has anything to wait on, so the other
+stores answer the async forms synchronously.
+
+The store is chosen in config.json:
+    link_store: "redis", "csr" or "memory"
+    csr_store_path: the CSRStore directory, for "csr"
+    memory_store_dir, memory_store_prefix: the generate_ac_files outputs to load, for "memory"
+"""
+import os
+import threading
+import orjson
+from src.graph_coalescence import graph_data
+from src.graph_coalescence.hubs import DegreeIndex, DEGREE_INDEX_FILE
+from src.graph_coalescence.graph_data import decode_total_node_counts, get_edge_symmetric, resolve_provs, \
+    resolve_symmetric_provs, total_node_count_types
+from src.graph_coalescence.redis_pool import load_config
+
+
+class LinkStore:
+    def links(self, nodes):
+        """{node: links} for the unique nodes in nodes, each link [other_node, predicate_json, node_is_source].  The
+        lists may be shared, so don't modify them."""
+        raise NotImplementedError
+
+    def link_partitions(self, node_to_predicates):
+        """{node: links} with only the links whose bare predicate is one of node_to_predicates[node], or None if the
+        store can't split them (use links)."""
+        return None
+
+    def node_metadata(self, nodes):
+        """({node: categories}, {node: name}).  Nodes with no categories are left out of the first dict, and nodes
+        with no name get ''."""
+        raise NotImplementedError
+
+    def link_counts(self, unique_links):
+        """{link: count} for (node, predicate_json, node_is_source, category) tuples."""
+        raise NotImplementedError
+
+    def provs(self, edges):
+        """{edge: prov} for "subject predicate_json object" edge strings."""
+        raise NotImplementedError
+
+    def total_node_counts(self, semantic_type):
+        """{category: count} for biolink:NamedThing and semantic_type."""
+        raise NotImplementedError
+
+    def degree_index(self):
+        """The hubs.DegreeIndex of the build; empty if it doesn't have one."""
+        return DegreeIndex()
+
+    async def fetch_links(self, nodes):
+        return self.links(nodes)
+
+    async def fetch_link_partitions(self, node_to_predicates):
+        return self.link_partitions(node_to_predicates)
+
+    async def fetch_node_metadata(self, nodes):
+        return self.node_metadata(nodes)
+
+    async def fetch_link_counts(self, unique_links):
+        return self.link_counts(unique_links)
+
+    async def fetch_provs(self, edges):
+        return self.provs(edges)
+
+    async def fetch_total_node_counts(self, semantic_type):
+        return self.total_node_counts(semantic_type)
+
+    async def fetch_degree_index(self):
+        return self.degree_index()
+
+
+def resolve_prov_values(edges, get_values):
+    """{edge: prov} given get_values(edge keys) -> raw db 4 style values, trying the symmetric edge for misses."""
+    edges = list(dict.fromkeys(edges))
+    prov, missing = resolve_provs(edges, get_values(edges))
+    if missing:
+        prov.update(resolve_symmetric_provs(missing, get_values([get_edge_symmetric(edge) for edge in missing])))
+    return prov
+
+
+class RedisLinkStore(LinkStore):
+    def links(self, nodes):
+        return graph_data.load_links(nodes)
+
+    def link_partitions(self, node_to_predicates):
+        return graph_data.load_link_partitions(node_to_predicates)
+
+    def node_metadata(self, nodes):
+        return graph_data.load_node_metadata(nodes)
+
+    def link_counts(self, unique_links):
+        return graph_data.load_link_counts(unique_links)
+
+    def provs(self, edges):
+        return graph_data.load_provs(edges)
+
+    def total_node_counts(self, semantic_type):
+        return graph_data.load_total_node_counts(semantic_type)
+
+    def degree_index(self):
+        return graph_data.load_degree_index()
+
+    async def fetch_links(self, nodes):
+        return await graph_data.fetch_links(nodes)
+
+    async def fetch_link_partitions(self, node_to_predicates):
+        return await graph_data.fetch_link_partitions(node_to_predicates)
+
+    async def fetch_node_metadata(self, nodes):
+        return await graph_data.fetch_node_metadata(nodes)
+
+    async def fetch_link_counts(self, unique_links):
+        return await graph_data.fetch_link_counts(unique_links)
+
+    async def fetch_provs(self, edges):
+        return await graph_data.fetch_provs(edges)
+
+    async def fetch_total_node_counts(self, semantic_type):
+        return await graph_data.fetch_total_node_counts(semantic_type)
+
+    async def fetch_degree_index(self):
+        return await graph_data.fetch_degree_index()
+
+
+class CSRLinkStore(LinkStore):
+    def __init__(self, store):
+        self.store = store
+        self._degree_index = None
+
+    @classmethod
+    def open(cls, path):
+        from src.graph_coalescence.csr_store import CSRStore
+        return cls(CSRStore(path))
+
+    def links(self, nodes):
+        return self.store.links(nodes)
+
+    def link_partitions(self, node_to_predicates):
+        return self.store.link_partitions(node_to_predicates)
+
+    def node_metadata(self, nodes):
+        return self.store.node_metadata(nodes)
+
+    def link_counts(self, unique_links):
+        return self.store.link_counts(unique_links)
+
+    def provs(self, edges):
+        return resolve_prov_values(edges, self.store.prov_values)
+
+    def total_node_counts(self, semantic_type):
+        semantic_list = total_node_count_types(semantic_type)
+        return decode_total_node_counts(semantic_list, self.store.category_count_values(semantic_list))
+
+    def degree_index(self):
+        # build_csr_store copies degrees.txt into the store directory when the build has one
+        if self._degree_index is None:
+            fname = os.path.join(self.store.path, DEGREE_INDEX_FILE)
+            self._degree_index = DegreeIndex.from_file(fname) if os.path.exists(fname) else DegreeIndex()
+        return self._degree_index
+
+
+class InMemoryLinkStore(LinkStore):
+    def __init__(self, nodes_to_links=None, node_types=None, node_names=None, link_counts=None, provs=None,
+                 category_counts=None, degrees=None):
+        self.nodes_to_links = nodes_to_links or {}
+        self.node_types = node_types or {}
+        self.node_names = node_names or {}
+        # (node, predicate_json, node_is_source, category) -> count
+        self.counts = link_counts or {}
+        # edge -> raw json provenance
+        self.prov_values = provs or {}
+        self.category_counts = category_counts or {}
+        self.degrees = degrees or DegreeIndex()
+        self._bare_predicates = {}
+
+    @classmethod
+    def from_files(cls, datadir, prefix='test_'):
+        """Load generate_ac_files outputs; the default prefix reads the tests/test_*.txt fixtures."""
+        from src.graph_coalescence.csr_store import iter_links, iter_node_metadata, iter_link_counts, iter_provs, \
+            read_category_counts
+        node_types = {}
+        node_names = {}
+        for node, categories, name in iter_node_metadata(datadir, prefix):
+            if categories:
+                node_types[node] = categories
+            node_names[node] = name
+        degrees_file = os.path.join(datadir, f'{prefix}{DEGREE_INDEX_FILE}')
+        return cls(nodes_to_links=dict(iter_links(datadir, prefix)),
+                   node_types=node_types,
+                   node_names=node_names,
+                   link_counts={tuple(link): count for link, count in iter_link_counts(datadir, prefix)},
+                   provs={edge: value for edge, value in iter_provs(datadir, prefix) if value},
+                   category_counts=read_category_counts(datadir, prefix),
+                   degrees=DegreeIndex.from_file(degrees_file) if os.path.exists(degrees_file) else None)
+
+    def _bare(self, predicate):
+        bare = self._bare_predicates.get(predicate)
+        if bare is None:
+            bare = self._bare_predicates[predicate] = orjson.loads(predicate).get('predicate')
+        return bare
+
+    def links(self, nodes):
+        return {node: self.nodes_to_links.get(node, []) for node in dict.fromkeys(nodes)}
+
+    def link_partitions(self, node_to_predicates):
+        return {node: [link for link in self.nodes_to_links.get(node, []) if self._bare(link[1]) in bare_predicates]
+                for node, bare_predicates in node_to_predicates.items()}
+
+    def node_metadata(self, nodes):
+        nodes = list(dict.fromkeys(nodes))
+        nodetypedict = {node: self.node_types[node] for node in nodes if self.node_types.get(node)}
+        return nodetypedict, {node: self.node_names.get(node, '') for node in nodes}
+
+    def link_counts(self, unique_links):
+        return {link: self.counts.get(link, 0) for link in unique_links}
+
+    def provs(self, edges):
+        return resolve_prov_values(edges, lambda keys: [self.prov_values.get(key) for key in keys])
+
+    def total_node_counts(self, semantic_type):
+        semantic_list = total_node_count_types(semantic_type)
+        return decode_total_node_counts(semantic_list, [self.category_counts.get(st) for st in semantic_list])
+
+    def degree_index(self):
+        return self.degrees
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_link_store(conf):
+    kind = conf.get('link_store', 'redis')
+    if kind == 'redis':
+        return RedisLinkStore()
+    if kind == 'csr':
+        return CSRLinkStore.open(conf['csr_store_path'])
+    if kind == 'memory':
+        return InMemoryLinkStore.from_files(conf['memory_store_dir'], conf.get('memory_store_prefix', 'test_'))
+    raise ValueError(f'Unknown link store {kind}')
+
+
+def get_link_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_link_store(load_config())
+    return _store
+
+
+def set_link_store(store):
+    """Use store for this process, e.g. an InMemoryLinkStore for a test or benchmark.  None goes back to config."""
+    global _store
+    with _store_lock:
+        _store = store
@@ -1,7 +1,19 @@
 import os
+import ast
 import sys
+import time
+import orjson
 import redis
 
+# This is run as a script from the ac root (python src/graph_coalescence/load_redis.py), so make src importable
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..'))
+from src.graph_coalescence import link_codec
+from src.graph_coalescence.count_keys import CountKeyBuilder, DICTIONARY_DB as COUNT_DICTIONARY_DB, \
+    PREDICATES_KEY, CATEGORIES_KEY
+from src.graph_coalescence.link_cache import KG_VERSION_DB, KG_VERSION_KEY
+from src.graph_coalescence.graph_data import LINK_PARTITIONS_DB, LINK_PARTITIONS_FORMAT, LINK_PARTITIONS_KEY
+from src.graph_coalescence.hubs import DEGREE_INDEX_FILE, DEGREE_INDEX_KEY, iter_degree_records
+
 def get_redis(db):
     r = redis.Redis(host=os.environ.get('REDIS_HOST', 'localhost'), port=int(os.environ.get('REDIS_PORT',  6379)), db=db)
     return r
@@ -27,24 +39,156 @@ def write_to(fname,db):
     pipe.execute()
     print(n)
 
+def write_binary_links(datadir):
+    """Load links.bin (see link_codec) into db 0 and its dictionaries into db 5."""
+    with open(os.path.join(datadir, 'linkdict_id.txt'), 'r') as inf:
+        dict_id = inf.read().strip()
+    dictionary_redis = get_redis(link_codec.DICTIONARY_DB)
+    for name, key in zip(('nodes', 'predicates'), link_codec.dictionary_keys(dict_id)):
+        with open(os.path.join(datadir, f'linkdict_{name}.txt'), 'rb') as inf:
+            dictionary_redis.set(key, inf.read().rstrip(b'\n'))
+    print(f'Processing links.bin with link dictionary {dict_id}')
+    write_records(os.path.join(datadir, 'links.bin'), 0)
+
+def write_records(fname, db):
+    """Load a file of link_codec records."""
+    pipe = get_redis(db).pipeline()
+    n = 0
+    with open(fname, 'rb') as inf:
+        for key, value in link_codec.read_records(inf, decode_keys=False):
+            pipe.set(key, value)
+            n += 1
+            if n % 10000 == 0:
+                pipe.execute()
+    pipe.execute()
+    print(n)
+
+def write_link_partitions(datadir):
+    """Load the db 7 per-predicate link partitions, if the build wrote them, and mark them as loaded."""
+    marker_redis = get_redis(COUNT_DICTIONARY_DB)
+    binary_fname = os.path.join(datadir, 'linkparts.bin')
+    text_fname = os.path.join(datadir, 'linkparts.txt')
+    if os.path.exists(binary_fname):
+        print(f'Processing {binary_fname}')
+        write_records(binary_fname, LINK_PARTITIONS_DB)
+    elif os.path.exists(text_fname):
+        write_to(text_fname, LINK_PARTITIONS_DB)
+    else:
+        marker_redis.delete(LINK_PARTITIONS_KEY)
+        return
+    marker_redis.set(LINK_PARTITIONS_KEY, LINK_PARTITIONS_FORMAT)
+
+def write_degree_index(datadir):
+    """Load degrees.txt, if the build wrote it, into db 5 as one json object, node -> degrees record."""
+    index_redis = get_redis(KG_VERSION_DB)
+    fname = os.path.join(datadir, DEGREE_INDEX_FILE)
+    if not os.path.exists(fname):
+        index_redis.delete(DEGREE_INDEX_KEY)
+        return
+    print(f'Processing {fname}')
+    records = dict(iter_degree_records(fname))
+    index_redis.set(DEGREE_INDEX_KEY, orjson.dumps(records))
+    print(len(records))
+
+def write_link_counts(datadir, fname):
+    """Load the db 2 link counts with compact keys (see count_keys).  Builds that wrote backlinks.bin already have
+    compact keys; for those that only have backlinks.txt, with str(tuple) keys, the keys are converted as they are
+    loaded.  Setting LEGACY_COUNT_KEYS loads backlinks.txt with its keys as they are."""
+    dictionary_redis = get_redis(COUNT_DICTIONARY_DB)
+    if os.environ.get('LEGACY_COUNT_KEYS'):
+        dictionary_redis.delete(PREDICATES_KEY, CATEGORIES_KEY)
+        write_to(os.path.join(datadir, fname), 2)
+        return
+    compact_fname = os.path.join(datadir, 'backlinks.bin')
+    if os.path.exists(compact_fname):
+        with open(os.path.join(datadir, 'countdict.json'), 'rb') as inf:
+            dictionaries = orjson.loads(inf.read())
+        print(f'Processing {compact_fname}')
+        write_records(compact_fname, 2)
+        dictionary_redis.set(PREDICATES_KEY, orjson.dumps(dictionaries['predicates']))
+        dictionary_redis.set(CATEGORIES_KEY, orjson.dumps(dictionaries['categories']))
+        return
+    print(f'Converting {fname} to compact count keys')
+    builder = CountKeyBuilder()
+    pipe = get_redis(2).pipeline()
+    n = 0
+    with open(os.path.join(datadir, fname), 'r') as inf:
+        for line in inf:
+            key, count = line.rstrip('\n').split('\t')
+            pipe.set(builder.key(ast.literal_eval(key)), count)
+            n += 1
+            if n % 10000 == 0:
+                pipe.execute()
+    pipe.execute()
+    predicates_value, categories_value = builder.dictionary_values()
+    dictionary_redis.set(PREDICATES_KEY, predicates_value)
+    dictionary_redis.set(CATEGORIES_KEY, categories_value)
+    print(n)
+
+def write_links(datadir, fname):
+    """The binary links if the build made them, otherwise the json links."""
+    if os.path.exists(os.path.join(datadir, 'links.bin')):
+        write_binary_links(datadir)
+    else:
+        write_to(os.path.join(datadir, fname), 0)
+
+def write_node_metadata(metadata_fname, labels_fname, names_fname):
+    """Load the db 6 node metadata records.  KG builds from before nodemetadata.txt existed only have nodelabels.txt
+    and nodenames.txt, so in that case the records are put together from those."""
+    if os.path.exists(metadata_fname):
+        write_to(metadata_fname, 6)
+        return
+    print(f'Building node metadata from {labels_fname} and {names_fname}')
+    names = {}
+    with open(names_fname, 'r') as inf:
+        for line in inf:
+            x = line.rstrip('\n').split('\t')
+            names[x[0]] = x[1] if len(x) > 1 else ''
+    pipe = get_redis(6).pipeline()
+    n = 0
+    with open(labels_fname, 'r') as inf:
+        for line in inf:
+            node, labels = line.strip().split('\t')
+            # Same record as build_redis_files.node_metadata_record
+            pipe.set(node, orjson.dumps({'c': ast.literal_eval(labels), 'n': names.get(node, '')}))
+            n += 1
+            if n % 10000 == 0:
+                pipe.execute()
+    pipe.execute()
+    print(n)
+
+def write_kg_version(version=None):
+    """Record which KG build is loaded.  Running coalescers drop their cached link lists when this changes."""
+    if version is None:
+        version = os.environ.get('KG_VERSION', time.strftime('%Y%m%dT%H%M%S'))
+    get_redis(KG_VERSION_DB).set(KG_VERSION_KEY, version)
+    print(f'KG version {version}')
+
 def go():
     import os
     thisdir = os.environ.get('DATA_DIR', os.path.dirname(os.path.realpath(__file__)))
-    write_to(os.path.join(thisdir, 'links.txt'),0)
+    write_links(thisdir, 'links.txt')
+    write_link_partitions(thisdir)
+    write_degree_index(thisdir)
     write_to(os.path.join(thisdir, 'nodelabels.txt'),1)
-    write_to(os.path.join(thisdir, 'backlinks.txt'),2)
+    write_link_counts(thisdir, 'backlinks.txt')
     write_to(os.path.join(thisdir, 'nodenames.txt'),3)
     write_to(os.path.join(thisdir, 'prov.txt'),4)
     write_to(os.path.join(thisdir, 'category_count.txt'),5)
+    write_node_metadata(os.path.join(thisdir, 'nodemetadata.txt'), os.path.join(thisdir, 'nodelabels.txt'),
+                        os.path.join(thisdir, 'nodenames.txt'))
+    write_kg_version()
 
 def go_test():
     #Is going to run from ac root
     write_to('tests/test_links.txt',0)
     write_to('tests/test_nodelabels.txt',1)
-    write_to('tests/test_backlinks.txt',2)
+    write_link_counts('tests', 'test_backlinks.txt')
     write_to('tests/test_nodenames.txt',3)
     write_to('tests/test_prov.txt',4)
     write_to('tests/category_count.txt',5) #the cat counts are the same for the test db
+    write_node_metadata('tests/test_nodemetadata.txt', 'tests/test_nodelabels.txt', 'tests/test_nodenames.txt')
+    write_kg_version()
 
 if __name__ == '__main__':
     if len(sys.argv) > 1 and sys.argv[1] == 'test':
@@ -0,0 +1,215 @@
+"""Recent MCQ member sets and their links, so that an MCQ overlapping one of them is enriched incrementally.
+
+MCQs often arrive in runs that share most of their members: a gene set refined by a few genes at a time, or the same
+set asked about with a different predicate.  The expensive parts of an enrichment are per member (fetching and
+filtering its links) or per link (its node's types and name, its count), so a member set is kept as:
+
+    LinkTable       for one set of query settings, every link seen so far, numbered, with the node metadata and link
+                    counts fetched for them and the scoring candidate and n of each link.  The numbering and the
+                    metadata grow as new members bring new links; nothing is ever taken out.
+    MemberSetState  the members of one set and, for each member, the numbers of its filtered links
+
+A request is matched to the kept set with the same settings that is closest to it.  Only the members it adds are
+fetched and filtered, and only the nodes and links it hasn't seen are looked up; the members it drops are simply
+left out.  The x counts then come from an incidence matrix built straight from the link numbers, and the p-values
+of the links whose (x, n) didn't change come from the p-value cache.
+
+A table is tied to the KG build: it is dropped when the link cache sees a new build, after ttl_seconds, or once it
+holds more than max_links links.
+
+Configuration (config.json, all optional):
+    mcq_incremental_states: member sets to keep, 0 turns incremental enrichment off
+    mcq_incremental_max_delta: the largest change, as a fraction of the members, applied to a kept set; anything
+        further off is enriched from scratch (and kept in turn)
+    mcq_incremental_max_links: links to keep in one table
+    mcq_incremental_ttl_seconds: how long a table is used for
+"""
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from src.graph_coalescence.link_cache import get_link_cache
+from src.graph_coalescence.predicates import get_predicate_registry
+from src.graph_coalescence.redis_pool import load_config
+
+DEFAULT_MAX_STATES = 0
+DEFAULT_MAX_DELTA = 0.5
+DEFAULT_MAX_LINKS = 1 << 22
+DEFAULT_TTL_SECONDS = 600
+
+
+class LinkTable:
+    def __init__(self, semantic_type):
+        self.semantic_type = semantic_type
+        # link tuple -> number; links[number] is the tuple
+        self.index = {}
+        self.links = []
+        # (newcurie, predicate, newcurie_is_source) and n for each link, as select_enriched_links scores it
+        self.candidates = []
+        self.counts = []
+        # What coalesce_by_graph fetches for the links, filled in as new links show up
+        self.nodetypedict = {}
+        self.nodenamedict = {}
+        self.lcounts = {}
+        self.created = time.monotonic()
+        self.kg_invalidations = get_link_cache().invalidations
+        self._symmetric = {}
+
+    def __len__(self):
+        return len(self.links)
+
+    def number(self, links):
+        """The numbers of links, as an array, numbering the new ones.  Their counts must be in lcounts."""
+        index = self.index
+        numbers = np.empty(len(links), dtype=np.int64)
+        for i, link in enumerate(links):
+            key = tuple(link)
+            number = index.get(key)
+            if number is None:
+                number = index[key] = len(self.links)
+                self._add(key)
+            numbers[i] = number
+        return numbers
+
+    def _add(self, link):
+        newcurie, predicate, is_source = link
+        symmetric = self._symmetric.get(predicate)
+        if symmetric is None:
+            symmetric = self._symmetric[predicate] = get_predicate_registry().info(predicate).symmetric
+        candidate = (newcurie, predicate, True if symmetric else not is_source)
+        self.links.append(link)
+        self.candidates.append(candidate)
+        self.counts.append(self.lcounts[candidate + (self.semantic_type,)])
+
+    def stale(self, ttl_seconds):
+        return time.monotonic() - self.created > ttl_seconds or get_link_cache().invalidations != self.kg_invalidations
+
+
+class MemberSetState:
+    __slots__ = ('members', 'member_links', 'table', 'total_node_counts', 'hub_pruned')
+
+    def __init__(self, member_links, table, total_node_counts, hub_pruned=None):
+        # member -> array of the numbers in table of its filtered links, in order
+        self.member_links = member_links
+        self.members = frozenset(member_links)
+        self.table = table
+        self.total_node_counts = total_node_counts
+        # member -> the number of its links pruned as hub links, for the members that had any
+        self.hub_pruned = hub_pruned or {}
+
+
+class MemberSetCache:
+    def __init__(self, max_states=DEFAULT_MAX_STATES, max_delta=DEFAULT_MAX_DELTA, max_links=DEFAULT_MAX_LINKS,
+                 ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_states = max_states
+        self.max_delta = max_delta
+        self.max_links = max_links
+        self.ttl_seconds = ttl_seconds
+        # (settings, members) -> MemberSetState
+        self._states = OrderedDict()
+        # settings -> LinkTable
+        self._tables = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.delta_hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_states > 0
+
+    def table(self, settings, semantic_type):
+        """The link table for settings, a new one if there is none yet or it has to be dropped."""
+        with self._lock:
+            table = self._tables.get(settings)
+            if table is None or table.stale(self.ttl_seconds) or len(table) > self.max_links:
+                if table is not None:
+                    self._drop(settings)
+                table = self._tables[settings] = LinkTable(semantic_type)
+            return table
+
+    def nearest(self, settings, members):
+        """The kept state for settings closest to the member set, and the members it (adds, drops); or None and
+        (members, ()) if none is close enough."""
+        members = frozenset(members)
+        with self._lock:
+            table = self._tables.get(settings)
+            if table is None or table.stale(self.ttl_seconds) or len(table) > self.max_links:
+                self.misses += 1
+                return None, (members, frozenset())
+            state = self._states.get((settings, members))
+            if state is not None:
+                self._states.move_to_end((settings, members))
+                self.exact_hits += 1
+                return state, (frozenset(), frozenset())
+            best, best_delta = None, self.max_delta * len(members)
+            for (state_settings, _), state in self._states.items():
+                if state_settings != settings or state.table is not table:
+                    continue
+                delta = len(members ^ state.members)
+                if delta <= best_delta:
+                    best, best_delta = state, delta
+            if best is None:
+                self.misses += 1
+                return None, (members, frozenset())
+            self._states.move_to_end((settings, best.members))
+            self.delta_hits += 1
+            return best, (members - best.members, best.members - members)
+
+    def store(self, settings, state):
+        with self._lock:
+            if self._tables.get(settings) is not state.table:
+                return
+            self._states[(settings, state.members)] = state
+            self._states.move_to_end((settings, state.members))
+            while len(self._states) > self.max_states:
+                (evicted_settings, _), _ = self._states.popitem(last=False)
+                if not any(s == evicted_settings for s, _ in self._states):
+                    self._tables.pop(evicted_settings, None)
+
+    def _drop(self, settings):
+        for key in [key for key in self._states if key[0] == settings]:
+            del self._states[key]
+        self._tables.pop(settings, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._tables.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.exact_hits + self.delta_hits + self.misses
+            return {'states': len(self._states),
+                    'max_states': self.max_states,
+                    'links': sum(len(table) for table in self._tables.values()),
+                    'exact_hits': self.exact_hits,
+                    'delta_hits': self.delta_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.exact_hits + self.delta_hits) / lookups if lookups else 0.0}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def create_member_set_cache(conf):
+    return MemberSetCache(max_states=int(conf.get('mcq_incremental_states', DEFAULT_MAX_STATES)),
+                          max_delta=float(conf.get('mcq_incremental_max_delta', DEFAULT_MAX_DELTA)),
+                          max_links=int(conf.get('mcq_incremental_max_links', DEFAULT_MAX_LINKS)),
+                          ttl_seconds=float(conf.get('mcq_incremental_ttl_seconds', DEFAULT_TTL_SECONDS)))
+
+
+def get_member_set_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_member_set_cache(load_config())
+    return _cache
+
+
+def reset_member_set_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,248 @@
+"""The predicate hierarchy filter of coalesce_by_graph (filter_predicate_hierarchies).
+
+A set of inputs is often enriched for the same node through several predicates: treats and
+treats_or_applied_or_studied_to_treat, or affects with a dozen different qualifiers.  The filter keeps the preferred
+results for each enriched node:
+
+    1. of the results with the same p-value, the one with the most specific predicate
+    2. of those, the ones with the best p-value along each line of descent in the predicate hierarchy, until the
+       ones left are unrelated
+
+Step 2 used to work on sets of predicate strings (graph_coalescer.process_enrichment_group), rebuilding a
+child -> parents mapping, merging it until nothing changed and recursing, with registry lookups all the way down;
+on enriched nodes with many predicate variants it took milliseconds a node.  Here the predicates of a node are
+numbered, their relations are read into bitmasks once, from the ancestors and children in the biolink closure, and
+the same steps are a few bit operations.  The outcome only depends on the predicates and the order of their
+p-values, so it is remembered, and the many enriched nodes found through the same few predicates are looked up.
+
+The results are the same as process_enrichment_group's, which tests/test_predicate_hierarchy.py checks on random
+nodes against the pairwise implementation, kept in tests/pairwise_hierarchy_filter.py.
+"""
+from src.graph_coalescence.biolink_closure import get_biolink_closure
+from src.graph_coalescence.predicates import get_predicate_registry
+
+# https://biolink.github.io/biolink-model/#enumerations
+ASPECT_ENUM = "GeneOrGeneProductOrChemicalEntityAspectEnum"
+DIRECTION_ENUM = "DirectionQualifierEnum"
+MAX_PREFERRED = 100000
+
+# (predicates, order of their p-values) -> mask of the preferred predicates
+_preferred = {}
+
+
+def filter_result_hierarchies(results):
+    """The results preferred for their enriched node, in the order given."""
+    node_results = {}
+    for result in results:
+        node_results.setdefault(result.enriched_node.new_curie, []).append(result)
+    kept = set()
+    for enriched_results in node_results.values():
+        if len(enriched_results) == 1:
+            kept.add(id(enriched_results[0]))
+        else:
+            kept.update(map(id, preferred_results(enriched_results)))
+    return [result for result in results if id(result) in kept]
+
+
+def preferred_results(results):
+    """The preferred results of one enriched node."""
+    pvalue_groups = {}
+    for result in results:
+        pvalue_groups.setdefault(result.p_value, []).append(result)
+    specific_results = [group[most_specific(group)] for group in pvalue_groups.values()]
+    if len(specific_results) == 1:
+        return specific_results
+
+    # Which are preferred depends only on the predicates and the order of their p-values, and enriched nodes found
+    # through the same predicates are common, so it is worked out once for each
+    key = (tuple(result.predicate for result in specific_results),
+           tuple(sorted(range(len(specific_results)), key=lambda i: specific_results[i].p_value)))
+    positions = {}
+    for predicate in key[0]:
+        positions.setdefault(predicate, len(positions))
+    preferred = _preferred.get(key)
+    if preferred is None:
+        # A predicate seen twice (the node is the source of one result and the target of the other) goes with the
+        # p-value of the later result
+        pvalues = [0.0] * len(positions)
+        for result in specific_results:
+            pvalues[positions[result.predicate]] = result.p_value
+        hierarchy = PredicateHierarchy(list(positions))
+        preferred = hierarchy.preferred(hierarchy.parent_mapping([positions[predicate] for predicate in key[0]]),
+                                        pvalues)
+        if len(_preferred) >= MAX_PREFERRED:
+            _preferred.clear()
+        _preferred[key] = preferred
+    return [result for result in specific_results if preferred >> positions[result.predicate] & 1]
+
+
+def most_specific(results):
+    """The position of the result with the most specific predicate, of results with the same p-value.
+
+    Results with the same predicate are told apart by their qualifiers: a result with an aspect or direction beats
+    one without, and a child aspect or direction beats its parent.  Otherwise the predicate with the most ancestors
+    wins."""
+    if len(results) == 1:
+        return 0
+    registry = get_predicate_registry()
+    closure = get_biolink_closure()
+    best = 0
+    for j in range(1, len(results)):
+        current = registry.info(results[best].predicate)
+        following = registry.info(results[j].predicate)
+        if current.bare != following.bare:
+            if len(following.ancestors) > len(current.ancestors):
+                best = j
+            continue
+        if not (any("qualifier" in key for key in current.qualifiers) or
+                any("qualifier" in key for key in following.qualifiers)):
+            best = 0
+            continue
+        current_aspect = current.qualifiers.get("object_aspect_qualifier")
+        following_aspect = following.qualifiers.get("object_aspect_qualifier")
+        current_direction = current.qualifiers.get("object_direction_qualifier")
+        following_direction = following.qualifiers.get("object_direction_qualifier")
+        if current_aspect and following_aspect:
+            if current_aspect == following_aspect:
+                if following_direction and not current_direction:
+                    best = j
+            elif current_aspect not in closure.permissible_value_children(following_aspect, ASPECT_ENUM) and \
+                    following_aspect in closure.permissible_value_children(current_aspect, ASPECT_ENUM):
+                best = j
+        elif current_direction and following_direction:
+            if current_direction != following_direction and \
+                    current_direction not in closure.permissible_value_children(following_direction,
+                                                                                DIRECTION_ENUM) and \
+                    following_direction in closure.permissible_value_children(current_direction, DIRECTION_ENUM):
+                best = j
+        elif (following_aspect or following_direction) and not (current_aspect or current_direction):
+            best = j
+    return best
+
+
+def iter_bits(mask):
+    """The positions of the bits set in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class PredicateHierarchy:
+    """The relations between the predicates of one enriched node, as bitmasks over their positions in predicates."""
+    def __init__(self, predicates):
+        registry = get_predicate_registry()
+        self.predicates = predicates
+        infos = [registry.info(predicate) for predicate in predicates]
+        by_bare = {}
+        for i, info in enumerate(infos):
+            by_bare[info.bare] = by_bare.get(info.bare, 0) | 1 << i
+        # the predicates with the same bare predicate as each predicate, with a parent of it, and with a child of it
+        self.same = [by_bare[info.bare] for info in infos]
+        self.parents = [self._mask(by_bare, info.ancestor_set) for info in infos]
+        self.children = [self._mask(by_bare, info.child_set) for info in infos]
+        self.has_ancestors = [bool(info.ancestor_set) for info in infos]
+        self.has_children = [bool(info.child_set) for info in infos]
+
+    @staticmethod
+    def _mask(by_bare, bare_predicates):
+        mask = 0
+        if len(bare_predicates) < len(by_bare):
+            for bare in bare_predicates:
+                mask |= by_bare.get(bare, 0)
+        else:
+            for bare, bare_mask in by_bare.items():
+                if bare in bare_predicates:
+                    mask |= bare_mask
+        return mask
+
+    def parent_mapping(self, order):
+        """{predicate: its parents} for the predicates at the positions in order, merged so that no parent is also a
+        child; as children_parent_mapping in the pairwise implementation."""
+        parents = self.parents
+        mapping = {}
+        # Neighbours in order are compared directly
+        for current, following in zip(order, order[1:]):
+            if parents[following] >> current & 1:
+                mapping[following] = mapping.get(following, 0) | 1 << current
+            elif parents[current] >> following & 1:
+                mapping[current] = mapping.get(current, 0) | 1 << following
+        # Then the ones that were missed are matched against all of them
+        allowed = 0
+        for i in order:
+            allowed |= 1 << i
+        mapped = 0
+        for values in mapping.values():
+            mapped |= values
+        for i in order:
+            if i in mapping or mapped >> i & 1:
+                continue
+            if self.has_ancestors[i]:
+                mapping[i] = parents[i] & allowed
+                mapped |= mapping[i]
+            elif self.has_children[i]:
+                for child in iter_bits(self.children[i] & allowed):
+                    if child in mapping:
+                        mapping[child] |= 1 << i
+                        mapped |= 1 << i
+            else:
+                mapping[i] = 1 << i
+                mapped |= 1 << i
+        return self._merge(mapping)
+
+    @staticmethod
+    def _merge(mapping):
+        # Parents that are children themselves have their parents merged in, and are dropped as children
+        while True:
+            keys = 0
+            for key in mapping:
+                keys |= 1 << key
+            merged = {}
+            removed = 0
+            for key, values in mapping.items():
+                for value in iter_bits(values & keys):
+                    values |= mapping[value]
+                    removed |= 1 << value
+                merged[key] = values
+            if not removed:
+                return merged
+            mapping = {key: values for key, values in merged.items() if not removed >> key & 1}
+
+    def preferred(self, mapping, pvalues):
+        """The mask of the preferred predicates, given a parent_mapping and the p-value at each position; as
+        streamline_children_to_parent in the pairwise implementation."""
+        def best(mask):
+            return 1 << min(iter_bits(mask), key=pvalues.__getitem__)
+
+        while True:
+            candidates = 0
+            for child, parents in mapping.items():
+                candidates |= 1 << child | parents
+            chosen = 0
+            grouped = 0
+            for child, parents in mapping.items():
+                if parents:
+                    chosen |= best(1 << child | parents)
+                    continue
+                # A predicate without parents is compared with the others with the same bare predicate
+                group = candidates & self.same[child] & ~grouped
+                if group == 1 << child:
+                    chosen |= group
+                    grouped |= group
+                elif group & (group - 1):
+                    chosen |= best(group)
+                    grouped |= group
+
+            count = chosen.bit_count()
+            if count == 2:
+                first, second = iter_bits(chosen)
+                if mapping.get(second, 0) >> first & 1 or mapping.get(first, 0) >> second & 1 or \
+                        self.parents[second] >> first & 1 or self.parents[first] >> second & 1:
+                    return best(chosen)
+                return chosen
+            if count < 2:
+                return chosen
+            remapped = self.parent_mapping(sorted(iter_bits(chosen), key=self.predicates.__getitem__))
+            if remapped == mapping:
+                return chosen
+            mapping = remapped
@@ -0,0 +1,208 @@
+"""Interned predicates.
+
+Links carry their predicate as a JSON string such as
+    '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+and a KG only has a few hundred distinct ones, but the coalescer looks at them millions of times per request.  The
+registry parses each string once and hands back a PredicateInfo holding everything the coalescer asks of it: the
+bare predicate, the qualifiers, whether it is symmetric, and the biolink ancestors and children of the bare predicate.
+
+Each interned string also gets a small integer id, which is what per-pair tables (like the predicate_matches memo)
+are keyed on.
+
+A PredicateMatcher is a set of predicate constraints compiled for filtering link lists: whether a predicate string
+meets them is worked out the first time the string shows up, so each further link costs one dict lookup.
+
+The biolink part (symmetry and hierarchy of every predicate under biolink:related_to) comes from the precomputed
+biolink_closure when the registry is created, so a process doesn't build a bmt Toolkit at startup, and nothing asks
+bmt inside requests.
+"""
+import threading
+import orjson
+from src.graph_coalescence.biolink_closure import BiolinkClosure, ROOT_PREDICATE, get_biolink_closure, \
+    get_toolkit  # noqa: F401
+
+
+class BarePredicate:
+    """What biolink says about a bare predicate like biolink:treats."""
+    __slots__ = ('predicate', 'symmetric', 'ancestors', 'ancestor_set', 'children', 'child_set')
+
+    def __init__(self, predicate, symmetric, ancestors, children):
+        self.predicate = predicate
+        self.symmetric = symmetric
+        # bmt order is kept for anything that wants the lists; the sets are for membership tests
+        self.ancestors = tuple(ancestors)
+        self.ancestor_set = frozenset(ancestors)
+        self.children = tuple(children)
+        self.child_set = frozenset(children)
+
+
+class PredicateInfo:
+    __slots__ = ('id', 'string', 'parsed', 'bare', 'qualifiers', 'symmetric', 'ancestors', 'ancestor_set',
+                 'children', 'child_set')
+
+    def __init__(self, pid, string, parsed, bare_info):
+        self.id = pid
+        self.string = string
+        self.parsed = parsed
+        self.bare = parsed.get('predicate')
+        self.qualifiers = {k: v for k, v in parsed.items() if k != 'predicate'}
+        self.symmetric = bare_info.symmetric
+        self.ancestors = bare_info.ancestors
+        self.ancestor_set = bare_info.ancestor_set
+        self.children = bare_info.children
+        self.child_set = bare_info.child_set
+
+    def __repr__(self):
+        return f'PredicateInfo({self.id}, {self.string})'
+
+
+class PredicateRegistry:
+    def __init__(self, toolkit=None, closure=None):
+        """From closure, by default the process's BiolinkClosure; or, given a toolkit, from that."""
+        self._toolkit = toolkit
+        if closure is None:
+            closure = BiolinkClosure.from_toolkit(toolkit) if toolkit is not None else get_biolink_closure()
+        self.closure = closure
+        self._bare = {}
+        self._by_string = {}
+        self._by_id = []
+        self._matches = {}
+        self._lock = threading.Lock()
+        for predicate, (symmetric, ancestors, children) in closure.predicates.items():
+            self._bare[predicate] = BarePredicate(predicate, symmetric, ancestors, children)
+
+    @property
+    def tk(self):
+        """The toolkit, for predicates outside the closure; only built when one shows up."""
+        if self._toolkit is None:
+            self._toolkit = get_toolkit()
+        return self._toolkit
+
+    def bare_info(self, predicate):
+        info = self._bare.get(predicate)
+        if info is None:
+            element = self.tk.get_element(predicate) if predicate else None
+            symmetric = element is not None and element['symmetric'] is True
+            ancestors = (self.tk.get_ancestors(predicate, formatted=True, reflexive=False) or []) if predicate else []
+            children = (self.tk.get_children(predicate, formatted=True) or []) if predicate else []
+            info = BarePredicate(predicate, symmetric, ancestors, children)
+            self._bare[predicate] = info
+        return info
+
+    def info(self, predicate_string):
+        """The PredicateInfo for a predicate JSON string, interning it on first sight.
+        Raises ValueError (or TypeError) if the string isn't a JSON object."""
+        info = self._by_string.get(predicate_string)
+        if info is None:
+            parsed = orjson.loads(predicate_string)
+            if not isinstance(parsed, dict):
+                raise ValueError(f'Predicate is not a JSON object: {predicate_string}')
+            bare_info = self.bare_info(parsed.get('predicate'))
+            with self._lock:
+                info = self._by_string.get(predicate_string)
+                if info is None:
+                    info = PredicateInfo(len(self._by_id), predicate_string, parsed, bare_info)
+                    self._by_id.append(info)
+                    self._by_string[predicate_string] = info
+        return info
+
+    def intern(self, predicate_string):
+        return self.info(predicate_string).id
+
+    def by_id(self, pid):
+        return self._by_id[pid]
+
+    def bare(self, predicate_string):
+        return self.info(predicate_string).bare
+
+    def is_symmetric(self, predicate_string):
+        return self.info(predicate_string).symmetric
+
+    def ancestors(self, bare_predicate):
+        return self.bare_info(bare_predicate).ancestors
+
+    def children(self, bare_predicate):
+        return self.bare_info(bare_predicate).children
+
+    def matches(self, param_predicate_string, link_predicate_string):
+        """True if every key-value pair of the param predicate is in the link predicate."""
+        param = self.info(param_predicate_string)
+        link = self.info(link_predicate_string)
+        key = (param.id, link.id)
+        result = self._matches.get(key)
+        if result is None:
+            result = param.parsed.items() <= link.parsed.items()
+            self._matches[key] = result
+        return result
+
+    def __len__(self):
+        return len(self._by_id)
+
+
+class PredicateMatcher:
+    """Whether link predicate strings meet a set of constraints.
+
+    constraints is a list of constraint dicts, one of which a predicate must meet, or None for no constraint.  With
+    match_type "exact" every key of the constraint must have the constraint's value in the predicate; with "partial"
+    only the bare predicates need to be the same.  The predicate must also have all of context_qualifiers.  Strings
+    that aren't JSON objects meet nothing."""
+    MATCH_TYPES = ('exact', 'partial')
+
+    def __init__(self, constraints=None, match_type='exact', context_qualifiers=None, registry=None):
+        if match_type not in self.MATCH_TYPES:
+            raise ValueError(f'Unknown match type {match_type}; use one of {", ".join(self.MATCH_TYPES)}')
+        self._registry = registry if registry is not None else get_predicate_registry()
+        self._partial = match_type == 'partial'
+        if constraints is None:
+            self._constraints = None
+        elif self._partial:
+            self._constraints = frozenset(constraint.get('predicate') for constraint in constraints)
+        else:
+            self._constraints = [tuple(constraint.items()) for constraint in constraints]
+        self._context = tuple((context_qualifiers or {}).items())
+        # predicate string -> whether it meets the constraints
+        self._matches = {}
+
+    def _match(self, predicate_string):
+        try:
+            parsed = self._registry.info(predicate_string).parsed
+        except (ValueError, TypeError):
+            return False
+        if not all(parsed.get(k) == v for k, v in self._context):
+            return False
+        if self._constraints is None:
+            return True
+        if self._partial:
+            return parsed.get('predicate') in self._constraints
+        return any(all(parsed.get(k) == v for k, v in constraint) for constraint in self._constraints)
+
+    def __call__(self, predicate_string):
+        matched = self._matches.get(predicate_string)
+        if matched is None:
+            matched = self._matches[predicate_string] = self._match(predicate_string)
+        return matched
+
+    def filter(self, links, keep=True):
+        """The links whose predicate meets the constraints, or with keep=False those whose predicate doesn't."""
+        matches = self._matches
+        kept = []
+        for link in links:
+            matched = matches.get(link[1])
+            if matched is None:
+                matched = self(link[1])
+            if matched is keep:
+                kept.append(link)
+        return kept
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_predicate_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = PredicateRegistry()
+    return _registry
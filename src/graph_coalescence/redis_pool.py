@@ -0,0 +1,262 @@
+"""Process-wide Redis connection pools for the graph coalescer.
+
+The coalescer spreads its data over several logical redis databases:
+    0: links            1: node labels      2: backlink counts
+    3: node names       4: provenance       5: category counts
+    6: node metadata (categories and name)
+Rather than re-reading config.json and opening a new client (and TCP connection) for every lookup,
+one bounded pool per logical database is created on first use and shared by every caller in the process.
+"""
+import asyncio
+import json
+import os
+import threading
+import weakref
+import redis
+import redis.asyncio
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
+from redis.asyncio.retry import Retry as AsyncRetry
+import redis.exceptions
+
+CONFIG_PATH = os.path.join(os.path.abspath(os.path.dirname(__file__)), '..', '..', 'config.json')
+LOGICAL_DBS = (0, 1, 2, 3, 4, 5, 6, 7)
+
+DEFAULT_MAX_CONNECTIONS = 16
+DEFAULT_POOL_TIMEOUT = 20
+DEFAULT_HEALTH_CHECK_INTERVAL = 30
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def load_config():
+    """Read config.json once per process."""
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                with open(CONFIG_PATH, 'r') as inf:
+                    _config = json.load(inf)
+    return _config
+
+
+class CountingConnectionPool(redis.BlockingConnectionPool):
+    """A bounded pool that blocks (up to timeout) when all connections are busy, and keeps usage counters."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._counter_lock = threading.Lock()
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.exhausted = 0
+
+    def get_connection(self, command_name, *keys, **options):
+        try:
+            connection = super().get_connection(command_name, *keys, **options)
+        except redis.exceptions.ConnectionError as e:
+            if 'No connection available' in str(e):
+                with self._counter_lock:
+                    self.exhausted += 1
+            raise
+        with self._counter_lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return connection
+
+    def release(self, connection):
+        super().release(connection)
+        with self._counter_lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def usage(self):
+        with self._counter_lock:
+            return {'max_connections': self.max_connections,
+                    'created_connections': len(self._connections),
+                    'in_use': self.in_use,
+                    'peak_in_use': self.peak_in_use,
+                    'checkouts': self.checkouts,
+                    'exhausted': self.exhausted}
+
+
+class RedisPoolRegistry:
+    """Holds one connection pool (and client) per logical database.
+
+    Pool sizing and health checks come from config.json:
+        redis_max_connections: connections per logical database
+        redis_pool_timeout: seconds to wait for a free connection before failing
+        redis_health_check_interval: seconds a connection may sit idle before it is PINGed on checkout
+    """
+
+    def __init__(self, conf):
+        self.host = conf['redis_host']
+        self.port = int(conf['redis_port'])
+        self.password = conf.get('redis_password') or None
+        self.max_connections = int(conf.get('redis_max_connections', DEFAULT_MAX_CONNECTIONS))
+        self.pool_timeout = float(conf.get('redis_pool_timeout', DEFAULT_POOL_TIMEOUT))
+        self.health_check_interval = int(conf.get('redis_health_check_interval', DEFAULT_HEALTH_CHECK_INTERVAL))
+        self._pools = {}
+        self._clients = {}
+        self._pipelines = {}
+        self._async_pipelines = {}
+        # asyncio pools are bound to the loop that created them, so keep one set per running loop
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def connection_kwargs(self, dbnum, retry_class=Retry):
+        kwargs = dict(
+            host=self.host,
+            port=self.port,
+            db=dbnum,
+            retry=retry_class(ExponentialBackoff(cap=10, base=0.5), retries=5),
+            retry_on_error=[redis.exceptions.BusyLoadingError, redis.exceptions.ConnectionError,
+                            redis.exceptions.TimeoutError],
+            health_check_interval=self.health_check_interval,
+        )
+        if self.password:
+            kwargs['password'] = self.password
+        return kwargs
+
+    def get_pool(self, dbnum):
+        pool = self._pools.get(dbnum)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(dbnum)
+                if pool is None:
+                    pool = CountingConnectionPool(max_connections=self.max_connections, timeout=self.pool_timeout,
+                                                  **self.connection_kwargs(dbnum))
+                    self._pools[dbnum] = pool
+        return pool
+
+    def get_client(self, dbnum):
+        client = self._clients.get(dbnum)
+        if client is None:
+            pool = self.get_pool(dbnum)
+            with self._lock:
+                client = self._clients.get(dbnum)
+                if client is None:
+                    client = redis.Redis(connection_pool=pool)
+                    self._clients[dbnum] = client
+        return client
+
+    def pipeline(self, dbnum):
+        """A non-transactional pipeline.  Its connection goes back to the pool when the pipeline is reset,
+        which happens on exiting a `with` block."""
+        p = self.get_client(dbnum).pipeline(transaction=False)
+        with self._lock:
+            self._pipelines[dbnum] = self._pipelines.get(dbnum, 0) + 1
+        return p
+
+    def get_async_client(self, dbnum):
+        """An asyncio client for dbnum, pooled per running event loop."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.get(loop)
+            if clients is None:
+                clients = {}
+                self._async_clients[loop] = clients
+            client = clients.get(dbnum)
+            if client is None:
+                pool = redis.asyncio.BlockingConnectionPool(max_connections=self.max_connections,
+                                                            timeout=self.pool_timeout,
+                                                            **self.connection_kwargs(dbnum, retry_class=AsyncRetry))
+                client = redis.asyncio.Redis(connection_pool=pool)
+                clients[dbnum] = client
+        return client
+
+    def async_pipeline(self, dbnum):
+        """A non-transactional asyncio pipeline; use it as `async with registry.async_pipeline(n) as p`."""
+        p = self.get_async_client(dbnum).pipeline(transaction=False)
+        with self._lock:
+            self._async_pipelines[dbnum] = self._async_pipelines.get(dbnum, 0) + 1
+        return p
+
+    def health_check(self):
+        """PING every logical database; returns {dbnum: True/False}."""
+        health = {}
+        for dbnum in LOGICAL_DBS:
+            try:
+                health[dbnum] = bool(self.get_client(dbnum).ping())
+            except redis.exceptions.RedisError:
+                health[dbnum] = False
+        return health
+
+    def stats(self):
+        """Pool usage counters for every pool that has been created so far."""
+        with self._lock:
+            pools = dict(self._pools)
+            pipelines = dict(self._pipelines)
+            async_pipelines = dict(self._async_pipelines)
+        stats = {}
+        for dbnum, pool in pools.items():
+            stats[dbnum] = pool.usage()
+            stats[dbnum]['pipelines'] = pipelines.get(dbnum, 0)
+        for dbnum, count in async_pipelines.items():
+            stats.setdefault(dbnum, {})['async_pipelines'] = count
+        return stats
+
+    async def aclose(self):
+        """Close the asyncio clients of the running event loop, and their pools; call it before the loop goes away
+        (e.g. on server shutdown)."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async_clients.pop(loop, {})
+        await close_async_clients(clients)
+
+    def close(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.disconnect()
+            self._pools.clear()
+            self._clients.clear()
+            self._pipelines.clear()
+            self._async_pipelines.clear()
+            async_clients = list(self._async_clients.items())
+            self._async_clients = weakref.WeakKeyDictionary()
+        # The asyncio clients can only be closed on their own loops.  Nothing can run on a closed loop any more, so
+        # the clients of those are just dropped.
+        for loop, clients in async_clients:
+            if loop.is_closed() or not clients:
+                continue
+            if not loop.is_running():
+                loop.run_until_complete(close_async_clients(clients))
+                continue
+            future = asyncio.run_coroutine_threadsafe(close_async_clients(clients), loop)
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            # On the loop's own thread the close is left to run after the caller gives the loop back
+            if running is not loop:
+                future.result(timeout=self.pool_timeout)
+
+
+async def close_async_clients(clients):
+    """Close {dbnum: asyncio client} and their connection pools."""
+    for client in clients.values():
+        await client.aclose(close_connection_pool=True)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_redis_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = RedisPoolRegistry(load_config())
+    return _registry
+
+
+def reset_redis_registry():
+    """Drop all pools, e.g. after a fork or when config.json has changed."""
+    global _registry, _config
+    with _registry_lock:
+        if _registry is not None:
+            _registry.close()
+        _registry = None
+        _config = None
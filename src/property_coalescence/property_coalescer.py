@@ -1,30 +1,44 @@
 from collections import defaultdict
-from scipy.stats import hypergeom
 from ast import literal_eval
 import sqlite3
 import os.path
 import logging
+import numpy as np
 from src.util import LoggingUtil
+from src.pvalue_cache import cached_sf_and_log_sf, get_pvalue_cache
+from src.enrichment_pool import get_enrichment_pool, pack_node_sets, run_in_pool, unpack_node_sets
 
 this_dir = os.path.dirname(os.path.realpath(__file__))
 logger = LoggingUtil.init_logging('property_coalescer', level=logging.WARNING, format='long',
                                   logFilePath=this_dir + '/')
+DEFAULT_SCORING_ENGINE = 'hypergeom'
 
 
 async def coalesce_by_property(input_ids: list, input_node_type: str, property_constraints: list = None,
-                               pvalue_threshold: float = None) -> list:
+                               pvalue_threshold: float = None, scoring_engine: str = None,
+                               max_results: int = None) -> list:
     """
     Given a list of input_ids for coalescence, find subset of the list with common CHEBI_ROLES then perform enrichment analysis
     input_node_type is the semantic_type for the input set
     properties_to_exclude allows us to avoid certain unwanted CHEBI_ROles
     pvalue_threshold gives the flexibility to cut off commonalities that occurs less likely
+    scoring_engine picks the distribution for the p-values: "hypergeom" (the default), "binom" or "poisson"
+    max_results keeps only that many of the best enrichments
     """
-    enriched_properties = get_enriched_properties(input_ids, input_node_type, property_constraints, pvalue_threshold)
+    settings = (property_constraints, pvalue_threshold, scoring_engine or DEFAULT_SCORING_ENGINE)
+    if get_enrichment_pool() is None:
+        enriched_properties = get_enriched_properties(input_ids, input_node_type, *settings)
+    else:
+        result = await run_in_pool(pack_enriched_properties, input_ids, input_node_type, *settings)
+        enriched_properties = unpack_enriched_properties(result, input_ids)
+    if max_results:
+        enriched_properties = enriched_properties[:max_results]
 
     return enriched_properties
 
 
-def get_enriched_properties(nodes, semantic_type, property_constraints=None, pvalue_threshold=None):
+def get_enriched_properties(nodes, semantic_type, property_constraints=None, pvalue_threshold=None,
+                            scoring_engine=DEFAULT_SCORING_ENGINE):
     if semantic_type in ['biolink:SmallMolecule', 'biolink:MolecularMixture', 'biolink:Drug']:
         semantic_type = 'biolink:ChemicalEntity'
     if semantic_type not in ['biolink:ChemicalEntity']:
@@ -39,15 +53,15 @@ def get_enriched_properties(nodes, semantic_type, property_constraints=None, pva
     property_lookup = PropertyLookup()
     properties = property_lookup.collect_properties(nodes, semantic_type)  # properties = {property: (curies with it)}
 
-    enriched = []
-
     total_node_count = property_lookup.get_nodecount(semantic_type)
+    ndraws = len(nodes)
+    # The hypergeometric distribution models drawing objects from a bin.
+    # M is the total number of objects (nodes) ,
+    # n is total number of Type I objects (nodes with that property).
+    # The random variate represents the number of Type I objects in N drawn
+    #  without replacement from the total population (len curies).
+    candidates = []
     for property, curies in properties.items():
-        # The hypergeometric distribution models drawing objects from a bin.
-        # M is the total number of objects (nodes) ,
-        # n is total number of Type I objects (nodes with that property).
-        # The random variate represents the number of Type I objects in N drawn
-        #  without replacement from the total population (len curies).
         x = len(curies)  # draws with the property
 
         n = property_lookup.total_nodes_with_property(property, semantic_type)
@@ -56,17 +70,19 @@ def get_enriched_properties(nodes, semantic_type, property_constraints=None, pva
             logger.info(f"x == {x}; n == 0??? : {property} {semantic_type} ")
             continue
 
-        ndraws = len(nodes)
-
         # I only care about things that occur more than by chance, not less than by chance
         if x < n * ndraws / total_node_count:
             logger.info(
                 f"x == {x} < {n * ndraws / total_node_count} : {property} {semantic_type} occur less than by chance")
             continue
 
-        enrichp = hypergeom.sf(x - 1, total_node_count, n, ndraws)
+        candidates.append((property, curies, x, n))
 
-        enriched.append(enrichment(enrichp, property, ndraws, n, total_node_count, curies, semantic_type))
+    # Score all the properties at once
+    enrichps, _ = cached_sf_and_log_sf([x for _, _, x, _ in candidates], [n for _, _, _, n in candidates], ndraws,
+                                       total_node_count, scoring_engine, get_pvalue_cache())
+    enriched = [enrichment(enrichp, property, ndraws, n, total_node_count, curies, semantic_type)
+                for (property, curies, x, n), enrichp in zip(candidates, enrichps.tolist())]
 
     # sifter enrichment results
     enriched = [enrich for enrich in enriched if enrich.get("enriched_property") not in BAD_PROPERTIES]
@@ -79,6 +95,28 @@ def get_enriched_properties(nodes, semantic_type, property_constraints=None, pva
     return enriched
 
 
+def pack_enriched_properties(nodes, semantic_type, *args):
+    """get_enriched_properties, in an enrichment pool worker, with the results packed into arrays."""
+    enriched = get_enriched_properties(nodes, semantic_type, *args)
+    node_index = {node: i for i, node in enumerate(dict.fromkeys(nodes))}
+    member_offsets, members = pack_node_sets([enrich["linked_curies"] for enrich in enriched], node_index)
+    return {'properties': [enrich["enriched_property"] for enrich in enriched],
+            'semantic_types': [enrich["semantic_type"] for enrich in enriched],
+            'p_values': np.array([enrich["p_value"] for enrich in enriched], dtype=np.float64),
+            'counts': np.array([enrich["counts"] for enrich in enriched], dtype=np.int64).reshape(-1, 3),
+            'member_offsets': member_offsets,
+            'members': members}
+
+
+def unpack_enriched_properties(result, nodes):
+    """get_enriched_properties output from pack_enriched_properties output."""
+    nodesets = unpack_node_sets(list(dict.fromkeys(nodes)), result['member_offsets'], result['members'])
+    return [enrichment(p_value, property, ndraws, n, total_node_count, nodeset, semantic_type)
+            for p_value, property, (ndraws, n, total_node_count), nodeset, semantic_type
+            in zip(result['p_values'].tolist(), result['properties'], result['counts'].tolist(), nodesets,
+                   result['semantic_types'])]
+
+
 class PropertyLookup:
     def __init__(self):
         # Right now, we're going to load the property file, but we should replace with a redis or sqlite
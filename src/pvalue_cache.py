@@ -0,0 +1,281 @@
+"""Process-wide memo of enrichment p-values and their logs, shared between requests.
+
+A p-value depends only on the scoring engine, x, n, the number of draws and the total node count, never on the KG
+build, so a value computed for one request stays good for every later one.  Requests with inputs of the same size
+against the same semantic type score largely the same (x, n) pairs, and the hub nodes that show up in most MCQs
+bring the same counts with them.
+
+Two caches, with the same lookup/store interface over whole arrays of pairs:
+
+    PValueCache         a dict in this process, bounded by entries, evicting the least recently used
+    SharedPValueCache   a fixed size table in a named shared memory segment, so that the worker processes of one
+                        server share their p-values.  The table is set associative: a pair can only live in one set
+                        of SHARED_WAYS slots, and the least recently used slot of the set is evicted.  There are no
+                        cross-process locks; each slot carries a checksum, and a slot caught half written reads as a
+                        miss.
+
+Both keep hit, miss and eviction counts for this process; see stats().
+
+Configuration (config.json, all optional):
+    pvalue_cache_max_entries: entries to keep, 0 turns the cache off
+    pvalue_cache_shared_name: the shared memory segment to use; empty for a cache in this process only.  The segment
+        outlives the processes that use it, until SharedPValueCache.close(unlink=True).
+"""
+import threading
+from collections import OrderedDict
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from src.enrichment_stats import SCORING_ENGINES, sf_and_log_sf
+from src.graph_coalescence.redis_pool import load_config
+
+DEFAULT_MAX_ENTRIES = 1 << 18
+SHARED_WAYS = 8
+SHARED_MAGIC = 0x61637076616c7632
+# The header is [magic, number of sets, ways, clock], followed by the slots
+SHARED_HEADER = 4
+SLOT_DTYPE = np.dtype([('engine', np.int64), ('x', np.int64), ('n', np.int64), ('ndraws', np.int64),
+                       ('total', np.int64), ('p', np.float64), ('logp', np.float64), ('stamp', np.uint64),
+                       ('check', np.uint64)])
+_KEY_MULTIPLIERS = np.array([0x9e3779b97f4a7c15, 0xc2b2ae3d27d4eb4f, 0x165667b19e3779f9, 0xd6e8feb86659fd93,
+                             0xff51afd7ed558ccd, 0xc4ceb9fe1a85ec53, 0x85ebca6b27d4eb2f], dtype=np.uint64)
+
+
+class PValueCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # (engine, x, n, ndraws, total_node_count) -> (p, log p)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def lookup(self, engine, ndraws, total_node_count, x, n):
+        """The cached p-values and log p-values for the pairs of x and n, as two arrays with nan for the pairs not
+        cached."""
+        p = np.full(len(x), np.nan)
+        logp = np.full(len(x), np.nan)
+        with self._lock:
+            for i, (px, pn) in enumerate(zip(x.tolist(), n.tolist())):
+                key = (engine, px, pn, ndraws, total_node_count)
+                value = self._entries.get(key)
+                if value is not None:
+                    self._entries.move_to_end(key)
+                    p[i], logp[i] = value
+            found = int(np.count_nonzero(~np.isnan(logp)))
+            self.hits += found
+            self.misses += len(x) - found
+        return p, logp
+
+    def store(self, engine, ndraws, total_node_count, x, n, p, logp):
+        if not self.enabled:
+            return
+        with self._lock:
+            for px, pn, value in zip(x.tolist(), n.tolist(), zip(p.tolist(), logp.tolist())):
+                self._entries[(engine, px, pn, ndraws, total_node_count)] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return _stats(self, len(self._entries))
+
+
+class SharedPValueCache:
+    def __init__(self, name, max_entries=DEFAULT_MAX_ENTRIES):
+        nsets = 1
+        while nsets * SHARED_WAYS < max_entries:
+            nsets *= 2
+        self.name = name
+        self.max_entries = nsets * SHARED_WAYS
+        size = SHARED_HEADER * 8 + self.max_entries * SLOT_DTYPE.itemsize
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            created = False
+        # The segment is shared with processes that outlive this one, so don't let this process's exit remove it
+        resource_tracker.unregister(self._shm._name, 'shared_memory')
+        self._header = np.ndarray(SHARED_HEADER, dtype=np.uint64, buffer=self._shm.buf)
+        if created:
+            self._header[1:3] = (nsets, SHARED_WAYS)
+            self._header[0] = SHARED_MAGIC
+        elif self._header[0] == SHARED_MAGIC and tuple(self._header[1:3]) != (nsets, SHARED_WAYS):
+            slots = int(self._header[1] * self._header[2])
+            self._header = None
+            self._shm.close()
+            raise ValueError(f'Shared p-value cache {name} has {slots} slots, not {self.max_entries}')
+        elif self._header[0] not in (0, SHARED_MAGIC):
+            # 0 is a segment still being set up by the process that created it
+            self._header = None
+            self._shm.close()
+            raise ValueError(f'Shared p-value cache {name} has a different slot layout')
+        self._table = np.ndarray((nsets, SHARED_WAYS), dtype=SLOT_DTYPE, buffer=self._shm.buf, offset=SHARED_HEADER * 8)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return True
+
+    def _keys(self, engine, ndraws, total_node_count, x, n):
+        keys = np.empty((len(x), 5), dtype=np.int64)
+        keys[:, 0] = SCORING_ENGINES.index(engine)
+        keys[:, 1] = x
+        keys[:, 2] = n
+        keys[:, 3] = ndraws
+        keys[:, 4] = total_node_count
+        return keys
+
+    @staticmethod
+    def _mix(keys, p, logp):
+        with np.errstate(over='ignore'):
+            h = (keys.view(np.uint64) * _KEY_MULTIPLIERS[:5]).sum(axis=1, dtype=np.uint64)
+            if logp is not None:
+                h ^= np.asarray(p, dtype=np.float64).view(np.uint64) * _KEY_MULTIPLIERS[6]
+                h ^= np.asarray(logp, dtype=np.float64).view(np.uint64) * _KEY_MULTIPLIERS[5]
+            h ^= h >> np.uint64(31)
+            h *= _KEY_MULTIPLIERS[4]
+            h ^= h >> np.uint64(29)
+        # 0 marks an empty slot
+        return h | np.uint64(1)
+
+    def _sets(self, keys):
+        return (self._mix(keys, None, None) >> np.uint64(11)) % np.uint64(self._table.shape[0])
+
+    def _tick(self):
+        self._header[3] += np.uint64(1)
+        return self._header[3]
+
+    def lookup(self, engine, ndraws, total_node_count, x, n):
+        keys = self._keys(engine, ndraws, total_node_count, x, n)
+        sets = self._sets(keys)
+        with self._lock:
+            rows = self._table[sets]
+            match = (rows['engine'] == keys[:, None, 0]) & (rows['x'] == keys[:, None, 1]) & \
+                    (rows['n'] == keys[:, None, 2]) & (rows['ndraws'] == keys[:, None, 3]) & \
+                    (rows['total'] == keys[:, None, 4])
+            match &= rows['check'] == self._mix(np.repeat(keys, SHARED_WAYS, axis=0), rows['p'].ravel(),
+                                                rows['logp'].ravel()).reshape(rows.shape)
+            found = match.any(axis=1)
+            ways = match.argmax(axis=1)
+            p = np.full(len(x), np.nan)
+            logp = np.full(len(x), np.nan)
+            p[found] = rows['p'][found, ways[found]]
+            logp[found] = rows['logp'][found, ways[found]]
+            self._table['stamp'][sets[found], ways[found]] = self._tick()
+            self.hits += int(found.sum())
+            self.misses += int(len(x) - found.sum())
+        return p, logp
+
+    def store(self, engine, ndraws, total_node_count, x, n, p, logp):
+        keys = self._keys(engine, ndraws, total_node_count, x, n)
+        sets = self._sets(keys)
+        p = np.asarray(p, dtype=np.float64)
+        logp = np.asarray(logp, dtype=np.float64)
+        checks = self._mix(keys, p, logp)
+        todo = np.arange(len(x))
+        with self._lock:
+            stamp = self._tick()
+            # A round writes at most one pair into each set, into its least recently used slot
+            while len(todo) > 0:
+                _, first = np.unique(sets[todo], return_index=True)
+                now = todo[first]
+                ways = self._table['stamp'][sets[now]].argmin(axis=1)
+                where = (sets[now], ways)
+                self.evictions += int(np.count_nonzero(self._table['check'][where]))
+                self._table['check'][where] = 0
+                for field, column in zip(('engine', 'x', 'n', 'ndraws', 'total'), keys[now].T):
+                    self._table[field][where] = column
+                self._table['p'][where] = p[now]
+                self._table['logp'][where] = logp[now]
+                self._table['stamp'][where] = stamp
+                self._table['check'][where] = checks[now]
+                todo = np.delete(todo, first)
+
+    def clear(self):
+        with self._lock:
+            self._table['check'] = 0
+            self._table['stamp'] = 0
+
+    def close(self, unlink=False):
+        self._table = None
+        self._header = None
+        self._shm.close()
+        if unlink:
+            self._shm.unlink()
+
+    def stats(self):
+        with self._lock:
+            return {**_stats(self, int(np.count_nonzero(self._table['check']))), 'shared_name': self.name}
+
+
+def _stats(cache, entries):
+    lookups = cache.hits + cache.misses
+    return {'entries': entries,
+            'max_entries': cache.max_entries,
+            'hits': cache.hits,
+            'misses': cache.misses,
+            'hit_rate': cache.hits / lookups if lookups else 0.0,
+            'evictions': cache.evictions}
+
+
+def cached_sf_and_log_sf(x, n, ndraws, total_node_count, engine='poisson', cache=None):
+    """enrichment_stats.sf_and_log_sf, scoring each distinct (x, n) pair once and only if cache doesn't have it
+    already.  With cache None, nothing is cached."""
+    x = np.asarray(x, dtype=np.int64)
+    n = np.asarray(n, dtype=np.int64)
+    if len(x) == 0:
+        return np.zeros(0), np.zeros(0)
+    # In a test from test_bigs, there are 1.46M links but only 250k unique parameter sets, so only score those.
+    nmax = int(n.max()) + 1
+    keys, inverse = np.unique(x * nmax + n, return_inverse=True)
+    ux, un = np.divmod(keys, nmax)
+    if cache is None or not cache.enabled:
+        unique_p, unique_logp = sf_and_log_sf(ux, un, ndraws, total_node_count, engine)
+        return unique_p[inverse], unique_logp[inverse]
+    unique_p, unique_logp = cache.lookup(engine, ndraws, total_node_count, ux, un)
+    todo = np.isnan(unique_logp)
+    if todo.any():
+        unique_p[todo], unique_logp[todo] = sf_and_log_sf(ux[todo], un[todo], ndraws, total_node_count, engine)
+        cache.store(engine, ndraws, total_node_count, ux[todo], un[todo], unique_p[todo], unique_logp[todo])
+    return unique_p[inverse], unique_logp[inverse]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def create_pvalue_cache(conf):
+    max_entries = int(conf.get('pvalue_cache_max_entries', DEFAULT_MAX_ENTRIES))
+    shared_name = conf.get('pvalue_cache_shared_name')
+    if shared_name and max_entries > 0:
+        return SharedPValueCache(shared_name, max_entries)
+    return PValueCache(max_entries)
+
+
+def get_pvalue_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_pvalue_cache(load_config())
+    return _cache
+
+
+def reset_pvalue_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -14,6 +14,7 @@ import orjson
 import httpx
 from datetime import datetime
 
+from contextlib import asynccontextmanager
 from enum import Enum
 from functools import wraps
 from pydantic import BaseModel, Field
@@ -22,7 +23,8 @@ from reasoner_pydantic import Response as PDResponse
 
 from src.util import LoggingUtil
 from src.default_query import default_input_sync, default_input_infer
-from src.single_node_coalescer import infer, multi_curie_query
+from src.single_node_coalescer import infer, multi_curie_query, multi_curie_query_batch
+from src.graph_coalescence.redis_pool import get_redis_registry
 
 from fastapi import Body, FastAPI, BackgroundTasks
 from fastapi.responses import JSONResponse
@@ -96,10 +98,18 @@ async def cached_infer(in_message: dict) -> dict:
     return result
 
 
+@asynccontextmanager
+async def lifespan(app):
+    yield
+    # The asyncio redis clients belong to the server's event loop, so they have to be closed on it
+    await get_redis_registry().aclose()
+
+
 # declare the application and populate some details
 APP = FastAPI(
     title='Answer coalesce - A FastAPI UI/web service',
-    version=AC_VERSION
+    version=AC_VERSION,
+    lifespan=lifespan
 )
 
 # declare the crossorigin params
@@ -156,6 +166,34 @@ async def query_handler(request: PDResponse = default_request_sync):
         return JSONResponse(content=in_message, status_code=status_code)
 
 
+class BatchQueryRequest(BaseModel):
+    queries: list[dict] = Field(..., description="TRAPI multi-curie query messages")
+
+
+@APP.post('/query_batch', tags=["Answer coalesce"], response_model=None, status_code=200)
+async def query_batch_handler(request: BatchQueryRequest):
+    """Answer many multi-curie queries at once.
+
+    The links, node types and counts of all the queries are fetched together, once, and the enrichments run side by
+    side.  Returns {"responses": [...]}, one TRAPI response for each query, in order.
+    """
+    in_messages = request.queries
+    invalid = [i for i, in_message in enumerate(in_messages) if not await is_batch_query(in_message)]
+    if invalid:
+        logger.error(f"Invalid batch query.  Every query must be a multi-curie query; these aren't: {invalid}")
+        return JSONResponse(content={"error": "Every query must be a multi-curie query", "invalid": invalid},
+                            status_code=422)
+    try:
+        parameters_list = [await get_parameters(in_message) for in_message in in_messages]
+        results = await multi_curie_query_batch(in_messages, parameters_list)
+        for result in results:
+            convert_log_timestamps(result)
+        return {"responses": results}
+    except Exception as e:
+        logger.exception(f"Exception encountered {str(e)}")
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
 class AsyncQueryRequest(BaseModel):
     message: dict
     callback: Optional[str] = Field(None, description="URL to POST results to when complete")
@@ -296,7 +334,8 @@ async def get_parameters(in_message):
     parameters = {"predicate_constraints": in_message.get('parameters', {}).get('predicate_constraints', []),
                   "property_constraints": in_message.get('parameters', {}).get('property_constraints', []),
                   "pvalue_threshold": in_message.get('parameters', {}).get('pvalue_threshold', None),
-                  "max_results": in_message.get('parameters', {}).get('max_results', None)}
+                  "max_results": in_message.get('parameters', {}).get('max_results', None),
+                  "scoring_engine": in_message.get('parameters', {}).get('scoring_engine', None)}
     return parameters
 
 
@@ -333,6 +372,14 @@ async def is_multi_curie_query(in_message):
     return False
 
 
+async def is_batch_query(in_message):
+    """Check that a /query_batch query is a MCQ, which a message without a query graph isn't."""
+    try:
+        return await is_multi_curie_query(in_message)
+    except (KeyError, TypeError, AttributeError):
+        return False
+
+
 def count_query_nodes(in_message):
     """Count the number of nodes in the query."""
     return len(in_message['message']['query_graph']['nodes'])
@@ -6,10 +6,13 @@ import orjson
 import time
 
 from src.property_coalescence.property_coalescer import coalesce_by_property, lookup_nodes_by_properties
-from src.graph_coalescence.graph_coalescer import coalesce_by_graph, create_nodes_to_links, get_node_types, \
-    filter_links_by_node_type, get_node_names, add_provs
+from src.graph_coalescence.graph_coalescer import coalesce_by_graph, coalesce_batch_by_graph, create_nodes_to_links, \
+    get_node_metadata, filter_links_by_node_type, get_node_names, add_provs
+from src.graph_coalescence.hubs import HubPruning, get_hub_policy, prune_hub_links
+from src.graph_coalescence.link_store import get_link_store
 
 from src.scoring import pvalue_to_sigmoid, score_inference
+from src.pvalue_cache import get_pvalue_cache
 from src.components import MCQDefinition, Lookup, NewEdge, QueryParams, InferenceParams, EnrichmentResult, \
     EnrichmentType
 
@@ -30,17 +33,51 @@ async def multi_curie_query(in_message, parameters):
     """Takes a TRAPI multi-curie query and returns a TRAPI multi-curie answer."""
     # Get the list of nodes that you want to enrich:
     mcq_definition = MCQDefinition(in_message)
+    hub_pruning = HubPruning()
+    enrichment_results = await coalesce_by_graph(**mcq_graph_query(mcq_definition, parameters), incremental=True,
+                                                 hub_pruning=hub_pruning)
+    log_hub_pruning(in_message, hub_pruning)
+    return await create_mcq_trapi_response(in_message, enrichment_results, mcq_definition)
+
+
+async def multi_curie_query_batch(in_messages, parameters_list):
+    """multi_curie_query for each of in_messages, with the parameters at the same position in parameters_list, as a
+    list of TRAPI multi-curie answers.  The links, node metadata and counts are fetched once for the whole batch
+    (see coalesce_batch_by_graph)."""
+    mcq_definitions = [MCQDefinition(in_message) for in_message in in_messages]
+    hub_prunings = [HubPruning() for _ in in_messages]
+    batch_results = await coalesce_batch_by_graph([{**mcq_graph_query(mcq_definition, parameters),
+                                                    'hub_pruning': hub_pruning}
+                                                   for mcq_definition, parameters, hub_pruning in
+                                                   zip(mcq_definitions, parameters_list, hub_prunings)])
+    for in_message, hub_pruning in zip(in_messages, hub_prunings):
+        log_hub_pruning(in_message, hub_pruning)
+    return list(await asyncio.gather(*[create_mcq_trapi_response(in_message, enrichment_results, mcq_definition)
+                                       for in_message, enrichment_results, mcq_definition in
+                                       zip(in_messages, batch_results, mcq_definitions)]))
+
+
+def mcq_graph_query(mcq_definition, parameters):
+    """The coalesce_by_graph arguments for an MCQ."""
     context_qualifiers = {k: v for k, v in mcq_definition.edge.predicate.items()
                           if k.endswith("_context_qualifier")}
-    enrichment_results = await coalesce_by_graph(mcq_definition.group_node.curies,
-                                                 mcq_definition.group_node.semantic_type,
-                                                 node_constraints=mcq_definition.enriched_node.semantic_types,
-                                                 predicate_constraints=[mcq_definition.edge.predicate],
-                                                 predicate_constraint_style="include",
-                                                 pvalue_threshold=parameters.get("pvalue_threshold"),
-                                                 max_results=parameters.get("max_results"),
-                                                 context_qualifiers=context_qualifiers)
-    return await create_mcq_trapi_response(in_message, enrichment_results, mcq_definition)
+    return {'input_ids': mcq_definition.group_node.curies,
+            'input_node_type': mcq_definition.group_node.semantic_type,
+            'node_constraints': mcq_definition.enriched_node.semantic_types,
+            'predicate_constraints': [mcq_definition.edge.predicate],
+            'predicate_constraint_style': "include",
+            'pvalue_threshold': parameters.get("pvalue_threshold"),
+            'max_results': parameters.get("max_results"),
+            'context_qualifiers': context_qualifiers,
+            'scoring_engine': parameters.get("scoring_engine")}
+
+
+def log_hub_pruning(in_message, hub_pruning):
+    """Add a TRAPI log entry for the hub links pruned from the inputs of a query, if any were."""
+    if hub_pruning.links:
+        in_message.setdefault("logs", []).append({"level": "INFO",
+                                                  "message": f"Pruned {hub_pruning.total} links to hub nodes",
+                                                  "metadata": hub_pruning.metadata()})
 
 
 def _run_coro_blocking(coro_func, *args, **kwargs):
@@ -89,17 +126,22 @@ async def infer(in_message: dict) -> dict:
                                                                                              3)})
         logger.info(f"Found {len(lookup_results.link_ids)} lookup results for {params.curie}")
 
-        # 3 & 4. ENRICHMENT (graph + property run truly concurrently in worker threads)
+        # 3 & 4. ENRICHMENT (graph enrichment does its redis i/o on this loop and its scoring in a worker thread or
+        # in the enrichment process pool; property enrichment runs in a worker thread, and scores in the pool if
+        # there is one)
         enrichment_start = time.time()
 
         context_qualifiers = {k: v for k, v in params.predicate_dict.items()
                               if k.endswith("_context_qualifier")}
 
+        # Enriched nodes that are inputs or the query curie get dropped, and only the max_rules best enrichments get
+        # used, so the coalescers can leave those out from the start
+        exclude_ids = set(lookup_results.link_ids) | {params.curie}
+        enrichment_hub_pruning = HubPruning()
+
         async def safe_graph_enrichment():
             try:
-                return await asyncio.to_thread(
-                    _run_coro_blocking,
-                    coalesce_by_graph,
+                return await coalesce_by_graph(
                     lookup_results.link_ids,
                     params.output_semantic_type,
                     node_constraints=inf_params.node_constraints,
@@ -107,7 +149,11 @@ async def infer(in_message: dict) -> dict:
                     predicate_constraints=inf_params.predicate_constraints,
                     pvalue_threshold=inf_params.pvalue_threshold,
                     filter_predicate_hierarchies=True,
-                    context_qualifiers=context_qualifiers
+                    context_qualifiers=context_qualifiers,
+                    scoring_engine=inf_params.scoring_engine,
+                    max_results=inf_params.max_rules,
+                    exclude_ids=exclude_ids,
+                    hub_pruning=enrichment_hub_pruning
                 )
             except Exception as e:
                 builder.log_error(f"Graph enrichment failed: {str(e)}")
@@ -122,7 +168,9 @@ async def infer(in_message: dict) -> dict:
                     lookup_results.link_ids,
                     params.output_semantic_type,
                     property_constraints=inf_params.property_constraints,
-                    pvalue_threshold=inf_params.pvalue_threshold
+                    pvalue_threshold=inf_params.pvalue_threshold,
+                    scoring_engine=inf_params.scoring_engine,
+                    max_results=inf_params.max_rules
                 )
             except Exception as e:
                 builder.log_error(f"Property enrichment failed: {str(e)}")
@@ -143,7 +191,6 @@ async def infer(in_message: dict) -> dict:
             ensure_empty_results(in_message)
             return in_message
 
-        exclude_ids = set(lookup_results.link_ids) | {params.curie}
         filtered_enrichments = filter_enrichments(
             all_enrichments,
             exclude_ids=exclude_ids,
@@ -167,6 +214,8 @@ async def infer(in_message: dict) -> dict:
                               "pvalue_stats": {"min": float(min(enrichment_pvalues)),
                                                "max": float(max(enrichment_pvalues))},
                               "unique_enriched_nodes": len(set(e.enriched_id for e in filtered_enrichments)),
+                              "pvalue_cache_hit_rate": round(get_pvalue_cache().stats()["hit_rate"], 3),
+                              "hub_pruning": enrichment_hub_pruning.metadata(),
                               "timing_seconds": round(time.time() - enrichment_start, 3)
                               }
                     )
@@ -174,8 +223,10 @@ async def infer(in_message: dict) -> dict:
 
         # 6. INFERENCE LOOKUP
         inference_start = time.time()
+        inference_hub_pruning = HubPruning()
         try:
-            graph_inferred_results, property_inferred_results = await run_inference_lookup(filtered_enrichments, params)
+            graph_inferred_results, property_inferred_results = await run_inference_lookup(filtered_enrichments, params,
+                                                                                           inference_hub_pruning)
         except Exception as e:
             builder.log_error(f"Inference lookup failed: {str(e)}",
                               metadata={"timing_seconds": round(time.time() - inference_start, 3)})
@@ -213,6 +264,7 @@ async def infer(in_message: dict) -> dict:
                                                    "unique": len(unique_graph_inferred)},
                               "property_inferences": {"total": total_property_inferences,
                                                       "unique": len(unique_property_inferred)},
+                              "hub_pruning": inference_hub_pruning.metadata(),
                               "timing_seconds": round(time.time() - inference_start, 3)
                               }
                     )
@@ -260,8 +312,7 @@ def lookup_single(curie: str, predicate_parts: str, is_source: bool, output_sema
 
     # Extract node IDs from full links for name/type lookups
     all_ids = [link[0] for links in nodes_to_links.values() for link in links] + [curie]
-    all_node_names = get_node_names(all_ids)
-    all_node_types = get_node_types(all_ids)
+    all_node_types, all_node_names = get_node_metadata(all_ids)
 
     # Filter by output semantic type and create Lookup object
     for curie_node, full_links in nodes_to_links.items():
@@ -282,9 +333,11 @@ def lookup_single(curie: str, predicate_parts: str, is_source: bool, output_sema
     return None
 
 
-def lookup_batch(curies: list[str], predicates: list[str], is_sources: list[bool], output_semantic_type: str) -> dict[str, Lookup]:
+def lookup_batch(curies: list[str], predicates: list[str], is_sources: list[bool], output_semantic_type: str,
+                 hub_pruning: HubPruning | None = None) -> dict[str, Lookup]:
     """
     Batch version of lookup_single - looks up multiple curies in batched Redis calls.
+    Links to hubs are pruned under the hub policy (see hubs), and counted in hub_pruning.
     Returns:
         Dict of {curie: Lookup} for curies that had results
     """
@@ -292,6 +345,10 @@ def lookup_batch(curies: list[str], predicates: list[str], is_sources: list[bool
         return {}
 
     all_nodes_to_links = create_nodes_to_links(curies, param_predicates=predicates)
+    hub_policy = get_hub_policy()
+    if hub_policy.active:
+        all_nodes_to_links = prune_hub_links(all_nodes_to_links, get_link_store().degree_index(), hub_policy,
+                                             hub_pruning)
     all_nodes_to_links = {node: links for node, links in all_nodes_to_links.items() if links}
 
     if not all_nodes_to_links:
@@ -305,8 +362,7 @@ def lookup_batch(curies: list[str], predicates: list[str], is_sources: list[bool
 
     all_node_ids = list(all_node_ids)
 
-    all_node_names = get_node_names(all_node_ids)
-    all_node_types = get_node_types(all_node_ids)
+    all_node_types, all_node_names = get_node_metadata(all_node_ids)
 
     results = {}
 
@@ -340,9 +396,11 @@ def lookup_batch(curies: list[str], predicates: list[str], is_sources: list[bool
     return results
 
 
-async def run_inference_lookup(enrichments: list[EnrichmentResult], params: QueryParams) -> tuple[list, dict]:
+async def run_inference_lookup(enrichments: list[EnrichmentResult], params: QueryParams,
+                               hub_pruning: HubPruning | None = None) -> tuple[list, dict]:
     """
     Run second lookup from enriched nodes to find inferred results.
+    The links to hubs that the graph lookups prune are counted in hub_pruning.
 
     OPTIMIZED: Uses lookup_batch for batched Redis calls.
 
@@ -364,7 +422,7 @@ async def run_inference_lookup(enrichments: list[EnrichmentResult], params: Quer
         predicates = [e.predicate for e in graph_enrichments]
         is_sources = [getattr(e, 'is_source', False) for e in graph_enrichments]
 
-        lookups = lookup_batch(curies, predicates, is_sources, params.output_semantic_type)
+        lookups = lookup_batch(curies, predicates, is_sources, params.output_semantic_type, hub_pruning)
 
         graph_inferred = []
         for enrichment in graph_enrichments:
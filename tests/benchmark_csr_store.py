@@ -0,0 +1,124 @@
+"""Compare serving lookups from redis with serving them from a memory-mapped CSR store.
+
+The redis side reads whatever is loaded in the configured redis, so load the same KG first:
+
+    python src/graph_coalescence/load_redis.py test
+    python -m tests.benchmark_csr_store tests test_            # the test KG
+
+    python -m tests.benchmark_csr_store --synthetic /tmp/kg    # write a synthetic KG to load with
+    DATA_DIR=/tmp/kg python src/graph_coalescence/load_redis.py
+    python -m tests.benchmark_csr_store /tmp/kg
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from src.graph_coalescence import graph_data
+from src.graph_coalescence.csr_store import CSRStore, build_csr_store, iter_links, iter_link_counts
+from src.graph_coalescence.link_cache import get_link_cache
+
+USAGE = 'python -m tests.benchmark_csr_store datadir [prefix] | --synthetic outdir'
+SAMPLE = 2000
+REPEATS = 5
+
+
+def write_synthetic_kg(outdir, nnodes=20000, npredicates=100, seed=0):
+    """generate_ac_files style outputs for a random KG with a few hub nodes."""
+    rng = random.Random(seed)
+    os.makedirs(outdir, exist_ok=True)
+    categories = [f'biolink:Category{i}' for i in range(20)]
+    nodes = {f'NCBIGene:{i}': ['biolink:NamedThing'] + rng.sample(categories, 2) for i in range(nnodes)}
+    curies = list(nodes)
+    predicates = [json.dumps({'predicate': f'biolink:predicate_{i}'}) for i in range(npredicates)]
+    nodes_to_links = {}
+    counts = {}
+    with open(os.path.join(outdir, 'prov.txt'), 'w') as provout:
+        for subject in curies:
+            for _ in range(min(int(rng.paretovariate(1.2) * 3), 20000)):
+                obj = rng.choice(curies)
+                predicate = rng.choice(predicates)
+                nodes_to_links.setdefault(subject, []).append([obj, predicate, True])
+                nodes_to_links.setdefault(obj, []).append([subject, predicate, False])
+                for category in nodes[obj]:
+                    key = (subject, predicate, True, category)
+                    counts[key] = counts.get(key, 0) + 1
+                for category in nodes[subject]:
+                    key = (obj, predicate, False, category)
+                    counts[key] = counts.get(key, 0) + 1
+                provout.write(f'{subject} {predicate} {obj}\t'
+                              f'{json.dumps({"biolink:primary_knowledge_source": "infores:synthetic"})}\n')
+    with open(os.path.join(outdir, 'links.txt'), 'w') as outf:
+        for node, links in nodes_to_links.items():
+            outf.write(f'{node}\t{json.dumps(links)}\n')
+    with open(os.path.join(outdir, 'backlinks.txt'), 'w') as outf:
+        for key, value in counts.items():
+            outf.write(f'{key}\t{value}\n')
+    with open(os.path.join(outdir, 'nodemetadata.txt'), 'w') as meta, \
+            open(os.path.join(outdir, 'nodelabels.txt'), 'w') as labels, \
+            open(os.path.join(outdir, 'nodenames.txt'), 'w') as names:
+        for node, node_categories in nodes.items():
+            meta.write(f'{node}\t{json.dumps({"c": node_categories, "n": node.lower()})}\n')
+            labels.write(f'{node}\t{node_categories}\n')
+            names.write(f'{node}\t{node.lower()}\n')
+    with open(os.path.join(outdir, 'category_count.txt'), 'w') as outf:
+        for category in ['biolink:NamedThing'] + categories:
+            outf.write(f'{category}\t{sum(category in c for c in nodes.values())}\n')
+
+
+def timed(label, redis_call, csr_call, compare=lambda a, b: a == b):
+    redis_seconds = []
+    csr_seconds = []
+    for _ in range(REPEATS):
+        get_link_cache().clear()
+        start = time.perf_counter()
+        redis_result = redis_call()
+        redis_seconds.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        csr_result = csr_call()
+        csr_seconds.append(time.perf_counter() - start)
+    assert compare(redis_result, csr_result), f'{label}: redis and the CSR store disagree'
+    redis_best, csr_best = min(redis_seconds), min(csr_seconds)
+    print(f'{label:<16} redis {redis_best * 1000:9.2f} ms   csr {csr_best * 1000:9.2f} ms   '
+          f'({redis_best / csr_best:.1f}x)')
+
+
+def same_metadata(a, b):
+    return {n: set(c) for n, c in a[0].items()} == {n: set(c) for n, c in b[0].items()} and a[1] == b[1]
+
+
+def benchmark(datadir, prefix=''):
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as storedir:
+        start = time.perf_counter()
+        build_csr_store(datadir, storedir, prefix)
+        print(f'built the CSR store in {time.perf_counter() - start:.2f} s')
+        store = CSRStore(storedir)
+
+        nodes = [node for node, _ in iter_links(datadir, prefix)]
+        sample = rng.sample(nodes, min(SAMPLE, len(nodes)))
+        links = store.links(sample)
+        neighbors = list(dict.fromkeys(link[0] for node_links in links.values() for link in node_links))
+        count_links = [link for link, _ in iter_link_counts(datadir, prefix)]
+        count_links = rng.sample(count_links, min(10 * SAMPLE, len(count_links)))
+        nlinks = sum(len(node_links) for node_links in links.values())
+        print(f'{len(nodes)} nodes; sample of {len(sample)} nodes with {nlinks} links, {len(neighbors)} neighbors, '
+              f'{len(count_links)} link counts')
+
+        timed('links', lambda: graph_data.load_links(sample), lambda: store.links(sample))
+        timed('node metadata', lambda: graph_data.load_node_metadata(neighbors),
+              lambda: store.node_metadata(neighbors), same_metadata)
+        timed('link counts', lambda: graph_data.load_link_counts(count_links),
+              lambda: store.link_counts(count_links))
+        store.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--synthetic':
+        write_synthetic_kg(sys.argv[2])
+    elif 2 <= len(sys.argv) <= 3:
+        benchmark(*sys.argv[1:])
+    else:
+        print(USAGE)
+        sys.exit(1)
@@ -0,0 +1,151 @@
+"""Time the scoring stage of the graph coalescer (get_enriched_links) on a large MCQ, against scoring one link at a
+time with a dict-cached sf call as it used to.  The MCQ is synthetic: enriched nodes with heavy-tailed degrees, each
+linked to some of the input nodes, so that there are many distinct (x, n) pairs to score as in a real large query.
+
+    python -m tests.benchmark_enrichment [ninputs [nenriched]]
+"""
+import random
+import sys
+import time
+import numpy as np
+from scipy.stats import poisson
+import src.graph_coalescence.graph_coalescer as gc
+from src.components import Enrichment
+from src.enrichment_stats import SCORING_ENGINES
+from src.graph_coalescence.predicate_hierarchy import filter_result_hierarchies
+from src.graph_coalescence.predicates import get_predicate_registry
+
+USAGE = 'python -m tests.benchmark_enrichment [ninputs [nenriched]]'
+SEMANTIC_TYPE = 'biolink:Gene'
+TOTAL_NODE_COUNT = 10000000
+PREDICATES = ['{"predicate": "biolink:genetically_associated_with"}', '{"predicate": "biolink:treats"}',
+              '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}',
+              '{"predicate": "biolink:interacts_with"}']
+REPEATS = 3
+
+
+def synthetic_mcq(ninputs, nenriched, seed=0):
+    """(nodes, nodes_to_links, lcounts, typecache, total_node_counts) for an MCQ on ninputs genes."""
+    rng = random.Random(seed)
+    nodes = [f'NCBIGene:{i}' for i in range(ninputs)]
+    nodes_to_links = {node: [] for node in nodes}
+    lcounts = {}
+    typecache = {}
+    for j in range(nenriched):
+        newcurie = f'MONDO:{j}'
+        typecache[newcurie] = ['biolink:Disease', 'biolink:NamedThing']
+        for predicate in rng.sample(PREDICATES, rng.randint(1, 2)):
+            x = min(int(rng.paretovariate(1.0)), ninputs // 10)
+            symmetric = get_predicate_registry().info(predicate).symmetric
+            is_source = rng.random() < 0.5
+            for node in rng.sample(nodes, x):
+                nodes_to_links[node].append([newcurie, predicate, True if symmetric else is_source])
+            newcurie_is_source = True if symmetric else not is_source
+            # Mostly more often than by chance (n * ninputs / TOTAL_NODE_COUNT <= x), some less
+            lcounts[(newcurie, predicate, newcurie_is_source, SEMANTIC_TYPE)] = int(x * rng.uniform(1, 2500))
+    return nodes, nodes_to_links, lcounts, typecache, {SEMANTIC_TYPE: TOTAL_NODE_COUNT}
+
+
+def scalar_enriched_links(nodes, semantic_type, nodes_to_links, lcounts, sfcache, typecache, total_node_counts,
+                          filter_predicate_hierarchies=False):
+    """The per-link scoring loop, with the hierarchy filter on the links in gathering order, but without the edgar
+    constraint filtering."""
+    registry = get_predicate_registry()
+    links_to_nodes = {}
+    for node in nodes:
+        for link in nodes_to_links[node]:
+            links_to_nodes.setdefault(tuple(link), []).append(node)
+    nodeset_to_links = {}
+    for link, snodes in links_to_nodes.items():
+        nodeset_to_links.setdefault(frozenset(snodes), []).append(link)
+    total_node_count = total_node_counts[semantic_type]
+    results = []
+    for nodeset, possible_links in nodeset_to_links.items():
+        for newcurie, predicate, is_source in possible_links:
+            x = len(nodeset)
+            newcurie_is_source = True if registry.info(predicate).symmetric else not is_source
+            n = lcounts[(newcurie, predicate, newcurie_is_source, semantic_type)]
+            if x > 0 and n == 0:
+                continue
+            ndraws = len(nodes)
+            if x < n * ndraws / total_node_count:
+                continue
+            args = (x - 1, total_node_count, n, ndraws)
+            if args not in sfcache:
+                sfcache[args] = poisson.sf(x - 1, n * ndraws / total_node_count)
+            results.append(Enrichment(sfcache[args], newcurie, predicate, newcurie_is_source, ndraws, n,
+                                      total_node_count, nodeset, typecache[newcurie]))
+    if filter_predicate_hierarchies:
+        results = filter_result_hierarchies(results)
+    results.sort(key=lambda x: x.p_value)
+    return results
+
+
+def best(call):
+    seconds = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = call()
+        seconds.append(time.perf_counter() - start)
+    return min(seconds), result
+
+
+def benchmark(ninputs=5000, nenriched=100000):
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(ninputs, nenriched)
+    print(f'{len(nodes)} input nodes, {sum(len(links) for links in nodes_to_links.values())} links, '
+          f'{len(lcounts)} unique links')
+
+    scalar_seconds, expected = best(lambda: scalar_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, {},
+                                                                  typecache, total_node_counts))
+    batched_seconds, results = best(lambda: gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None,
+                                                                  typecache, total_node_counts, [], 'exclude'))
+    # The batched scoring also orders the p-values that underflow to 0, so compare without the order
+    scored = {(e.enriched_node.new_curie, e.predicate, e.is_source): (e.counts, e.p_value) for e in results}
+    assert len(scored) == len(results) == len(expected)
+    for e in expected:
+        counts, p_value = scored[(e.enriched_node.new_curie, e.predicate, e.is_source)]
+        assert counts == e.counts and p_value == e.p_value
+    print(f'{len(results)} enrichments')
+
+    # The p-values alone, for the same (x, n) pairs
+    x = np.array([len(e.linked_curies) for e in expected])
+    n = np.array([e.counts[1] for e in expected])
+    ndraws = len(nodes)
+
+    def scalar_pvalues():
+        sfcache = {}
+        for xi, ni in zip(x.tolist(), n.tolist()):
+            args = (xi - 1, TOTAL_NODE_COUNT, ni, ndraws)
+            if args not in sfcache:
+                sfcache[args] = poisson.sf(xi - 1, ni * ndraws / TOTAL_NODE_COUNT)
+        return sfcache
+
+    scalar_sf_seconds, sfcache = best(scalar_pvalues)
+    batched_sf_seconds, _ = best(lambda: gc.enrichment_pvalues(x, n, ndraws, TOTAL_NODE_COUNT))
+    print(f'{len(sfcache)} distinct (x, n) pairs')
+    print(f'p-values:      per link {scalar_sf_seconds * 1000:9.2f} ms   batched {batched_sf_seconds * 1000:9.2f} ms   '
+          f'({scalar_sf_seconds / batched_sf_seconds:.1f}x)')
+    for engine in SCORING_ENGINES[1:]:
+        engine_seconds, _ = best(lambda: gc.enrichment_pvalues(x, n, ndraws, TOTAL_NODE_COUNT, scoring_engine=engine))
+        print(f'  {engine:<11}                          batched {engine_seconds * 1000:9.2f} ms')
+    top_seconds, top = best(lambda: gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache,
+                                                          total_node_counts, [], 'exclude', max_results=100))
+    assert [e.enriched_node.new_curie for e in top] == [e.enriched_node.new_curie for e in results[:100]]
+    sparse_seconds, sparse = best(lambda: gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None,
+                                                                typecache, total_node_counts, [], 'exclude',
+                                                                enrichment_engine='sparse'))
+    assert [(e.enriched_node.new_curie, e.predicate, e.p_value) for e in sparse] == \
+           [(e.enriched_node.new_curie, e.predicate, e.p_value) for e in results]
+    print(f'whole stage:   per link {scalar_seconds * 1000:9.2f} ms   batched {batched_seconds * 1000:9.2f} ms   '
+          f'({scalar_seconds / batched_seconds:.1f}x)')
+    print(f'sparse engine: per link {scalar_seconds * 1000:9.2f} ms   batched {sparse_seconds * 1000:9.2f} ms   '
+          f'({scalar_seconds / sparse_seconds:.1f}x)')
+    print(f'top 100:       per link {scalar_seconds * 1000:9.2f} ms   batched {top_seconds * 1000:9.2f} ms   '
+          f'({scalar_seconds / top_seconds:.1f}x)')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:
+        print(USAGE)
+        sys.exit(1)
+    benchmark(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,96 @@
+"""Compare the JSON and binary (link_codec) DB0 formats: bytes stored and time to decode.
+
+    python -m tests.benchmark_link_codec                # synthetic links
+    python -m tests.benchmark_link_codec links.txt      # a links.txt from generate_ac_files
+"""
+import random
+import sys
+import time
+import orjson
+from src.graph_coalescence import link_codec
+
+USAGE = 'python -m tests.benchmark_link_codec [links.txt]'
+
+
+def synthetic_links(nnodes=20000, npredicates=300, seed=0):
+    rng = random.Random(seed)
+    prefixes = ['NCBIGene', 'MONDO', 'CHEBI', 'HP', 'UBERON', 'GO']
+    curies = [f'{rng.choice(prefixes)}:{rng.randrange(10 ** 7)}' for _ in range(nnodes)]
+    predicates = []
+    for i in range(npredicates):
+        predicate = {'predicate': f'biolink:predicate_{i}'}
+        if i % 3 == 0:
+            predicate['object_aspect_qualifier'] = 'activity'
+        if i % 5 == 0:
+            predicate['object_direction_qualifier'] = 'increased'
+        predicates.append(orjson.dumps(predicate, option=orjson.OPT_SORT_KEYS).decode())
+    nodes_to_links = {}
+    for curie in curies:
+        # A few hubs with many links, most nodes with a handful
+        nlinks = int(rng.paretovariate(1.2) * 5)
+        nodes_to_links[curie] = [[rng.choice(curies), rng.choice(predicates), rng.random() < 0.5]
+                                 for _ in range(min(nlinks, 50000))]
+    return nodes_to_links
+
+
+def read_links(fname):
+    nodes_to_links = {}
+    with open(fname, 'r') as inf:
+        for line in inf:
+            node, links = line.rstrip('\n').split('\t')
+            nodes_to_links[node] = orjson.loads(links)
+    return nodes_to_links
+
+
+def benchmark(nodes_to_links):
+    node_ids = {node: i for i, node in enumerate(nodes_to_links)}
+    for links in nodes_to_links.values():
+        for link in links:
+            node_ids.setdefault(link[0], len(node_ids))
+    predicate_ids = {}
+    for links in nodes_to_links.values():
+        for link in links:
+            predicate_ids.setdefault(link[1], len(predicate_ids))
+    dict_id = link_codec.dictionary_id(node_ids, predicate_ids)
+    dictionary = link_codec.LinkDictionary.from_lists(dict_id, list(node_ids), list(predicate_ids))
+
+    json_values = [orjson.dumps(links) for links in nodes_to_links.values()]
+    binary_values = [link_codec.encode_links(links, node_ids, predicate_ids, dict_id)
+                     for links in nodes_to_links.values()]
+
+    start = time.perf_counter()
+    json_decoded = [orjson.loads(v) for v in json_values]
+    json_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    binary_decoded = [link_codec.decode_links(v, lambda _: dictionary) for v in binary_values]
+    binary_seconds = time.perf_counter() - start
+
+    assert json_decoded == binary_decoded
+
+    json_bytes = sum(len(v) for v in json_values)
+    binary_bytes = sum(len(v) for v in binary_values)
+    nlinks = sum(len(links) for links in nodes_to_links.values())
+    print(f'{len(nodes_to_links)} nodes, {nlinks} links, {len(predicate_ids)} predicates')
+    print(f'json:   {json_bytes:>12} bytes  {json_seconds:8.3f} s to decode')
+    print(f'binary: {binary_bytes:>12} bytes  {binary_seconds:8.3f} s to decode  '
+          f'({binary_bytes / json_bytes:.1%} of the json bytes)')
+    print(f'dictionary: {len(dictionary.nodes_blob)} bytes of curies, {len(predicate_ids)} predicates')
+
+    # Most of the request-time cost is in a few big link lists
+    biggest = max(nodes_to_links, key=lambda node: len(nodes_to_links[node]))
+    i = list(nodes_to_links).index(biggest)
+    for label, decode in (('json', lambda: orjson.loads(json_values[i])),
+                          ('binary', lambda: link_codec.decode_links(binary_values[i], lambda _: dictionary))):
+        start = time.perf_counter()
+        for _ in range(10):
+            decode()
+        print(f'{label} decode of the largest list ({len(nodes_to_links[biggest])} links): '
+              f'{(time.perf_counter() - start) / 10 * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2:
+        print(USAGE)
+        sys.exit(1)
+    benchmark(read_links(sys.argv[1]) if len(sys.argv) == 2 else synthetic_links())
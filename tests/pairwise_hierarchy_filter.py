@@ -0,0 +1,369 @@
+"""The original, pairwise implementation of the predicate hierarchy filter, moved out of graph_coalescer when
+predicate_hierarchy.filter_result_hierarchies replaced it.  It is the reference that tests/test_predicate_hierarchy.py
+checks the replacement against.
+"""
+from src.graph_coalescence.biolink_closure import get_biolink_closure
+from src.graph_coalescence.predicates import get_predicate_registry
+
+
+def process_enrichment_group(enrichment_group_dict):
+    new_results = set()
+
+    for enriched_node, enriched_results in enrichment_group_dict.items():
+        if len(enriched_results) == 1:
+            new_results.update(enriched_results)
+        else:
+            # Re_group by p_value:
+            p_value_group_dict = {}
+            for enriched_result in enriched_results:
+                p_value_group_dict.setdefault(enriched_result.p_value, []).append(enriched_result)
+
+            # For each group, find the most specific predicates in each p_value group and put in specific results
+            specific_results = get_specific_results(p_value_group_dict)
+
+            # Pick the most specific in the specific results
+            if len(specific_results) == 1:
+                new_results.update(specific_results)
+                continue
+            # Else we pick the best representative of an enrichment node from the combined group result by min pvalue
+            # OR Hierarchy again, Most especially if we can get further specificity
+            # Filtering by predicate hierarchy and p_value scoring
+            children_to_parent = children_parent_mapping(specific_results)
+            pvalue_dict = {specific_result.predicate: specific_result.p_value for
+                           specific_result in specific_results}
+            most_preferred = streamline_children_to_parent(children_to_parent, pvalue_dict)
+
+            for specific_result in specific_results:
+                pred = specific_result.predicate
+                if pred in most_preferred:
+                    new_results.add(specific_result)
+    return list(new_results)
+
+
+def streamline_children_to_parent(children_to_parent, pvalues):
+    """
+    Given,
+         pvalue_dict = {
+                'biolink:contributes_to': 5.62677119993497e-16,
+                'biolink:related_to': 6.984714344422767e-26,
+                'biolink:treats_or_applied_or_studied_to_treat': 2.688166355839941e-06,
+                'biolink:has_adverse_event': 2.8008696832786763e-17,
+                'biolink:causes': 3.9591314521010225e-08
+        }
+
+    And child-parent dependencies between the predicates, we want to choose the one with best predicate in each case
+
+        children_to_parent_dict = {
+            'biolink:causes': {'biolink:contributes_to', 'biolink:related_to'},
+            'biolink:contributes_to': {'biolink:related_to'},
+            'biolink:has_adverse_event': {'biolink:related_to'}
+        }
+
+    since `biolink:related_to` has the best pvalue compared with the key,value pair in each item
+
+    Then our results returns:
+            {'biolink:related_to'}
+
+    """
+    streamlined_set = set()
+    items_to_remove = set()
+
+    # Let's gather all unique predicates from children_to_parent and their children
+    all_keys = set(children_to_parent.keys())
+    for children in children_to_parent.values():
+        all_keys.update(children)
+
+    # Get the p-values
+    pvalue_lookup = {key: pvalues.get(key, float('inf')) for key in all_keys}
+
+    # Streamline the children_to_parent dictionary
+    for child, parents in list(children_to_parent.items()):
+        if parents:
+            # Select the element with the smallest p-value
+            best_element = min([child] + list(parents), key=lambda x: pvalue_lookup[x])
+            streamlined_set.add(best_element)
+            continue
+        # If a child has no parents, it needs to be compared with others
+        candidates = set()
+        for other_child, other_parents in children_to_parent.items():
+            candidates.add(other_child)
+            candidates.update(other_parents)
+        candidates = candidates - items_to_remove
+        grouping = group_by_predicate(candidates).get(get_predicate_registry().info(child).bare, [])
+        if len(grouping) == 1 and child == grouping[0]:
+            streamlined_set.add(child)
+            items_to_remove.add(child)
+        if len(grouping) > 1:
+            best_element = min(grouping, key=lambda x: pvalue_lookup[x])
+            streamlined_set.add(best_element)
+            items_to_remove.update(grouping)
+
+    # # Remove items marked for deletion, if it exists
+    # for item in items_to_remove:
+    #     del children_to_parent[item]
+
+    if len(streamlined_set) == 1:
+        return streamlined_set
+
+    # Check to be sure the set aren't dependent on each other
+    if len(streamlined_set) == 2:
+        streamlist = list(streamlined_set)
+        if streamlist[0] in children_to_parent.get(streamlist[1], []):
+            # 0 is the parent but return the one with least pvalue
+            if pvalues.get(streamlist[0]) < pvalues.get(streamlist[1]):
+                return {streamlist[0]}
+            else:
+                return {streamlist[1]}
+        elif streamlist[1] in children_to_parent.get(streamlist[0], []):
+            # 1 is the parent but return the one with least pvalue
+            if pvalues.get(streamlist[1]) < pvalues.get(streamlist[0]):
+                return {streamlist[1]}
+            else:
+                return {streamlist[0]}
+        else:
+            registry = get_predicate_registry()
+            streamlist0 = registry.info(streamlist[0])
+            streamlist1 = registry.info(streamlist[1])
+            # For the last time:
+            if streamlist0.bare in streamlist1.ancestor_set:
+                if pvalues.get(streamlist[0]) < pvalues.get(streamlist[1]):
+                    return {streamlist[0]}
+                else:
+                    return {streamlist[1]}
+            if streamlist1.bare in streamlist0.ancestor_set:
+                if pvalues.get(streamlist[1]) < pvalues.get(streamlist[0]):
+                    return {streamlist[1]}
+                else:
+                    return {streamlist[0]}
+            # None is the parent of the other
+            return streamlined_set
+
+    if len(streamlined_set) > 2:
+        # The original went on with list(streamlined_set), in the hash order of the set, which changes from run to
+        # run, and the mapping depends on the order.  Sorting pins it to the order PredicateHierarchy.preferred uses.
+        new_children_to_parent = children_parent_mapping(sorted(streamlined_set))
+        if new_children_to_parent == children_to_parent:
+            return streamlined_set
+        return streamline_children_to_parent(new_children_to_parent, pvalues)
+
+    return streamlined_set
+
+
+def group_by_predicate(items):
+    """
+    groups a list of predicate strings by the predicate only
+    """
+    grouped_items = {}
+    registry = get_predicate_registry()
+
+    for item in items:
+        predicate = registry.info(item).bare
+
+        if predicate not in grouped_items:
+            grouped_items[predicate] = []
+        grouped_items[predicate].append(item)
+
+    return grouped_items
+
+
+def children_parent_mapping(specific_results):
+    def merge_dict(d):
+        """
+        For each key-value pair, check if any of the values are keys in the dictionary.
+        If they are, merge their value sets and mark the key for removal.
+        """
+        # Make a new dictionary to merge all the items results
+        merged_dict = {key: set(values) for key, values in d.items()}
+
+        merging_needed = True
+        while merging_needed:
+            merging_needed = False
+            keys_to_remove = set()
+            temp_dict = {}
+
+            for key, values in merged_dict.items():
+                # W need a temporary set to avoid modifying the original set during iteration
+                new_values = set(values)
+                for value in values:
+                    if value in merged_dict:
+                        # Merge the value's set into the new set
+                        new_values.update(merged_dict[value])
+                        # Mark the key for removal
+                        keys_to_remove.add(value)
+                        # Mark merging as needed
+                        merging_needed = True
+
+                temp_dict[key] = new_values
+
+            # Let's update the merged dictionary with the temporary dictionary
+            merged_dict.update(temp_dict)
+
+            # Then remove the merged keys
+            for key in keys_to_remove:
+                if key in merged_dict:
+                    del merged_dict[key]
+
+        return merged_dict
+
+    children_to_parent = {}
+    registry = get_predicate_registry()
+
+    def bare_pred(full_predicate_str):
+        return registry.info(full_predicate_str).bare
+
+    # Map bare predicate -> set of full predicate strings that share it
+    bare_to_full = {}
+    for result in specific_results:
+        pred = result if isinstance(result, str) else result.predicate
+        bp = bare_pred(pred)
+        bare_to_full.setdefault(bp, set()).add(pred)
+
+    current_predicate = specific_results[0] if isinstance(specific_results[0], str) else specific_results[0].predicate
+
+    for j in range(1, len(specific_results)):
+        next_predicate = specific_results[j] if isinstance(specific_results[j], str) else specific_results[j].predicate
+
+        if bare_pred(current_predicate) in registry.info(next_predicate).ancestor_set:
+            children_to_parent.setdefault(next_predicate, set()).add(current_predicate)
+
+        elif bare_pred(next_predicate) in registry.info(current_predicate).ancestor_set:
+            children_to_parent.setdefault(current_predicate, set()).add(next_predicate)
+
+        current_predicate = next_predicate
+
+    allowable_predicates = {specific_result if isinstance(specific_results[0], str) else specific_result.predicate for
+                            specific_result in specific_results}
+
+    # Case where there are some misses; we need to somehow figure out how to store it in the children_to_parent_dict
+    for result in specific_results:
+        pred = result if isinstance(result, str) else result.predicate
+        if pred in children_to_parent:
+            continue
+        if any(pred in values for values in children_to_parent.values()):
+            continue
+        pred_ancestors = registry.info(pred).ancestor_set
+        if pred_ancestors:
+            # Find allowable predicates whose bare predicate is an ancestor
+            matching = set()
+            for ap in allowable_predicates:
+                if bare_pred(ap) in pred_ancestors:
+                    matching.add(ap)
+            children_to_parent[pred] = matching
+        else:
+            pred_children = registry.info(pred).child_set
+            if pred_children:
+                matching = set()
+                for ap in allowable_predicates:
+                    if bare_pred(ap) in pred_children:
+                        matching.add(ap)
+                for pred_child in matching:
+                    if pred_child in children_to_parent:
+                        children_to_parent.setdefault(pred_child, set()).add(pred)
+            else:
+                children_to_parent.setdefault(pred, set()).add(pred)
+
+    return merge_dict(children_to_parent)
+
+
+def is_child_in(child, parent, qualifier_enum):
+    """Eg: activity_or_abundance is used in cases where the specificity of the relationship can not be determined to be either activity or abundance.
+    In general, a more specific value from this enumeration should be used, if it is present in the result being filtered.
+    """
+    return child in get_biolink_closure().permissible_value_children(parent, qualifier_enum)
+
+
+def get_specific_results(pvalue_group_dict):
+    """
+    This function accepts:
+        enrichment result grouped by pvalue, and most-likely, different predicates
+        for instance:
+                0.0001: [(enriched_node1, causes), (enriched_node1, contributes_to)]
+                0.0002: [(enriched_node1, has_advert_event), (enriched_node1, affects)]
+                0.0003: [(enriched_node1, treats_or_applied_or_studied_to_treat), (enriched_node1, treats)]
+    to return specific list representative of enriched_node1:
+                [(enriched_node1, causes),(enriched_node1, has_advert_event), (enriched_node1, treats)]
+
+    NB: No scoring is performed since each group compared shares the same p_value
+    """
+    # https://biolink.github.io/biolink-model/#enumerations
+    biolink_aspect_qualifier_enumeration = "GeneOrGeneProductOrChemicalEntityAspectEnum"
+    biolink_direction_qualifier_enumeration = "DirectionQualifierEnum"
+
+    specific_results = []
+    registry = get_predicate_registry()
+
+    for results in pvalue_group_dict.values():
+        if len(results) == 1:
+            specific_results.extend(results)
+            continue
+
+        most_specific_result = results[0]
+
+        for j in range(1, len(results)):
+            result_i = most_specific_result
+            result_j = results[j]
+
+            pred_i = registry.info(result_i.predicate).parsed
+            pred_j = registry.info(result_j.predicate).parsed
+
+            if pred_i.get("predicate") == pred_j.get("predicate"):
+                # Equal predicates? then lets dig further down to the qualifier
+                if any("qualifier" in key for key in pred_i) or any("qualifier" in key for key in pred_j):
+                    c_pred = pred_i
+                    n_pred = pred_j
+
+                    # Handle ASPECT qualifiers separately from DIRECTION qualifiers
+                    curr_aspect = c_pred.get("object_aspect_qualifier")
+                    next_aspect = n_pred.get("object_aspect_qualifier")
+                    curr_direction = c_pred.get("object_direction_qualifier")
+                    next_direction = n_pred.get("object_direction_qualifier")
+
+                    # Compare aspect qualifiers (if both have them)
+                    if curr_aspect and next_aspect:
+                        if curr_aspect == next_aspect:
+                            # Same aspect, prefer the one with direction qualifier
+                            if curr_direction and not next_direction:
+                                most_specific_result = result_i
+                            elif next_direction and not curr_direction:
+                                most_specific_result = result_j
+                            # Both have or both lack direction - keep current
+                        else:
+                            # Different aspects - check hierarchy
+                            try:
+                                if is_child_in(curr_aspect, next_aspect, biolink_aspect_qualifier_enumeration):
+                                    most_specific_result = result_i
+                                elif is_child_in(next_aspect, curr_aspect, biolink_aspect_qualifier_enumeration):
+                                    most_specific_result = result_j
+                            except ValueError:
+                                # If enum lookup fails, keep current
+                                pass
+
+                    # Compare direction qualifiers (if both have them and no aspect difference)
+                    elif curr_direction and next_direction:
+                        if curr_direction != next_direction:
+                            try:
+                                if is_child_in(curr_direction, next_direction, biolink_direction_qualifier_enumeration):
+                                    most_specific_result = result_i
+                                elif is_child_in(next_direction, curr_direction, biolink_direction_qualifier_enumeration):
+                                    most_specific_result = result_j
+                            except ValueError:
+                                # If enum lookup fails, keep current
+                                pass
+
+                    # One has qualifier, one doesn't - prefer the one with qualifier
+                    elif (curr_aspect or curr_direction) and not (next_aspect or next_direction):
+                        most_specific_result = result_i
+                    elif (next_aspect or next_direction) and not (curr_aspect or curr_direction):
+                        most_specific_result = result_j
+
+                else:
+                    most_specific_result = results[0]
+
+            else:
+                top_ancestral_result = max([result_i, result_j], key=lambda result: len(
+                    registry.info(result.predicate).ancestors))
+                most_specific_result = top_ancestral_result
+
+        specific_results.append(most_specific_result)
+
+    return specific_results
@@ -0,0 +1,100 @@
+import asyncio
+import copy
+import re
+import orjson
+from fastapi.testclient import TestClient
+import src.graph_coalescence.graph_coalescer as gc
+from src.graph_coalescence.link_store import InMemoryLinkStore, set_link_store
+from src.server import APP
+from src.single_node_coalescer import multi_curie_query, multi_curie_query_batch
+from tests.conftest import generate_mcq_query
+from tests.test_csr_store import write_kg
+from tests.test_enrichment_pool import enrichment_key
+from tests.test_member_set_cache import SEMANTIC_TYPE, synthetic_store  # noqa: F401
+
+TREATS = [{"predicate": "biolink:treats"}]
+UUID = re.compile(rb'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+
+
+def numbered_uuids(message):
+    """The message as json, with its random edge ids numbered in the order they show up."""
+    numbers = {}
+    return UUID.sub(lambda m: b'uuid-%d' % numbers.setdefault(m.group(), len(numbers)), orjson.dumps(message, default=str))
+
+
+def test_batch_matches_single_queries(synthetic_store):
+    nodes, store = synthetic_store
+    queries = [{"input_ids": nodes[:200], "input_node_type": SEMANTIC_TYPE, "max_results": 50},
+               {"input_ids": nodes[100:300], "input_node_type": SEMANTIC_TYPE, "node_constraints": ["biolink:Disease"],
+                "predicate_constraints": TREATS, "predicate_constraint_style": "include"},
+               {"input_ids": nodes[150:250], "input_node_type": SEMANTIC_TYPE, "predicate_constraints": TREATS,
+                "predicate_constraint_style": "include", "scoring_engine": "hypergeom", "pvalue_threshold": 1e-4},
+               {"input_ids": nodes[:50], "input_node_type": SEMANTIC_TYPE, "filter_predicate_hierarchies": True,
+                "predicate_constraints": ["biolink:treats"], "max_results": 20}]
+    expected = [asyncio.run(gc.coalesce_by_graph(**query)) for query in queries]
+    store.fetched_nodes.clear()
+    store.fetched_counts.clear()
+    results = asyncio.run(gc.coalesce_batch_by_graph(queries))
+    assert [enrichment_key(r) for r in results] == [enrichment_key(e) for e in expected]
+    assert all(expected)
+    # Whole link lists for the inputs of the exclude queries, the treats partitions for those of the include ones
+    assert sorted(store.fetched_nodes) == sorted(nodes[:200] + nodes[100:300])
+    # and no count twice
+    assert len(store.fetched_counts) == len(set(store.fetched_counts))
+
+
+def test_mcq_batch_matches_single_queries(tmp_path):
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    write_kg(datadir)
+    set_link_store(InMemoryLinkStore.from_files(datadir, prefix=''))
+    try:
+        messages = [generate_mcq_query("biolink:Gene", "biolink:ChemicalEntity", ["NCBIGene:1", "NCBIGene:2"],
+                                       "biolink:affects", input_is_subject=False),
+                    generate_mcq_query("biolink:Gene", "biolink:Gene", ["NCBIGene:1", "NCBIGene:2"],
+                                       "biolink:interacts_with")]
+        parameters = [{"pvalue_threshold": None, "max_results": None, "scoring_engine": None}] * len(messages)
+        expected = [asyncio.run(multi_curie_query(copy.deepcopy(m), p)) for m, p in zip(messages, parameters)]
+        results = asyncio.run(multi_curie_query_batch(copy.deepcopy(messages), parameters))
+    finally:
+        set_link_store(None)
+    assert list(map(numbered_uuids, results)) == list(map(numbered_uuids, expected))
+    assert expected[0]["message"]["results"]
+
+
+class UnsplitLinkStore(InMemoryLinkStore):
+    """A store that can't split links by predicate, like redis without the link partitions."""
+    def link_partitions(self, node_to_predicates):
+        return None
+
+
+def test_mcq_batch_without_link_partitions(tmp_path):
+    """Include-style MCQs fall back to the whole link lists when the store has no partitions, alone and batched."""
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    write_kg(datadir)
+    messages = [generate_mcq_query("biolink:Gene", "biolink:ChemicalEntity", ["NCBIGene:1", "NCBIGene:2"],
+                                   "biolink:affects", input_is_subject=False),
+                generate_mcq_query("biolink:Gene", "biolink:Gene", ["NCBIGene:1", "NCBIGene:2"],
+                                   "biolink:interacts_with")]
+    parameters = [{"pvalue_threshold": None, "max_results": None, "scoring_engine": None}] * len(messages)
+    set_link_store(InMemoryLinkStore.from_files(datadir, prefix=''))
+    try:
+        expected = [asyncio.run(multi_curie_query(copy.deepcopy(m), p)) for m, p in zip(messages, parameters)]
+        set_link_store(UnsplitLinkStore.from_files(datadir, prefix=''))
+        singles = [asyncio.run(multi_curie_query(copy.deepcopy(m), p)) for m, p in zip(messages, parameters)]
+        results = asyncio.run(multi_curie_query_batch(copy.deepcopy(messages), parameters))
+    finally:
+        set_link_store(None)
+    assert list(map(numbered_uuids, singles)) == list(map(numbered_uuids, expected))
+    assert list(map(numbered_uuids, results)) == list(map(numbered_uuids, expected))
+    assert expected[0]["message"]["results"]
+
+
+def test_query_batch_rejects_non_mcqs():
+    client = TestClient(APP)
+    mcq = generate_mcq_query("biolink:Gene", "biolink:ChemicalEntity", ["NCBIGene:1", "NCBIGene:2"],
+                             "biolink:affects")
+    response = client.post('/query_batch', json={"queries": [mcq, {"message": {}}]})
+    assert response.status_code == 422
+    assert response.json()["invalid"] == [1]
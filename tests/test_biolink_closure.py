@@ -0,0 +1,42 @@
+import orjson
+from src.graph_coalescence.biolink_closure import BiolinkClosure, CLOSURE_FILE, get_biolink_closure, get_toolkit
+from src.graph_coalescence.predicates import PredicateRegistry
+
+
+def test_closure_file_is_current():
+    """biolink_closure.json says what the installed bmt does; rerun python -m src.graph_coalescence.biolink_closure
+    if this fails after a bmt upgrade."""
+    closure = BiolinkClosure.from_file(CLOSURE_FILE)
+    assert closure is not None
+    expected = BiolinkClosure.from_toolkit(get_toolkit())
+    assert closure.predicates == expected.predicates
+    assert closure.categories == expected.categories
+    assert closure.enums == expected.enums
+
+
+def test_closure_for_other_bmt_is_not_used(tmp_path):
+    with open(CLOSURE_FILE, 'rb') as inf:
+        data = orjson.loads(inf.read())
+    data['bmt_version'] = '0.0.1'
+    path = tmp_path / 'closure.json'
+    path.write_bytes(orjson.dumps(data))
+    assert BiolinkClosure.from_file(path) is None
+    assert BiolinkClosure.from_file(tmp_path / 'missing.json') is None
+
+
+def test_registry_from_closure():
+    registry = PredicateRegistry(closure=get_biolink_closure())
+    assert registry.bare_info("biolink:treats").ancestor_set == set(get_toolkit().get_ancestors(
+        "biolink:treats", formatted=True, reflexive=False))
+    assert registry.info('{"predicate": "biolink:interacts_with"}').symmetric
+    # Predicates the closure doesn't have go to the toolkit
+    assert registry.bare_info("biolink:not_a_predicate").ancestors == ()
+
+
+def test_qualifier_children():
+    enum = "GeneOrGeneProductOrChemicalEntityAspectEnum"
+    closure = get_biolink_closure()
+    assert "activity" in closure.permissible_value_children("activity_or_abundance", enum)
+    assert "activity_or_abundance" not in closure.permissible_value_children("activity", enum)
+    assert ("activity" in closure.permissible_value_children("activity_or_abundance", enum)) == \
+        ("activity" in (get_toolkit().get_permissible_value_children("activity_or_abundance", enum) or []))
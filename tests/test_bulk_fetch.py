@@ -0,0 +1,56 @@
+import asyncio
+import pytest
+import src.graph_coalescence.bulk_fetch as bf
+import src.graph_coalescence.redis_pool as rp
+
+TEST_DB = 9
+
+
+@pytest.fixture
+def fetcher():
+    conf = {"redis_host": "localhost", "redis_port": 6379, "redis_password": "", "redis_fetch_concurrency": 3}
+    registry = rp.RedisPoolRegistry(conf)
+    client = registry.get_client(TEST_DB)
+    client.flushdb()
+    client.mset({f"key:{i}": f"value:{i}" for i in range(0, 2500, 2)})
+    yield bf.BulkFetcher(conf, registry)
+    client.flushdb()
+    registry.close()
+
+
+def test_chunker_adapts_to_payload():
+    chunker = bf.AdaptiveChunker(target_bytes=10000, target_seconds=1, min_chunk=10, max_chunk=5000)
+    assert chunker.chunk_size() == bf.INITIAL_CHUNK
+    # 100 bytes per key and fast: limited by the byte target
+    chunker.observe(100, 10000, 0.001)
+    assert chunker.chunk_size() == 100
+    # Small values: the chunk grows to the max
+    small = bf.AdaptiveChunker(target_bytes=10000, target_seconds=1, min_chunk=10, max_chunk=5000)
+    small.observe(1000, 1000, 0.001)
+    assert small.chunk_size() == 5000
+    # Slow values: limited by the latency target
+    slow = bf.AdaptiveChunker(target_bytes=10000, target_seconds=1, min_chunk=10, max_chunk=5000)
+    slow.observe(100, 100, 1)
+    assert slow.chunk_size() == 100
+
+
+@pytest.mark.nongithub
+def test_mget_keeps_key_order(fetcher):
+    keys = [f"key:{i}" for i in reversed(range(2500))]
+    fetcher.chunker(TEST_DB).initial_chunk = 300
+    values = fetcher.mget(TEST_DB, keys)
+    assert values == [(f"value:{i}".encode() if i % 2 == 0 else None) for i in reversed(range(2500))]
+    stats = fetcher.recent_stats(1)[0]
+    assert stats["keys"] == 2500
+    assert stats["chunks"] == 9
+    assert stats["bytes"] == sum(len(v) for v in values if v)
+    assert not stats["async"]
+
+
+@pytest.mark.nongithub
+def test_mget_async_matches_mget(fetcher):
+    keys = [f"key:{i}" for i in range(2500)]
+    expected = fetcher.mget(TEST_DB, keys)
+    assert asyncio.run(fetcher.mget_async(TEST_DB, keys)) == expected
+    assert fetcher.recent_stats(1)[0]["async"]
+    assert asyncio.run(fetcher.mget_async(TEST_DB, [])) == []
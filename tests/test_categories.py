@@ -0,0 +1,33 @@
+from src.graph_coalescence.categories import CategoryBits, get_category_bits
+from src.graph_coalescence.graph_coalescer import filter_links_by_node_type
+
+
+def test_masks():
+    bits = CategoryBits(["biolink:NamedThing", "biolink:Gene"])
+    gene = bits.mask(["biolink:Gene", "biolink:NamedThing"])
+    assert gene == 0b11 and bits.mask("biolink:Gene") == 0b10
+    # Categories outside the list get the next bits
+    assert bits.mask(["biolink:NamedThing", "test:Thing"]) == 0b101
+    assert bits.categories(gene | bits.bit("test:Thing")) == ["biolink:NamedThing", "biolink:Gene", "test:Thing"]
+    assert len(bits) == 3
+
+
+def test_biolink_masks_are_wide():
+    bits = get_category_bits()
+    assert len(bits) > 64
+    assert bits.mask(["biolink:Disease"]) & bits.mask(["biolink:Gene", "biolink:Disease"])
+    assert not bits.mask(["biolink:Disease"]) & bits.mask(["biolink:Gene"])
+
+
+def test_node_type_filter_matches_set_overlap():
+    link_node_types = {"NCBIGene:1": ["biolink:Gene", "biolink:BiologicalEntity", "biolink:NamedThing"],
+                       "MONDO:1": ["biolink:Disease", "biolink:DiseaseOrPhenotypicFeature", "biolink:NamedThing"],
+                       "CHEBI:1": ["biolink:SmallMolecule", "biolink:ChemicalEntity", "biolink:NamedThing"],
+                       "X:1": ["test:Unknown"]}
+    nodes_to_links = {"A": [[node, '{"predicate": "biolink:related_to"}', True] for node in link_node_types],
+                      "B": [["MONDO:1", '{"predicate": "biolink:treats"}', False]]}
+    for constraints in (["biolink:Gene"], ["biolink:ChemicalEntity", "biolink:DiseaseOrPhenotypicFeature"],
+                        ["biolink:BiologicalEntity"], ["test:Unknown"], ["biolink:Protein"]):
+        expected = {node: [link for link in links if set(constraints) & set(link_node_types[link[0]])]
+                    for node, links in nodes_to_links.items()}
+        assert filter_links_by_node_type(nodes_to_links, constraints, link_node_types) == expected
@@ -0,0 +1,75 @@
+import os
+import orjson
+import src.graph_coalescence.count_keys as ck
+from src.graph_coalescence import graph_data, link_codec
+from src.graph_coalescence.build_redis_files import write_compact_counts
+from src.graph_coalescence.link_cache import reset_link_cache
+from src.graph_coalescence.redis_pool import get_redis_registry
+
+AFFECTS = '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+TREATS = '{"predicate": "biolink:treats"}'
+COUNTS = {("NCBIGene:1017", AFFECTS, True, "biolink:Disease"): 12,
+          ("NCBIGene:1017", AFFECTS, False, "biolink:Disease"): 3,
+          ("MONDO:0005011", TREATS, False, "biolink:ChemicalEntity"): 7,
+          ("CHEBI:ü", TREATS, True, "biolink:Gene"): 1}
+
+
+def test_round_trip():
+    builder = ck.CountKeyBuilder()
+    keys = {link: builder.key(link) for link in COUNTS}
+    assert len(set(keys.values())) == len(COUNTS)
+    codec = ck.CountKeyCodec.from_redis_values(*builder.dictionary_values())
+    for link, key in keys.items():
+        assert key.startswith(ck.MAGIC)
+        assert len(key) < len(ck.legacy_count_key(link))
+        assert codec.key(link) == key
+        assert codec.decode(key) == link
+    # Things that were never counted have no key
+    assert codec.key(("NCBIGene:1017", TREATS, True, "biolink:Protein")) is None
+    assert codec.key(("NCBIGene:1017", '{"predicate": "biolink:causes"}', True, "biolink:Disease")) is None
+    assert ck.CountKeyCodec.from_redis_values(None, None) is None
+
+
+def test_write_compact_counts(tmp_path):
+    write_compact_counts(COUNTS, tmp_path)
+    with open(os.path.join(tmp_path, 'countdict.json'), 'rb') as inf:
+        dictionaries = orjson.loads(inf.read())
+    codec = ck.CountKeyCodec(dictionaries['predicates'], dictionaries['categories'])
+    with open(os.path.join(tmp_path, 'backlinks.bin'), 'rb') as inf:
+        records = list(link_codec.read_records(inf, decode_keys=False))
+    assert {codec.decode(key): int(value) for key, value in records} == COUNTS
+
+
+def test_load_link_counts_both_key_schemes():
+    counts_client = get_redis_registry().get_client(graph_data.LINK_COUNTS_DB)
+    dictionary_client = get_redis_registry().get_client(ck.DICTIONARY_DB)
+    saved_dictionaries = dictionary_client.mget(ck.DICTIONARY_KEYS)
+    links = list(COUNTS) + [("NCBIGene:1017", TREATS, True, "biolink:Protein")]
+    expected = dict(COUNTS)
+    expected[links[-1]] = 0
+    builder = ck.CountKeyBuilder()
+    written = []
+    try:
+        # Original keys, no dictionaries
+        dictionary_client.delete(*ck.DICTIONARY_KEYS)
+        for link, count in COUNTS.items():
+            counts_client.set(ck.legacy_count_key(link), count)
+            written.append(ck.legacy_count_key(link))
+        reset_link_cache()
+        assert graph_data.load_link_counts(links) == expected
+        # Compact keys
+        for link, count in COUNTS.items():
+            counts_client.set(builder.key(link), count)
+            written.append(builder.key(link))
+        dictionary_client.set(ck.PREDICATES_KEY, builder.dictionary_values()[0])
+        dictionary_client.set(ck.CATEGORIES_KEY, builder.dictionary_values()[1])
+        reset_link_cache()
+        assert graph_data.get_count_key_codec() is not None
+        assert graph_data.load_link_counts(links) == expected
+    finally:
+        counts_client.delete(*written)
+        dictionary_client.delete(*ck.DICTIONARY_KEYS)
+        for key, value in zip(ck.DICTIONARY_KEYS, saved_dictionaries):
+            if value is not None:
+                dictionary_client.set(key, value)
+        reset_link_cache()
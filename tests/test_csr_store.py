@@ -0,0 +1,115 @@
+import json
+import os
+import pytest
+from src.graph_coalescence.build_redis_files import write_binary_links, write_compact_counts
+from src.graph_coalescence.csr_store import CSRStore, build_csr_store
+
+TREATS = '{"predicate": "biolink:treats"}'
+AFFECTS = '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+INTERACTS = '{"predicate": "biolink:interacts_with"}'
+
+NODES = {"CHEBI:1": (["biolink:SmallMolecule", "biolink:ChemicalEntity", "biolink:NamedThing"], "aspirin"),
+         "MONDO:1": (["biolink:Disease", "biolink:NamedThing"], "headache"),
+         "NCBIGene:1": (["biolink:Gene", "biolink:NamedThing"], "PTGS1"),
+         "NCBIGene:2": (["biolink:Gene", "biolink:NamedThing"], "PTGS2")}
+# subject, predicate, object
+EDGES = [("CHEBI:1", TREATS, "MONDO:1"), ("CHEBI:1", AFFECTS, "NCBIGene:1"), ("CHEBI:1", AFFECTS, "NCBIGene:2"),
+         ("NCBIGene:1", INTERACTS, "NCBIGene:2")]
+SYMMETRIC = {INTERACTS}
+
+
+def make_kg():
+    nodes_to_links = {}
+    counts = {}
+    provs = {}
+    for subject, predicate, obj in EDGES:
+        target_is_source = predicate in SYMMETRIC
+        nodes_to_links.setdefault(subject, []).append([obj, predicate, True])
+        nodes_to_links.setdefault(obj, []).append([subject, predicate, target_is_source])
+        for category in NODES[obj][0]:
+            counts[(subject, predicate, True, category)] = counts.get((subject, predicate, True, category), 0) + 1
+        for category in NODES[subject][0]:
+            key = (obj, predicate, target_is_source, category)
+            counts[key] = counts.get(key, 0) + 1
+        provs[f'{subject} {predicate} {obj}'] = {"biolink:primary_knowledge_source": f"infores:{subject}"}
+    return nodes_to_links, counts, provs
+
+
+def write_kg(datadir, binary=False, metadata=True):
+    nodes_to_links, counts, provs = make_kg()
+    with open(os.path.join(datadir, 'links.txt'), 'w') as outf:
+        for node, links in nodes_to_links.items():
+            outf.write(f'{node}\t{json.dumps(links)}\n')
+    if binary:
+        write_binary_links(nodes_to_links, datadir)
+        write_compact_counts(counts, datadir)
+    else:
+        with open(os.path.join(datadir, 'backlinks.txt'), 'w') as outf:
+            for key, value in counts.items():
+                outf.write(f'{key}\t{value}\n')
+    if metadata:
+        with open(os.path.join(datadir, 'nodemetadata.txt'), 'w') as outf:
+            for node, (categories, name) in NODES.items():
+                outf.write(f'{node}\t{json.dumps({"c": categories, "n": name})}\n')
+    else:
+        with open(os.path.join(datadir, 'nodelabels.txt'), 'w') as labels, \
+                open(os.path.join(datadir, 'nodenames.txt'), 'w') as names:
+            for node, (categories, name) in NODES.items():
+                labels.write(f'{node}\t{categories}\n')
+                names.write(f'{node}\t{name}\n')
+    with open(os.path.join(datadir, 'prov.txt'), 'w') as outf:
+        for key, value in provs.items():
+            outf.write(f'{key}\t{json.dumps(value)}\n')
+    with open(os.path.join(datadir, 'category_count.txt'), 'w') as outf:
+        outf.write('biolink:NamedThing\t4\nbiolink:Gene\t2\n')
+    return nodes_to_links, counts, provs
+
+
+@pytest.mark.parametrize("binary,metadata", [(False, True), (True, True), (False, False)])
+def test_build_and_read(tmp_path, binary, metadata):
+    datadir = tmp_path / 'data'
+    storedir = tmp_path / 'store'
+    datadir.mkdir()
+    nodes_to_links, counts, provs = write_kg(datadir, binary, metadata)
+    build_csr_store(datadir, storedir)
+    store = CSRStore(storedir)
+    try:
+        assert store.links(list(nodes_to_links) + ["MONDO:missing"]) == {**nodes_to_links, "MONDO:missing": []}
+        assert store.link_partitions({"CHEBI:1": ["biolink:affects"]}) == \
+            {"CHEBI:1": [link for link in nodes_to_links["CHEBI:1"] if link[1] == AFFECTS]}
+        types, names = store.node_metadata(list(NODES) + ["MONDO:missing"])
+        assert {node: set(c) for node, c in types.items()} == {node: set(c) for node, (c, _) in NODES.items()}
+        assert names == {**{node: name for node, (_, name) in NODES.items()}, "MONDO:missing": ""}
+        unknown = ("CHEBI:1", TREATS, True, "biolink:Gene")
+        assert store.link_counts(list(counts) + [unknown]) == {**counts, unknown: 0}
+        edges = list(provs) + [f'MONDO:1 {TREATS} CHEBI:1']
+        values = store.prov_values(edges)
+        assert [json.loads(v) for v in values[:-1]] == list(provs.values())
+        assert values[-1] is None
+        assert store.category_count_values(["biolink:Gene", "biolink:Disease"]) == ["2", None]
+    finally:
+        store.close()
+
+
+def test_coalescer_serves_from_csr_store(tmp_path):
+    import src.graph_coalescence.graph_coalescer as gc
+    from src.graph_coalescence.link_store import CSRLinkStore, set_link_store
+
+    datadir = tmp_path / 'data'
+    storedir = tmp_path / 'store'
+    datadir.mkdir()
+    nodes_to_links, counts, provs = write_kg(datadir)
+    build_csr_store(datadir, storedir)
+    store = CSRLinkStore.open(storedir)
+    set_link_store(store)
+    try:
+        assert gc.create_nodes_to_links(["CHEBI:1"]) == {"CHEBI:1": nodes_to_links["CHEBI:1"]}
+        assert gc.get_link_counts(list(counts)) == counts
+        # The symmetric interacts_with edge is found from either end
+        symmetric_edge = f'NCBIGene:2 {INTERACTS} NCBIGene:1'
+        assert store.provs([symmetric_edge])[symmetric_edge] == \
+            [{'resource_id': 'infores:NCBIGene:1', 'resource_role': 'primary_knowledge_source'}]
+        assert gc.get_total_node_counts("biolink:Disease") == {"biolink:NamedThing": 4.0, "biolink:Disease": 4.0}
+    finally:
+        set_link_store(None)
+        store.store.close()
@@ -0,0 +1,65 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import src.graph_coalescence.graph_coalescer as gc
+from src.enrichment_pool import create_enrichment_pool, pack_node_sets, set_enrichment_pool, unpack_node_sets
+from src.graph_coalescence.link_store import InMemoryLinkStore, set_link_store
+from tests.test_csr_store import write_kg
+
+
+def enrichment_key(enrichments):
+    return [(e.enriched_node.new_curie, e.predicate, e.is_source, e.counts, e.p_value, list(e.linked_curies),
+             e.enriched_node.newnode_type) for e in enrichments]
+
+
+@pytest.mark.parametrize("filter_predicate_hierarchies,predicate_constraints,enrichment_engine",
+                         [(False, [], "dict"), (True, ["biolink:treats"], "dict"), (True, [], "sparse")])
+def test_packed_enrichment_matches(filter_predicate_hierarchies, predicate_constraints, enrichment_engine):
+    """Packing, selecting from the packed inputs and unpacking gives what get_enriched_links does."""
+    from tests.benchmark_enrichment import SEMANTIC_TYPE, synthetic_mcq
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(300, 3000)
+    # A count for another semantic type doesn't go along
+    lcounts[("MONDO:0", "{}", True, "biolink:Disease")] = 5
+    settings = (predicate_constraints, 'exclude', filter_predicate_hierarchies, 'poisson', None, 50, enrichment_engine)
+    expected = gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache,
+                                     total_node_counts, *settings)
+    packed = gc.pack_enrichment_inputs(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, total_node_counts)
+    assert gc.unpack_enrichment_inputs(packed)[2] == nodes_to_links
+    result = gc.select_packed_enriched_links(packed, *settings)
+    enrichments = gc.build_enrichments(gc.unpack_selected_links(result, packed), len(nodes),
+                                       total_node_counts[SEMANTIC_TYPE], typecache)
+    assert len(expected) == 50
+    assert enrichment_key(enrichments) == enrichment_key(expected)
+
+
+def test_node_sets_round_trip():
+    nodes = ["a", "b", "c", "d"]
+    node_sets = [frozenset(["c", "a"]), frozenset(), frozenset(nodes)]
+    offsets, members = pack_node_sets(node_sets, {node: i for i, node in enumerate(nodes)})
+    assert offsets.tolist() == [0, 2, 2, 6]
+    assert members.tolist() == [0, 2, 0, 1, 2, 3]
+    assert unpack_node_sets(nodes, offsets, members) == node_sets
+
+
+def test_create_enrichment_pool():
+    assert create_enrichment_pool({}) is None
+    with pytest.raises(ValueError):
+        create_enrichment_pool({"enrichment_executor": "gpu"})
+
+
+def test_coalesce_in_process_pool(tmp_path):
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    write_kg(datadir)
+    set_link_store(InMemoryLinkStore.from_files(datadir, prefix=''))
+    try:
+        in_thread = asyncio.run(gc.coalesce_by_graph(["NCBIGene:1", "NCBIGene:2"], "biolink:Gene"))
+        set_enrichment_pool(ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')))
+        in_process = asyncio.run(gc.coalesce_by_graph(["NCBIGene:1", "NCBIGene:2"], "biolink:Gene"))
+    finally:
+        set_enrichment_pool(None)
+        set_link_store(None)
+    assert len(in_thread) > 0
+    assert enrichment_key(in_process) == enrichment_key(in_thread)
+    assert all(e.enriched_node.newnode_name for e in in_process)
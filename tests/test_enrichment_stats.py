@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from scipy.special import gammaln
+from scipy.stats import binom, hypergeom, poisson
+from src.enrichment_stats import SCORING_ENGINES, log_factorial, log_sf, pvalues
+
+
+def scipy_sf(engine, x, n, ndraws, total):
+    if engine == 'poisson':
+        return poisson.sf(x - 1, n * ndraws / total)
+    if engine == 'binom':
+        return binom.sf(x - 1, ndraws, n / total)
+    return hypergeom.sf(x - 1, total, n, ndraws)
+
+
+@pytest.mark.parametrize("engine", SCORING_ENGINES)
+@pytest.mark.parametrize("ndraws,total", [(10, 20), (50, 1000), (5000, 10000000)])
+def test_matches_scipy(engine, ndraws, total):
+    rng = np.random.default_rng(0)
+    x = rng.integers(0, min(ndraws, 300) + 1, 500)
+    n = np.minimum((x * rng.uniform(0, 3 * total / ndraws, 500)).astype(np.int64), total)
+    expected = scipy_sf(engine, x, n, ndraws, total)
+    assert pvalues(x, n, ndraws, total, engine).tolist() == expected.tolist()
+    # The logs agree with them too, where scipy hasn't lost precision in the subnormal range
+    normal = expected > 1e-300
+    assert np.exp(log_sf(x, n, ndraws, total, engine))[normal] == pytest.approx(expected[normal], rel=1e-6)
+
+
+@pytest.mark.parametrize("engine", SCORING_ENGINES)
+def test_tiny_pvalues_stay_ordered(engine):
+    """Beyond the float range the p-values are 0, but their logs still order them."""
+    x = np.array([400, 450, 500])
+    n = np.array([1000, 1000, 1000])
+    logp = log_sf(x, n, 5000, 10000000, engine)
+    assert np.all(np.isfinite(logp))
+    assert logp[0] > logp[1] > logp[2]
+    assert logp[0] < -745
+    # Just inside the float range, the log agrees with scipy
+    assert np.exp(log_sf([30], [1000], 5000, 10000000, engine))[0] == \
+           pytest.approx(scipy_sf(engine, 30, 1000, 5000, 10000000), rel=1e-6)
+
+
+def test_edge_cases():
+    for engine in SCORING_ENGINES:
+        # x == 0 always happens, and with n == 0 no draw has the property
+        assert list(pvalues([0, 3], [5, 0], 10, 20, engine)) == [1.0, 0.0]
+    # Without replacement there can't be more draws with the property than n
+    assert pvalues([6], [5], 10, 20, 'hypergeom')[0] == 0.0
+    with pytest.raises(ValueError):
+        pvalues([1], [1], 10, 20, 'norm')
+
+
+def test_log_factorial():
+    k = np.array([0, 1, 5, 3000, 5000000])
+    assert log_factorial(k) == pytest.approx(gammaln(k + 1.0), rel=1e-14)
@@ -4,7 +4,8 @@ import src.graph_coalescence.graph_coalescer as gc
 import src.single_node_coalescer as snc
 from src.components import Enrichment
 from reasoner_pydantic import Response as PDResponse
-from src.graph_coalescence.graph_coalescer import filter_links_by_node_type, filter_links_by_context, streamline_children_to_parent
+from src.graph_coalescence.graph_coalescer import filter_links_by_node_type, filter_links_by_context
+from tests.pairwise_hierarchy_filter import streamline_children_to_parent
 
 jsondir = 'InputJson_1.5'
 
@@ -154,6 +155,89 @@ def test_get_prov():
         assert isinstance(link.prov, list)
 
 
+def test_async_fetch_matches_sync():
+    """The asyncio data access layer returns the same data as the synchronous lookups."""
+    from src.graph_coalescence import graph_data
+
+    nodes = ["NCBIGene:2932", "NCBIGene:1500", "NCBIGene:not_a_gene"]
+    nodes_to_links = gc.create_nodes_to_links(nodes)
+
+    async def fetch_all():
+        links = await graph_data.fetch_links(nodes)
+        types = await graph_data.fetch_node_types(nodes)
+        names = await graph_data.fetch_node_names(nodes)
+        return links, types, names
+
+    links, types, names = asyncio.run(fetch_all())
+    assert links == nodes_to_links
+    assert types == gc.get_node_types(nodes)
+    assert names == gc.get_node_names(nodes)
+
+
+def test_node_metadata_with_legacy_fallback():
+    """Nodes with a db 6 record are read from it, the rest from the old db 1 / db 3 layout."""
+    from src.graph_coalescence import graph_data
+    from src.graph_coalescence.redis_pool import get_redis_registry
+
+    registry = get_redis_registry()
+    new, old = "TEST:metadata_new", "TEST:metadata_old"
+    registry.get_client(graph_data.NODE_METADATA_DB).set(
+        new, graph_data.encode_node_metadata(["biolink:Gene", "biolink:NamedThing"], "new gene"))
+    registry.get_client(graph_data.NODE_TYPES_DB).set(old, "['biolink:Disease', 'biolink:NamedThing']")
+    registry.get_client(graph_data.NODE_NAMES_DB).set(old, "old disease")
+    try:
+        nodes = [new, old, "TEST:metadata_missing"]
+        expected_types = {new: ["biolink:Gene", "biolink:NamedThing"], old: ["biolink:Disease", "biolink:NamedThing"]}
+        expected_names = {new: "new gene", old: "old disease", "TEST:metadata_missing": ""}
+        assert gc.get_node_metadata(nodes) == (expected_types, expected_names)
+        assert asyncio.run(graph_data.fetch_node_metadata(nodes)) == (expected_types, expected_names)
+    finally:
+        registry.get_client(graph_data.NODE_METADATA_DB).delete(new)
+        registry.get_client(graph_data.NODE_TYPES_DB).delete(old)
+        registry.get_client(graph_data.NODE_NAMES_DB).delete(old)
+
+
+def test_link_partitions_match_filtered_links():
+    """With db 7 loaded, predicate lookups read only their partitions and get the same links as filtering the whole
+    list."""
+    from src.graph_coalescence import graph_data
+    from src.graph_coalescence.build_redis_files import json_link_partition, partition_links
+    from src.graph_coalescence.link_cache import reset_link_cache
+    from src.graph_coalescence.redis_pool import get_redis_registry
+
+    registry = get_redis_registry()
+    affects = '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+    treats = '{"predicate": "biolink:treats"}'
+    node = "TEST:partitioned"
+    # Mixed directions, so that the partitions of a predicate interleave in the whole list
+    links = [["TEST:a", affects, True], ["TEST:b", treats, False], ["TEST:c", affects, False],
+             ["TEST:d", '{"predicate": "biolink:affects"}', True], ["TEST:e", treats, True],
+             ["TEST:f", affects, False]]
+    partitions = {graph_data.link_partition_key(node, bare, node_is_source): json_link_partition(links, positions)
+                  for (bare, node_is_source), positions in partition_links(links).items()}
+    registry.get_client(graph_data.LINKS_DB).set(node, json.dumps(links))
+    registry.get_client(graph_data.LINK_PARTITIONS_DB).mset(partitions)
+    registry.get_client(graph_data.CATEGORY_COUNTS_DB).set(graph_data.LINK_PARTITIONS_KEY,
+                                                           graph_data.LINK_PARTITIONS_FORMAT)
+    reset_link_cache()
+    try:
+        for predicate in (affects, '{"predicate": "biolink:affects"}', treats, '{"predicate": "biolink:causes"}'):
+            expected = [link for link in links if gc.predicate_matches(predicate, link[1])]
+            found = gc.create_nodes_to_links([node], param_predicates=[predicate])[node]
+            assert found == expected
+        # Links of several predicates come back in the order of the whole list too
+        expected = {node: [link for link in links if '"biolink:causes"' not in link[1]]}
+        assert graph_data.load_link_partitions({node: ["biolink:affects", "biolink:treats"]}) == expected
+        assert asyncio.run(graph_data.fetch_link_partitions({node: ["biolink:affects", "biolink:treats"]})) == expected
+        # Whole lists are still used without predicates
+        assert gc.create_nodes_to_links([node])[node] == links
+    finally:
+        registry.get_client(graph_data.LINKS_DB).delete(node)
+        registry.get_client(graph_data.LINK_PARTITIONS_DB).delete(*partitions)
+        registry.get_client(graph_data.CATEGORY_COUNTS_DB).delete(graph_data.LINK_PARTITIONS_KEY)
+        reset_link_cache()
+
+
 def test_filter_links_by_node_type():
     # Mocking the nodes_to_links dictionary
     nodes_to_links = {
@@ -675,4 +759,111 @@ def test_grouper_keys():
         x = group
         n += 1
     assert n == 3
-    assert x == ('g',)
\ No newline at end of file
+    assert x == ('g',)
+
+
+def test_enrichment_pvalues():
+    from scipy.stats import poisson
+    from src.pvalue_cache import PValueCache
+    import numpy as np
+    x = np.array([1, 3, 3, 10, 1])
+    n = np.array([5, 40, 40, 12, 5])
+    sfcache = PValueCache()
+    sfcache.store('poisson', 50, 1000, np.array([1]), np.array([5]), np.array([0.5]), np.log([0.5]))
+    pvalues = gc.enrichment_pvalues(x, n, 50, 1000, sfcache)
+    # The cached value is used as is, the others are computed and cached
+    assert pvalues[0] == pvalues[4] == 0.5
+    for i in (1, 2, 3):
+        assert pvalues[i] == poisson.sf(x[i] - 1, n[i] * 50 / 1000)
+    assert sfcache.lookup('poisson', 50, 1000, np.array([3]), np.array([40]))[0] == pvalues[1]
+    assert sfcache.stats()['entries'] == 3
+    assert len(gc.enrichment_pvalues(np.zeros(0, dtype=int), np.zeros(0, dtype=int), 50, 1000)) == 0
+
+
+def test_batched_scoring_matches_per_link():
+    from tests.benchmark_enrichment import SEMANTIC_TYPE, scalar_enriched_links, synthetic_mcq
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(200, 2000)
+    expected = scalar_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, {}, typecache, total_node_counts)
+    results = gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache, total_node_counts,
+                                    [], 'exclude')
+    assert len(results) > 0
+    assert [(e.enriched_node.new_curie, e.predicate, e.is_source, e.counts, e.linked_curies) for e in results] == \
+           [(e.enriched_node.new_curie, e.predicate, e.is_source, e.counts, e.linked_curies) for e in expected]
+    assert [e.p_value for e in results] == [e.p_value for e in expected]
+
+
+@pytest.mark.parametrize("scoring_engine", ["binom", "hypergeom"])
+def test_batched_scoring_engines(scoring_engine):
+    from tests.benchmark_enrichment import SEMANTIC_TYPE, synthetic_mcq
+    from scipy.stats import binom, hypergeom
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(200, 2000)
+    total = total_node_counts[SEMANTIC_TYPE]
+    results = gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache, total_node_counts,
+                                    [], 'exclude', scoring_engine=scoring_engine)
+    assert len(results) > 0
+    for e in results[:200]:
+        x, (ndraws, n, _) = len(e.linked_curies), e.counts
+        if scoring_engine == "binom":
+            expected = binom.sf(x - 1, ndraws, n / total)
+        else:
+            expected = hypergeom.sf(x - 1, total, n, ndraws)
+        assert e.p_value == pytest.approx(expected, rel=1e-15)
+
+
+@pytest.mark.parametrize("filter_predicate_hierarchies", [False, True])
+def test_threshold_and_limit_pushdown(filter_predicate_hierarchies):
+    """Cutting inside get_enriched_links gives what cutting the per-link scoring's full output used to."""
+    from tests.benchmark_enrichment import SEMANTIC_TYPE, scalar_enriched_links, synthetic_mcq
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(300, 3000)
+
+    def key(enrichments):
+        return [(e.enriched_node.new_curie, e.predicate, e.is_source, e.p_value, e.counts) for e in enrichments]
+
+    everything = scalar_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, {}, typecache,
+                                       total_node_counts, filter_predicate_hierarchies)
+    threshold = everything[len(everything) // 2].p_value
+    for pvalue_threshold, max_results in [(None, None), (None, 10), (threshold, None), (threshold, 25), (1e-300, 5)]:
+        expected = everything
+        if pvalue_threshold:
+            expected = [e for e in expected if e.p_value < pvalue_threshold]
+        if max_results:
+            expected = expected[:max_results]
+        cut = gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache, total_node_counts,
+                                    [], 'exclude', filter_predicate_hierarchies, pvalue_threshold=pvalue_threshold,
+                                    max_results=max_results)
+        assert key(cut) == key(expected)
+
+
+@pytest.mark.parametrize("filter_predicate_hierarchies,predicate_constraints",
+                         [(False, []), (True, []), (True, ["biolink:treats", "biolink:affects"])])
+def test_sparse_engine_matches_dict(filter_predicate_hierarchies, predicate_constraints):
+    from tests.benchmark_enrichment import SEMANTIC_TYPE, synthetic_mcq
+    nodes, nodes_to_links, lcounts, typecache, total_node_counts = synthetic_mcq(300, 3000)
+    # A link listed twice for a node, and a node listed twice, still count once
+    nodes_to_links[nodes[0]].append(list(nodes_to_links[nodes[0]][0]))
+    nodes = nodes + [nodes[1]]
+
+    def key(enrichments):
+        return [(e.enriched_node.new_curie, e.predicate, e.is_source, e.counts, e.p_value, list(e.linked_curies))
+                for e in enrichments]
+
+    results = {}
+    for engine in gc.ENRICHMENT_ENGINES:
+        results[engine] = gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache,
+                                                total_node_counts, predicate_constraints, 'exclude',
+                                                filter_predicate_hierarchies, enrichment_engine=engine)
+    assert len(results['dict']) > 0
+    assert key(results['sparse']) == key(results['dict'])
+    with pytest.raises(ValueError):
+        gc.get_enriched_links(nodes, SEMANTIC_TYPE, nodes_to_links, lcounts, None, typecache, total_node_counts,
+                              enrichment_engine='frozenset')
+
+
+def test_same_column_groups():
+    import numpy as np
+    from scipy.sparse import csc_matrix
+    incidence = csc_matrix(np.array([[1, 0, 1, 1, 0],
+                                     [1, 1, 1, 0, 0],
+                                     [0, 1, 0, 1, 1]]))
+    groups = gc.same_column_groups(incidence.indptr, incidence.indices, np.diff(incidence.indptr))
+    assert groups.tolist() == [0, 1, 0, 3, 4]
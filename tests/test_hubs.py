@@ -0,0 +1,86 @@
+import asyncio
+from collections import Counter
+import pytest
+import src.graph_coalescence.graph_coalescer as gc
+from src.graph_coalescence.build_redis_files import write_degree_index
+from src.graph_coalescence.hubs import DegreeIndex, HubPolicy, HubPruning, create_hub_policy, prune_hub_links, \
+    set_hub_policy
+from tests.test_enrichment_pool import enrichment_key
+from tests.test_member_set_cache import SEMANTIC_TYPE, synthetic_store  # noqa: F401
+
+TREATS = '{"predicate": "biolink:treats"}'
+AFFECTS = '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+
+
+@pytest.fixture
+def hub_policy():
+    yield set_hub_policy
+    set_hub_policy(None)
+
+
+def test_degree_index_round_trip(tmp_path):
+    nodes_to_links = {"MONDO:1": [["NCBIGene:1", TREATS, False], ["NCBIGene:2", TREATS, False],
+                                  ["NCBIGene:2", AFFECTS, True]],
+                      "NCBIGene:1": [["MONDO:1", TREATS, True]]}
+    write_degree_index(nodes_to_links, tmp_path, min_degree=2)
+    index = DegreeIndex.from_file(tmp_path / 'degrees.txt')
+    assert len(index) == 1 and "NCBIGene:1" not in index
+    assert index.degree("MONDO:1") == 3
+    assert index.degree("MONDO:1", "biolink:treats") == 2
+    assert index.degree("MONDO:1", "biolink:affects") == 1
+    assert index.degree("MONDO:1", "biolink:interacts_with") == 0
+    assert index.degree("NCBIGene:1") == 0
+
+
+@pytest.mark.parametrize("kind,kept", [("none", [0, 1, 2, 3]), ("skip", [1]), ("cap", [1, 3])])
+def test_hub_policies(kind, kept):
+    index = DegreeIndex({"HUB:1": (500, {"biolink:treats": 500}), "HUB:2": (200, {"biolink:treats": 200}),
+                         "MONDO:1": (200, {"biolink:treats": 50, "biolink:affects": 150})})
+    # MONDO:1 is a hub for its affects links only
+    links = [["HUB:1", TREATS, True], ["MONDO:1", TREATS, True], ["HUB:2", TREATS, True], ["MONDO:1", AFFECTS, True]]
+    pruning = HubPruning()
+    pruned = prune_hub_links({"NCBIGene:1": links, "NCBIGene:2": links[1:2]}, index, HubPolicy(kind, 100, 1), pruning)
+    assert pruned["NCBIGene:1"] == [links[i] for i in kept]
+    assert pruned["NCBIGene:2"] == links[1:2]
+    assert pruning.links == ({} if kind == "none" else {"NCBIGene:1": 4 - len(kept)})
+
+
+def test_sampling_is_repeatable():
+    index = DegreeIndex({f"HUB:{i}": (1000, {"biolink:treats": 1000}) for i in range(20)})
+    nodes_to_links = {f"NCBIGene:{i}": [[f"HUB:{j}", TREATS, True] for j in range(20)] for i in range(3)}
+    policy = HubPolicy("sample", 100, 5)
+    sampled = prune_hub_links(nodes_to_links, index, policy)
+    assert all(len(links) == 5 for links in sampled.values())
+    assert sampled == prune_hub_links(nodes_to_links, index, policy)
+    assert len({tuple(map(tuple, links)) for links in sampled.values()}) > 1
+
+
+def test_create_hub_policy():
+    assert not create_hub_policy({}).active
+    policy = create_hub_policy({"hub_policy": "cap", "hub_degree_threshold": 50, "hub_max_links": 3})
+    assert (policy.kind, policy.degree_threshold, policy.max_links) == ("cap", 50, 3)
+    with pytest.raises(ValueError):
+        create_hub_policy({"hub_policy": "drop"})
+
+
+@pytest.mark.parametrize("incremental", [False, True])
+def test_coalesce_skips_hubs(synthetic_store, hub_policy, incremental):
+    nodes, store = synthetic_store
+    members = nodes[:200]
+    linked = Counter(link[0] for node in members for link in store.nodes_to_links[node])
+    hubs = [node for node, _ in linked.most_common(10)]
+    store.degrees = DegreeIndex({hub: (50000, {bare: 50000 for bare in ("biolink:treats", "biolink:affects",
+                                                                         "biolink:interacts_with",
+                                                                         "biolink:genetically_associated_with")})
+                                 for hub in hubs})
+    expected = asyncio.run(gc.coalesce_by_graph(members, SEMANTIC_TYPE))
+    assert any(e.enriched_node.new_curie in hubs for e in expected)
+
+    hub_policy(HubPolicy("skip", 10000))
+    for _ in range(2):
+        pruning = HubPruning()
+        enrichments = asyncio.run(gc.coalesce_by_graph(members, SEMANTIC_TYPE, incremental=incremental,
+                                                       hub_pruning=pruning))
+        assert enrichment_key(enrichments) == enrichment_key([e for e in expected
+                                                              if e.enriched_node.new_curie not in hubs])
+        assert pruning.total == sum(linked[hub] for hub in hubs)
@@ -0,0 +1,56 @@
+import pytest
+import src.graph_coalescence.link_cache as lc
+
+
+def test_get_many_counts_hits_and_misses():
+    cache = lc.LinkCache(max_bytes=10000)
+    cache.put("A", [["B", "{}", True]], 100)
+    found, missing = cache.get_many(["A", "C"])
+    assert found == {"A": [["B", "{}", True]]}
+    assert missing == ["C"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+    assert stats["bytes"] == 100 + lc.ENTRY_OVERHEAD
+
+
+def test_lru_eviction_under_byte_budget():
+    cache = lc.LinkCache(max_bytes=3 * (100 + lc.ENTRY_OVERHEAD))
+    for curie in "ABC":
+        cache.put(curie, [], 100)
+    # touch A so that B is the least recently used
+    cache.get_many(["A"])
+    cache.put("D", [], 100)
+    found, missing = cache.get_many(["A", "B", "C", "D"])
+    assert missing == ["B"]
+    assert cache.stats()["evictions"] == 1
+    # Something bigger than the whole budget is never cached
+    cache.put("E", [], 10 ** 6)
+    assert cache.get_many(["E"])[1] == ["E"]
+
+
+def test_lfu_keeps_frequently_used_entries():
+    cache = lc.LinkCache(max_bytes=3 * (100 + lc.ENTRY_OVERHEAD), policy="lfu")
+    cache.put("hub", [], 100)
+    for _ in range(5):
+        cache.get_many(["hub"])
+    cache.put("A", [], 100)
+    cache.put("B", [], 100)
+    # hub is the oldest entry, but it is used the most, so A goes instead
+    cache.put("C", [], 100)
+    assert cache.get_many(["hub", "A"])[1] == ["A"]
+    with pytest.raises(ValueError):
+        lc.LinkCache(policy="fifo")
+
+
+def test_new_kg_version_invalidates():
+    cache = lc.LinkCache(max_bytes=10000, version_check_seconds=1000)
+    assert cache.version_check_due()
+    cache.set_version(b"v1")
+    assert not cache.version_check_due()
+    cache.put("A", [], 10)
+    cache.set_version(b"v1")
+    assert cache.get_many(["A"])[1] == []
+    cache.set_version(b"v2")
+    assert cache.get_many(["A"])[1] == ["A"]
+    assert cache.stats()["invalidations"] == 1
+    assert cache.stats()["kg_version"] == "v2"
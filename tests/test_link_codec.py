@@ -0,0 +1,119 @@
+import io
+import os
+import pytest
+import src.graph_coalescence.link_codec as lc
+from src.graph_coalescence import graph_data
+from src.graph_coalescence.build_redis_files import write_binary_links, write_link_partitions
+from src.graph_coalescence.redis_pool import get_redis_registry
+
+PREDICATES = ['{"predicate": "biolink:treats"}',
+              '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}']
+
+
+def make_nodes_to_links(nnodes=300):
+    nodes = [f"NCBIGene:{i}" for i in range(nnodes)]
+    return {node: [[nodes[(i * j) % nnodes], PREDICATES[j % 2], j % 3 == 0] for j in range(i)]
+            for i, node in enumerate(nodes)}
+
+
+def test_varints():
+    out = bytearray()
+    values = [0, 1, 127, 128, 300, 2 ** 32, 2 ** 60]
+    for v in values:
+        lc.encode_varint(v, out)
+    assert lc.decode_varints_python(bytes(out)) == values
+    assert lc.decode_varints(bytes(out)).tolist() == values
+    with pytest.raises(ValueError):
+        lc.decode_varints(bytes(out) + b'\x80')
+    with pytest.raises(ValueError):
+        lc.decode_varints_python(bytes(out) + b'\x80')
+
+
+def test_round_trip_small_and_large():
+    nodes_to_links = make_nodes_to_links()
+    node_ids = {node: i for i, node in enumerate(nodes_to_links)}
+    predicate_ids = {p: i for i, p in enumerate(PREDICATES)}
+    dict_id = lc.dictionary_id(node_ids, predicate_ids)
+    dictionary = lc.LinkDictionary.from_lists(dict_id, list(node_ids), PREDICATES)
+    sizes = set()
+    for links in nodes_to_links.values():
+        value = lc.encode_links(links, node_ids, predicate_ids, dict_id)
+        assert lc.is_encoded(value)
+        sizes.add(len(value) > lc.NUMPY_MIN_BYTES)
+        assert lc.decode_links(value, lambda i: dictionary) == links
+    # Both the python and the numpy decoders were used
+    assert sizes == {True, False}
+    bad_version = lc.MAGIC + bytes([lc.FORMAT_VERSION + 1]) + value[3:]
+    with pytest.raises(ValueError):
+        lc.decode_links(bad_version, lambda i: dictionary)
+
+
+def load_link_dictionaries(datadir):
+    """Put the link dictionaries that write_binary_links wrote in redis; returns their keys."""
+    with open(os.path.join(datadir, 'linkdict_id.txt')) as inf:
+        dict_id = int(inf.read())
+    client = get_redis_registry().get_client(lc.DICTIONARY_DB)
+    keys = lc.dictionary_keys(dict_id)
+    for key, name in zip(keys, ('nodes', 'predicates')):
+        with open(os.path.join(datadir, f'linkdict_{name}.txt'), 'rb') as inf:
+            client.set(key, inf.read().rstrip(b'\n'))
+    return keys
+
+
+def test_build_files_and_redis_decode(tmp_path):
+    nodes_to_links = make_nodes_to_links(50)
+    write_binary_links(nodes_to_links, tmp_path)
+    client = get_redis_registry().get_client(lc.DICTIONARY_DB)
+    nodes_key, predicates_key = load_link_dictionaries(tmp_path)
+    try:
+        with open(os.path.join(tmp_path, 'links.bin'), 'rb') as inf:
+            records = list(lc.read_records(inf))
+        assert [node for node, _ in records] == list(nodes_to_links)
+        for node, value in records:
+            assert graph_data.decode_links(value) == nodes_to_links[node]
+        # json values still decode
+        assert graph_data.decode_links(b'[["A", "{}", true]]') == [["A", "{}", True]]
+    finally:
+        client.delete(nodes_key, predicates_key)
+
+
+def test_partition_positions():
+    positions = [0, 3, 4, 200, 100000]
+    value = lc.encode_partition(positions, lc.HEADER + b'links')
+    assert lc.is_encoded_partition(value) and not lc.is_encoded(value)
+    assert lc.decode_partition(value) == (positions, lc.HEADER + b'links')
+    assert lc.decode_partition(lc.encode_partition([], b'[]')) == ([], b'[]')
+
+
+@pytest.mark.parametrize("binary", [True, False])
+def test_link_partitions_put_back_in_order(tmp_path, binary):
+    """The partitions of a node, in either format, merge back into its whole link list."""
+    nodes_to_links = make_nodes_to_links(50)
+    write_binary_links(nodes_to_links, tmp_path)
+    write_link_partitions(nodes_to_links, tmp_path, binary)
+    client = get_redis_registry().get_client(lc.DICTIONARY_DB)
+    keys = load_link_dictionaries(tmp_path)
+    try:
+        if binary:
+            with open(os.path.join(tmp_path, 'linkparts.bin'), 'rb') as inf:
+                records = list(lc.read_records(inf))
+        else:
+            with open(os.path.join(tmp_path, 'linkparts.txt'), 'rb') as inf:
+                records = [line.rstrip(b'\n').split(b'\t', 1) for line in inf]
+                records = [(key.decode('utf-8'), value) for key, value in records]
+        merged = {node: [None] * len(links) for node, links in nodes_to_links.items()}
+        for key, value in records:
+            positions, links = graph_data.decode_link_partition(value)
+            for position, link in zip(positions, links):
+                merged[key.split(' ')[0]][position] = link
+        assert merged == nodes_to_links
+    finally:
+        client.delete(*keys)
+
+
+def test_records():
+    buf = io.BytesIO()
+    lc.write_record(buf, "MONDO:1", b"\x00\t\n")
+    lc.write_record(buf, "HP:2", b"")
+    buf.seek(0)
+    assert list(lc.read_records(buf)) == [("MONDO:1", b"\x00\t\n"), ("HP:2", b"")]
@@ -0,0 +1,55 @@
+import pytest
+import src.graph_coalescence.graph_coalescer as gc
+from src.graph_coalescence.link_filter import LinkFilter
+from tests.benchmark_enrichment import PREDICATES, SEMANTIC_TYPE, synthetic_mcq
+
+HUMAN = {"species_context_qualifier": "NCBITaxon:9606"}
+
+
+@pytest.fixture(scope="module")
+def links_and_types():
+    nodes, nodes_to_links, _, typecache, _ = synthetic_mcq(200, 2000)
+    # Some context qualified links, some blocklisted and some chemical link nodes
+    human = '{"predicate": "biolink:treats", "species_context_qualifier": "NCBITaxon:9606"}'
+    for i, node in enumerate(nodes):
+        nodes_to_links[node] = nodes_to_links[node] + [[f"MONDO:{i}", human, False], ["MONDO:0000001", PREDICATES[1], True],
+                                                       [f"CHEBI:{i % 7}", PREDICATES[2], True]]
+    typecache.update({f"CHEBI:{i}": ["biolink:SmallMolecule", "biolink:ChemicalEntity", "biolink:NamedThing"]
+                      for i in range(7)})
+    typecache["MONDO:0000001"] = ["biolink:Disease", "biolink:NamedThing"]
+    return nodes_to_links, typecache
+
+
+@pytest.mark.parametrize("node_constraints,predicate_constraints,style,context,exclude_ids",
+                         [(["biolink:NamedThing"], [], "exclude", None, None),
+                          (["biolink:Disease"], [{"predicate": "biolink:treats"}], "include", None, {"MONDO:3"}),
+                          (["biolink:ChemicalEntity", "biolink:Disease"], [{"predicate": "biolink:treats"}],
+                           "exclude", HUMAN, None),
+                          (["biolink:Disease"], [{"predicate": "biolink:affects", "object_aspect_qualifier": "activity"},
+                                                 {"predicate": "biolink:treats"}], "include", HUMAN, {"MONDO:5"})])
+def test_passes_match_separate_filters(links_and_types, node_constraints, predicate_constraints, style, context,
+                                       exclude_ids):
+    """The two passes keep the links, and find the link nodes and unique links, that the filters one after another
+    do."""
+    nodes_to_links, typecache = links_and_types
+    expected = gc.filter_links_by_context(nodes_to_links, context)
+    if style == "include":
+        expected = gc.filter_links_by_predicate(expected, predicate_constraints, style)
+    if exclude_ids:
+        expected = {node: [link for link in links if link[0] not in exclude_ids] for node, links in expected.items()}
+    expected_link_nodes = gc.uniquify_links(gc.filter_links_by_node_type(expected, ["biolink:NamedThing"], typecache),
+                                            SEMANTIC_TYPE)[0]
+    expected = gc.filter_links_by_node_type(expected, node_constraints, typecache)
+
+    link_filter = LinkFilter(SEMANTIC_TYPE, node_constraints, predicate_constraints, style, context, exclude_ids)
+    first, link_nodes = link_filter.first_pass(nodes_to_links)
+    assert link_nodes == expected_link_nodes
+    second, unique_links = link_filter.second_pass(first, typecache)
+    assert second == expected
+    assert unique_links == gc.uniquify_links(expected, SEMANTIC_TYPE)[1]
+    drops = link_filter.drops
+    assert sum(drops.values()) == sum(map(len, nodes_to_links.values())) - sum(map(len, expected.values()))
+    assert drops['node_type'] == sum(map(len, first.values())) - sum(map(len, second.values()))
+    # The blocklisted links are treats links without a context
+    assert drops['blocklist'] == (0 if context else len(nodes_to_links))
+    assert (drops['excluded'] > 0) == bool(exclude_ids)
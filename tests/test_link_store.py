@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+import src.graph_coalescence.graph_coalescer as gc
+from src.graph_coalescence.csr_store import build_csr_store
+from src.graph_coalescence.link_store import CSRLinkStore, InMemoryLinkStore, create_link_store, set_link_store
+from tests.test_csr_store import AFFECTS, NODES, write_kg
+
+
+def test_memory_and_csr_stores_agree(tmp_path):
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    nodes_to_links, counts, provs = write_kg(datadir)
+    build_csr_store(datadir, tmp_path / 'store')
+    memory = InMemoryLinkStore.from_files(datadir, prefix='')
+    csr = CSRLinkStore.open(tmp_path / 'store')
+    nodes = list(NODES) + ["MONDO:missing"]
+    edges = list(provs) + ["MONDO:1 {} CHEBI:1"]
+    for store in (memory, csr):
+        assert store.links(nodes) == {**nodes_to_links, "MONDO:missing": []}
+        assert store.link_partitions({"CHEBI:1": ["biolink:affects"]}) == \
+            {"CHEBI:1": [link for link in nodes_to_links["CHEBI:1"] if link[1] == AFFECTS]}
+        assert store.link_counts(counts) == counts
+        assert asyncio.run(store.fetch_link_counts(counts)) == counts
+        assert store.provs(edges) == memory.provs(edges)
+        assert store.total_node_counts("biolink:Gene") == {"biolink:NamedThing": 4.0, "biolink:Gene": 2.0}
+        types, names = store.node_metadata(nodes)
+        assert {node: set(c) for node, c in types.items()} == {node: set(c) for node, (c, _) in NODES.items()}
+        assert names["MONDO:missing"] == ""
+    csr.store.close()
+
+
+def test_coalesce_without_redis(tmp_path):
+    """The whole graph enrichment runs against an in-memory store."""
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    write_kg(datadir)
+    set_link_store(InMemoryLinkStore.from_files(datadir, prefix=''))
+    try:
+        enrichments = asyncio.run(gc.coalesce_by_graph(["NCBIGene:1", "NCBIGene:2"], "biolink:Gene"))
+        assert "CHEBI:1" in {e.enriched_node.new_curie for e in enrichments}
+        assert all(e.enriched_node.newnode_name for e in enrichments)
+    finally:
+        set_link_store(None)
+
+
+def test_unknown_store():
+    with pytest.raises(ValueError):
+        create_link_store({"link_store": "sqlite"})
+
+
+def test_coalesce_excludes_ids(tmp_path):
+    datadir = tmp_path / 'data'
+    datadir.mkdir()
+    write_kg(datadir)
+    set_link_store(InMemoryLinkStore.from_files(datadir, prefix=''))
+    try:
+        everything = asyncio.run(gc.coalesce_by_graph(["NCBIGene:1", "NCBIGene:2"], "biolink:Gene"))
+        excluded = asyncio.run(gc.coalesce_by_graph(["NCBIGene:1", "NCBIGene:2"], "biolink:Gene",
+                                                    exclude_ids={"CHEBI:1"}))
+    finally:
+        set_link_store(None)
+    assert [e.enriched_node.new_curie for e in excluded] == \
+           [e.enriched_node.new_curie for e in everything if e.enriched_node.new_curie != "CHEBI:1"]
@@ -0,0 +1,114 @@
+import asyncio
+import pytest
+import src.graph_coalescence.graph_coalescer as gc
+import src.graph_coalescence.member_set_cache as member_set_cache
+from src.graph_coalescence.link_store import InMemoryLinkStore, set_link_store
+from src.graph_coalescence.member_set_cache import MemberSetCache, create_member_set_cache
+from tests.benchmark_enrichment import SEMANTIC_TYPE, TOTAL_NODE_COUNT, synthetic_mcq
+from tests.test_enrichment_pool import enrichment_key
+
+
+class CountingStore(InMemoryLinkStore):
+    """Remembers which nodes had their links fetched and which links had their counts fetched."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetched_nodes = []
+        self.fetched_counts = []
+
+    def links(self, nodes):
+        self.fetched_nodes.extend(nodes)
+        return super().links(nodes)
+
+    def link_partitions(self, node_to_predicates):
+        self.fetched_nodes.extend(node_to_predicates)
+        return super().link_partitions(node_to_predicates)
+
+    def link_counts(self, unique_links):
+        self.fetched_counts.extend(unique_links)
+        return super().link_counts(unique_links)
+
+
+@pytest.fixture
+def synthetic_store(monkeypatch):
+    nodes, nodes_to_links, lcounts, typecache, _ = synthetic_mcq(300, 3000)
+    store = CountingStore(nodes_to_links=nodes_to_links, node_types=typecache,
+                          node_names={node: node.lower() for node in typecache}, link_counts=lcounts,
+                          category_counts={"biolink:NamedThing": TOTAL_NODE_COUNT, SEMANTIC_TYPE: TOTAL_NODE_COUNT})
+    monkeypatch.setattr(member_set_cache, '_cache', MemberSetCache(max_states=4))
+    set_link_store(store)
+    yield nodes, store
+    set_link_store(None)
+
+
+def coalesce(nodes, incremental, **kwargs):
+    return asyncio.run(gc.coalesce_by_graph(nodes, SEMANTIC_TYPE, node_constraints=["biolink:Disease"],
+                                            incremental=incremental, **kwargs))
+
+
+@pytest.mark.parametrize("kwargs", [{"max_results": 100},
+                                    {"predicate_constraints": [{"predicate": "biolink:treats"}],
+                                     "predicate_constraint_style": "include", "pvalue_threshold": 1e-3}])
+def test_incremental_matches_full(synthetic_store, kwargs):
+    """Adding, dropping and swapping members of a kept set gives what enriching from scratch does."""
+    nodes, store = synthetic_store
+    member_sets = [nodes[:200], nodes[:210], nodes[5:210], nodes[:5] + nodes[10:215], nodes[5:210], nodes[250:]]
+    for members in member_sets:
+        expected = coalesce(members, False, **kwargs)
+        store.fetched_nodes.clear()
+        assert enrichment_key(coalesce(members, True, **kwargs)) == enrichment_key(expected)
+        assert expected
+    stats = member_set_cache.get_member_set_cache().stats()
+    assert (stats['misses'], stats['delta_hits'], stats['exact_hits']) == (2, 3, 1)
+
+
+def test_only_added_members_are_fetched(synthetic_store):
+    nodes, store = synthetic_store
+    coalesce(nodes[:200], True)
+    store.fetched_nodes.clear()
+    store.fetched_counts.clear()
+    coalesce(nodes[:190] + nodes[200:220], True)
+    assert store.fetched_nodes == nodes[200:220]
+    fetched_counts = len(store.fetched_counts)
+    # The same set again needs nothing fetched at all
+    coalesce(nodes[:190] + nodes[200:220], True)
+    assert store.fetched_nodes == nodes[200:220]
+    assert len(store.fetched_counts) == fetched_counts
+
+
+def test_repeated_members_are_not_incremental(synthetic_store):
+    nodes, store = synthetic_store
+    members = nodes[:50] + nodes[:10]
+    assert enrichment_key(coalesce(members, True)) == enrichment_key(coalesce(members, False))
+    assert member_set_cache.get_member_set_cache().stats()['states'] == 0
+
+
+def test_states_are_bounded():
+    cache = MemberSetCache(max_states=2, max_delta=0.5)
+    for i in range(3):
+        settings = ('biolink:Gene', i)
+        state = member_set_cache.MemberSetState({'NCBIGene:1': None}, cache.table(settings, 'biolink:Gene'), {})
+        cache.store(settings, state)
+    stats = cache.stats()
+    assert stats['states'] == 2
+    # The table of the evicted settings goes with its last state
+    assert cache.nearest(('biolink:Gene', 0), ['NCBIGene:1'])[0] is None
+    assert cache.nearest(('biolink:Gene', 2), ['NCBIGene:1'])[0] is state
+
+
+def test_oversized_table_is_not_reused():
+    cache = MemberSetCache(max_states=2, max_links=1)
+    settings = ('biolink:Gene', 0)
+    table = cache.table(settings, 'biolink:Gene')
+    state = member_set_cache.MemberSetState({'NCBIGene:1': None}, table, {})
+    cache.store(settings, state)
+    assert cache.nearest(settings, ['NCBIGene:1'])[0] is state
+    # Links numbered since the state was kept have taken the table past max_links
+    table.links.extend([('MONDO:1', 'biolink:treats', True), ('MONDO:2', 'biolink:treats', True)])
+    assert cache.nearest(settings, ['NCBIGene:1'])[0] is None
+    assert cache.table(settings, 'biolink:Gene') is not table
+
+
+def test_create_member_set_cache():
+    assert not create_member_set_cache({}).enabled
+    cache = create_member_set_cache({"mcq_incremental_states": 8, "mcq_incremental_max_delta": 0.25})
+    assert cache.enabled and cache.max_delta == 0.25
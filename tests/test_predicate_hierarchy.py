@@ -0,0 +1,80 @@
+import json
+import random
+import pytest
+from src.components import Enrichment
+from src.graph_coalescence.predicate_hierarchy import PredicateHierarchy, filter_result_hierarchies, iter_bits
+from tests.pairwise_hierarchy_filter import process_enrichment_group
+
+# Branches of the predicate hierarchy that enrichments turn up in, from related_to down
+BARE_PREDICATES = ["biolink:related_to", "biolink:related_to_at_instance_level", "biolink:associated_with",
+                   "biolink:correlated_with", "biolink:positively_correlated_with",
+                   "biolink:genetically_associated_with", "biolink:affects", "biolink:regulates",
+                   "biolink:has_adverse_event", "biolink:affects_response_to", "biolink:increases_response_to",
+                   "biolink:treats_or_applied_or_studied_to_treat", "biolink:treats", "biolink:ameliorates_condition",
+                   "biolink:contributes_to", "biolink:causes", "biolink:interacts_with",
+                   "biolink:physically_interacts_with", "biolink:directly_physically_interacts_with",
+                   "biolink:binds", "biolink:has_phenotype", "biolink:subclass_of"]
+ASPECTS = ["activity", "abundance", "activity_or_abundance", "expression", "secretion", "transport", "degradation",
+           "molecular_interaction"]
+DIRECTIONS = ["increased", "decreased", "upregulated", "downregulated"]
+
+
+def random_predicate(rng):
+    predicate = {"predicate": rng.choice(BARE_PREDICATES)}
+    if predicate["predicate"] in ("biolink:affects", "biolink:regulates") and rng.random() < 0.7:
+        if rng.random() < 0.8:
+            predicate["object_aspect_qualifier"] = rng.choice(ASPECTS)
+        if rng.random() < 0.5:
+            predicate["object_direction_qualifier"] = rng.choice(DIRECTIONS)
+    return json.dumps(predicate, sort_keys=True)
+
+
+def random_results(rng, node, size):
+    """size results for node, with some p-values shared, and some predicates repeated the other way round."""
+    results = []
+    pvalues = [rng.random() * 10 ** -rng.randint(1, 40) for _ in range(max(1, size // 2))]
+    for _ in range(size):
+        if results and rng.random() < 0.1:
+            predicate = rng.choice(results).predicate
+        else:
+            predicate = random_predicate(rng)
+        pvalue = rng.choice(pvalues) if rng.random() < 0.3 else rng.random() * 10 ** -rng.randint(1, 40)
+        results.append(Enrichment(pvalue, node, predicate, rng.random() < 0.5, 61, 5, 1366955.0, ["CHEBI:6888"],
+                                  "biolink:Gene"))
+    return results
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_matches_pairwise_filter(seed):
+    """The filter keeps the same results for each enriched node as the pairwise implementation it replaced."""
+    rng = random.Random(seed)
+    for i in range(200):
+        node = f"NCBIGene:{i}"
+        results = random_results(rng, node, rng.randint(2, 5 if i % 2 else 40))
+        expected = process_enrichment_group({node: results})
+        assert set(map(id, filter_result_hierarchies(results))) == set(map(id, expected)), results
+
+
+def test_keeps_order_across_nodes():
+    rng = random.Random(11)
+    results = [result for i in range(20) for result in random_results(rng, f"MONDO:{i}", rng.randint(1, 10))]
+    rng.shuffle(results)
+    kept = filter_result_hierarchies(results)
+    expected = set(map(id, process_enrichment_group({node: [r for r in results if r.enriched_node.new_curie == node]
+                                                     for node in {r.enriched_node.new_curie for r in results}})))
+    assert set(map(id, kept)) == expected
+    assert kept == [result for result in results if id(result) in expected]
+
+
+def test_hierarchy_masks():
+    predicates = ['{"predicate": "biolink:related_to"}', '{"predicate": "biolink:affects"}',
+                  '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}',
+                  '{"predicate": "biolink:regulates"}', '{"predicate": "biolink:interacts_with"}']
+    hierarchy = PredicateHierarchy(predicates)
+    assert list(iter_bits(hierarchy.same[1])) == [1, 2]
+    # regulates is an affects and an interacts_with
+    assert list(iter_bits(hierarchy.parents[3])) == [0, 1, 2, 4]
+    assert list(iter_bits(hierarchy.parents[4])) == [0]
+    assert list(iter_bits(hierarchy.children[4])) == [3]
+    # children are only the direct ones
+    assert hierarchy.parents[0] == hierarchy.children[0] == 0
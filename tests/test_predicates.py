@@ -0,0 +1,86 @@
+import orjson
+import pytest
+from src.graph_coalescence.predicates import PredicateMatcher, get_predicate_registry, get_toolkit
+import src.graph_coalescence.graph_coalescer as gc
+
+
+def test_interning_gives_stable_ids():
+    registry = get_predicate_registry()
+    qualified = '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}'
+    pid = registry.intern(qualified)
+    assert registry.intern(qualified) == pid
+    assert registry.intern('{"predicate": "biolink:treats"}') != pid
+    info = registry.by_id(pid)
+    assert info.string == qualified
+    assert info.bare == "biolink:affects"
+    assert info.qualifiers == {"object_aspect_qualifier": "activity"}
+
+
+def test_predicate_info_matches_bmt():
+    registry = get_predicate_registry()
+    tk = get_toolkit()
+    for bare in ["biolink:treats", "biolink:interacts_with", "biolink:related_to", "biolink:affects"]:
+        info = registry.info(orjson.dumps({"predicate": bare}).decode())
+        assert info.symmetric == (tk.get_element(bare)["symmetric"] is True)
+        assert list(info.ancestors) == (tk.get_ancestors(bare, formatted=True, reflexive=False) or [])
+        assert list(info.children) == (tk.get_children(bare, formatted=True) or [])
+    assert gc.predicate_string_is_symmetric('{"predicate": "biolink:interacts_with"}')
+    assert not gc.predicate_string_is_symmetric('{"predicate": "biolink:treats"}')
+
+
+def test_predicate_matches():
+    link = '{"predicate": "biolink:affects", "species_context_qualifier": "NCBITaxon:9606"}'
+    assert gc.predicate_matches('{"predicate": "biolink:affects"}', link)
+    assert gc.predicate_matches(link, link)
+    assert not gc.predicate_matches('{"predicate": "biolink:treats"}', link)
+    assert not gc.predicate_matches(link, '{"predicate": "biolink:affects"}')
+
+
+def test_bad_predicate_strings():
+    registry = get_predicate_registry()
+    with pytest.raises(ValueError):
+        registry.info("not json")
+    with pytest.raises(ValueError):
+        registry.info("[1, 2]")
+    # The filters skip links whose predicate can't be read
+    nodes_to_links = {"A": [["B", "not json", True], ["C", '{"predicate": "biolink:treats"}', True]]}
+    filtered = gc.filter_links_by_predicate(nodes_to_links, [{"predicate": "biolink:treats"}], "include")
+    assert filtered == {"A": [["C", '{"predicate": "biolink:treats"}', True]]}
+
+
+def test_predicate_matcher_matches_constraint_by_constraint():
+    """A compiled matcher keeps the links that checking each constraint against each link would."""
+    predicates = ['{"predicate": "biolink:affects"}',
+                  '{"object_aspect_qualifier": "activity", "predicate": "biolink:affects"}',
+                  '{"predicate": "biolink:affects", "species_context_qualifier": "NCBITaxon:9606"}',
+                  '{"predicate": "biolink:treats", "species_context_qualifier": "NCBITaxon:10090"}',
+                  '{"predicate": "biolink:treats"}', "not json"]
+    links = [[f"X:{i}", predicate, bool(i % 2)] for i, predicate in enumerate(predicates * 3)]
+    constraints = [{"predicate": "biolink:affects", "object_aspect_qualifier": "activity"},
+                   {"predicate": "biolink:treats"}]
+    registry = get_predicate_registry()
+
+    def parsed(predicate):
+        try:
+            return registry.info(predicate).parsed
+        except ValueError:
+            return None
+
+    for match_type in ("exact", "partial"):
+        for context in ({}, {"species_context_qualifier": "NCBITaxon:9606"}):
+            def meets(predicate):
+                p = parsed(predicate)
+                if p is None or any(p.get(k) != v for k, v in context.items()):
+                    return False
+                if match_type == "partial":
+                    return any(p.get("predicate") == c["predicate"] for c in constraints)
+                return any(all(p.get(k) == v for k, v in c.items()) for c in constraints)
+
+            matcher = PredicateMatcher(constraints, match_type, context)
+            assert matcher.filter(links) == [link for link in links if meets(link[1])]
+            assert matcher.filter(links, keep=False) == [link for link in links if not meets(link[1])]
+    human = {"species_context_qualifier": "NCBITaxon:9606"}
+    assert PredicateMatcher(context_qualifiers=human).filter(links) == \
+        [link for link in links if (parsed(link[1]) or {}).get("species_context_qualifier") == "NCBITaxon:9606"]
+    with pytest.raises(ValueError):
+        PredicateMatcher(constraints, "fuzzy")
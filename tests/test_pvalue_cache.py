@@ -0,0 +1,98 @@
+import os
+import numpy as np
+import pytest
+from src.enrichment_stats import sf_and_log_sf
+from src.pvalue_cache import PValueCache, SharedPValueCache, cached_sf_and_log_sf, create_pvalue_cache
+
+
+@pytest.fixture
+def shared_cache():
+    name = f'ac_test_pvalues_{os.getpid()}'
+    cache = SharedPValueCache(name, 64)
+    yield cache
+    cache.close(unlink=True)
+
+
+def test_lru_eviction():
+    cache = PValueCache(max_entries=2)
+    cache.store('poisson', 10, 100, np.array([1, 2]), np.array([5, 5]), np.array([0.3, 0.1]), np.array([-1.0, -2.0]))
+    # Using (1, 5) makes (2, 5) the least recently used
+    p, logp = cache.lookup('poisson', 10, 100, np.array([1]), np.array([5]))
+    assert (p.tolist(), logp.tolist()) == ([0.3], [-1.0])
+    cache.store('poisson', 10, 100, np.array([3]), np.array([5]), np.array([0.05]), np.array([-3.0]))
+    p, logp = cache.lookup('poisson', 10, 100, np.array([1, 2, 3]), np.array([5, 5, 5]))
+    assert logp[0] == -1.0 and np.isnan(logp[1]) and logp[2] == -3.0
+    assert p[0] == 0.3 and np.isnan(p[1]) and p[2] == 0.05
+    # The engine and the draw counts are part of the key
+    assert np.isnan(cache.lookup('binom', 10, 100, np.array([1]), np.array([5]))[1]).all()
+    assert np.isnan(cache.lookup('poisson', 11, 100, np.array([1]), np.array([5]))[1]).all()
+    stats = cache.stats()
+    assert (stats['entries'], stats['hits'], stats['misses'], stats['evictions']) == (2, 3, 3, 1)
+    assert stats['hit_rate'] == 0.5
+
+
+def same(found, expected):
+    return all(f.tolist() == e.tolist() for f, e in zip(found, expected))
+
+
+def test_cached_sf_and_log_sf_scores_only_misses():
+    cache = PValueCache()
+    x = np.array([3, 4, 3, 9])
+    n = np.array([50, 50, 50, 20])
+    expected = sf_and_log_sf(x, n, 40, 10000, 'hypergeom')
+    assert same(cached_sf_and_log_sf(x, n, 40, 10000, 'hypergeom', cache), expected)
+    # Each distinct pair is looked up once
+    assert (cache.hits, cache.misses) == (0, 3)
+    assert same(cached_sf_and_log_sf(x[::-1], n[::-1], 40, 10000, 'hypergeom', cache),
+                [values[::-1] for values in expected])
+    assert (cache.hits, cache.misses) == (3, 3)
+    assert same(cached_sf_and_log_sf(x, n, 40, 10000, 'hypergeom', None), expected)
+    assert same(cached_sf_and_log_sf(x, n, 40, 10000, 'hypergeom', PValueCache(0)), expected)
+
+
+def test_shared_cache(shared_cache):
+    x = np.arange(1, 200)
+    n = np.full(len(x), 300)
+    expected_p, expected = sf_and_log_sf(x, n, 200, 100000)
+    assert same(cached_sf_and_log_sf(x, n, 200, 100000, 'poisson', shared_cache), (expected_p, expected))
+    # 199 pairs don't fit in 64 slots; the ones that are still there came back exactly as stored
+    stats = shared_cache.stats()
+    assert stats['entries'] == stats['max_entries'] == 64
+    assert stats['evictions'] == 199 - 64
+    found_p, found = shared_cache.lookup('poisson', 200, 100000, x, n)
+    kept = ~np.isnan(found)
+    assert kept.sum() == 64
+    assert found[kept].tolist() == expected[kept].tolist()
+    assert found_p[kept].tolist() == expected_p[kept].tolist()
+
+    # Another process attaching the same segment sees the same entries
+    other = SharedPValueCache(shared_cache.name, 64)
+    try:
+        assert other.lookup('poisson', 200, 100000, x, n)[1][kept].tolist() == expected[kept].tolist()
+        with pytest.raises(ValueError):
+            SharedPValueCache(shared_cache.name, 1024)
+    finally:
+        other.close()
+
+    # A slot with a bad checksum, e.g. half written by another process, is a miss
+    shared_cache._table['p'][shared_cache._table['check'] != 0] += 1
+    assert np.isnan(shared_cache.lookup('poisson', 200, 100000, x, n)[1]).all()
+    shared_cache.clear()
+    assert shared_cache.stats()['entries'] == 0
+
+
+def test_shared_cache_other_layout(shared_cache):
+    shared_cache._header[0] = 0x61637076616c7565
+    with pytest.raises(ValueError):
+        SharedPValueCache(shared_cache.name, 64)
+
+
+def test_create_pvalue_cache():
+    assert isinstance(create_pvalue_cache({}), PValueCache)
+    assert not create_pvalue_cache({'pvalue_cache_max_entries': 0}).enabled
+    name = f'ac_test_pvalues_conf_{os.getpid()}'
+    cache = create_pvalue_cache({'pvalue_cache_shared_name': name, 'pvalue_cache_max_entries': 100})
+    try:
+        assert isinstance(cache, SharedPValueCache) and cache.max_entries == 128
+    finally:
+        cache.close(unlink=True)
@@ -0,0 +1,103 @@
+import asyncio
+import pytest
+import src.graph_coalescence.redis_pool as rp
+
+
+def make_registry(**overrides):
+    conf = {"redis_host": "localhost", "redis_port": 6379, "redis_password": ""}
+    conf.update(overrides)
+    return rp.RedisPoolRegistry(conf)
+
+
+def test_config_is_loaded_once(monkeypatch):
+    rp.reset_redis_registry()
+    calls = []
+    real_open = open
+
+    def counting_open(path, *args, **kwargs):
+        if path == rp.CONFIG_PATH:
+            calls.append(path)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", counting_open)
+    for _ in range(5):
+        rp.load_config()
+        rp.get_redis_registry()
+    assert len(calls) == 1
+    rp.reset_redis_registry()
+
+
+def test_one_pool_per_logical_db():
+    """Pools and clients are created lazily (no connection is made) and then reused."""
+    registry = make_registry(redis_max_connections=4, redis_health_check_interval=5)
+    for dbnum in rp.LOGICAL_DBS:
+        pool = registry.get_pool(dbnum)
+        assert registry.get_pool(dbnum) is pool
+        assert registry.get_client(dbnum).connection_pool is pool
+        assert pool.max_connections == 4
+        assert pool.connection_kwargs["db"] == dbnum
+        assert pool.connection_kwargs["health_check_interval"] == 5
+    assert len({id(registry.get_pool(dbnum)) for dbnum in rp.LOGICAL_DBS}) == len(rp.LOGICAL_DBS)
+    assert "password" not in registry.get_pool(0).connection_kwargs
+
+
+def test_pool_stats_count_pipelines():
+    registry = make_registry()
+    registry.pipeline(2)
+    registry.pipeline(2)
+    stats = registry.stats()
+    assert list(stats.keys()) == [2]
+    assert stats[2]["pipelines"] == 2
+    assert stats[2]["in_use"] == 0
+    assert stats[2]["created_connections"] == 0
+
+
+def test_pool_is_bounded():
+    registry = make_registry(redis_max_connections=1, redis_pool_timeout=0.01)
+    pool = registry.get_pool(0)
+    pool.make_connection = lambda: type("FakeConnection", (), {"connect": lambda self: None,
+                                                               "can_read": lambda self: False,
+                                                               "pid": pool.pid})()
+    connection = pool.get_connection("GET")
+    with pytest.raises(rp.redis.exceptions.ConnectionError):
+        pool.get_connection("GET")
+    assert pool.usage()["exhausted"] == 1
+    assert pool.usage()["peak_in_use"] == 1
+    pool.release(connection)
+    assert pool.usage()["in_use"] == 0
+
+
+def connected(client):
+    pool = client.connection_pool
+    return [c for c in pool._available_connections + list(pool._in_use_connections) if c.is_connected]
+
+
+def test_aclose_closes_async_clients():
+    registry = make_registry()
+
+    async def use_and_close():
+        client = registry.get_async_client(0)
+        await client.ping()
+        assert connected(client)
+        await registry.aclose()
+        return client
+
+    client = asyncio.run(use_and_close())
+    assert not connected(client)
+
+
+def test_close_closes_async_clients_on_their_loop():
+    registry = make_registry()
+    loop = asyncio.new_event_loop()
+    try:
+        async def use():
+            client = registry.get_async_client(0)
+            await client.ping()
+            return client
+
+        client = loop.run_until_complete(use())
+        assert connected(client)
+        registry.close()
+        assert not connected(client)
+    finally:
+        loop.close()